@@ -3,16 +3,33 @@
 
 import asyncio
 import re
+import sys
+import heapq
+import time
+import io
 import os
+import glob
+import shutil
+import struct
 import zipfile
 import xlrd
 import csv
 import argparse
 import logging
+import functools
+import threading
+import collections
+import concurrent.futures
+from contextlib import asynccontextmanager
 import aiohttp
-from aiohttp_socks import ProxyConnector
+from aiohttp_socks import ProxyConnector, ProxyError, ProxyConnectionError, ProxyTimeoutError
 from tqdm import tqdm
 
+from crawl_journal import Journal
+from grade_manifest import Manifest, sheet_digest
+from crawl_metrics import CrawlMetrics
+from sheet_parser import XLS_MAGIC
+
 logging.basicConfig(level=logging.WARNING, format='%(asctime)s [%(levelname)s] %(message)s')
 logger = logging.getLogger(__name__)
 
@@ -24,110 +41,1254 @@ except ImportError:
     PROXY = 'socks5://127.0.0.1:10801'
     USE_PROXY = True  # 通过服务器代理访问
 
+# 多出口代理列表，未配置时只用 PROXY
+try:
+    from config import PROXIES
+except ImportError:
+    PROXIES = [PROXY]
+
 DEFAULT_WORKERS = 150
 TIMEOUT = aiohttp.ClientTimeout(sock_connect=10, sock_read=30)
 RETRIES = 6
 RETRY_STATUSES = {429, 502, 503, 504}
+# 一次请求在网络层失败（SOCKS 代理连不上、握手超时的异常不是 aiohttp.ClientError 的子类）
+NETWORK_ERRORS = (aiohttp.ClientError, asyncio.TimeoutError, ProxyError, ProxyConnectionError, ProxyTimeoutError)
+MANIFEST_SAVE_EVERY = 1000
 
 # 预编译正则表达式
 RE_CACHED = re.compile(r'report1_cachedId\s*=\s*"([^"]+)"')
 RE_PARAMS = re.compile(r'name=reportParamsId\s*value=([^>\s]+)')
 RE_TIME = re.compile(r't_i_m_e=(\d+)')
 
-async def download_and_convert(session, student_id, csv_dir, semaphore):
-    csv_path = os.path.join(csv_dir, f"{student_id}.csv")
-    temp_path = f"{csv_path}.tmp"
+def xls_to_csv_bytes(content):
+    """XLS 二进制 → CSV 字节（utf-8-sig，与原先落盘格式一致）"""
+    workbook = xlrd.open_workbook(file_contents=content)
+    sheet = workbook.sheet_by_index(0)
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    for row_idx in range(sheet.nrows):
+        writer.writerow(sheet.row_values(row_idx))
+    return buf.getvalue().encode('utf-8-sig')
 
-    # 如果文件已存在，跳过
-    if os.path.exists(csv_path):
-        return "skipped"
 
-    async with semaphore:
-        try:
-            for attempt in range(RETRIES):
-                try:
-                    # 第一步：获取报表参数
-                    async with session.post(
-                        f"{BASE_URL}/reportJsp/showReport.jsp?rpx=/148656-XSCJDXSD.rpx",
-                        data={'selShowType': 'all', 'kclx': '0', 'xsxh': student_id},
-                    ) as r:
-                        if r.status in RETRY_STATUSES and attempt < RETRIES - 1:
-                            await asyncio.sleep(0.3 * (2 ** attempt))
-                            continue
-                        r.raise_for_status()
-                        text = await r.text()
-
-                    # 使用预编译的正则表达式
-                    matches = [RE_CACHED.search(text), RE_PARAMS.search(text), RE_TIME.search(text)]
-                    if not all(matches):
-                        return False
-
-                    # 第二步：下载Excel
-                    async with session.get(f'{BASE_URL}/reportServlet', params={
-                        'action': '3', 'file': '/148656-XSCJDXSD.rpx', 'columns': '0', 'srcType': 'file',
-                        'cachedId': matches[0].group(1), 'reportParamsId': matches[1].group(1),
-                        't_i_m_e': matches[2].group(1), 'excelFormat': '2003', 'width': '0', 'height': '0',
-                        'pageStyle': '0', 'formula': '0', 'tips': 'yes'
-                    }) as x:
-                        if x.status in RETRY_STATUSES and attempt < RETRIES - 1:
-                            await asyncio.sleep(0.3 * (2 ** attempt))
-                            continue
-                        x.raise_for_status()
-                        content = await x.read()
-
-                    # 转换为CSV，直接写入临时文件以减少内存占用
-                    workbook = xlrd.open_workbook(file_contents=content)
-                    sheet = workbook.sheet_by_index(0)
-                    with open(temp_path, 'w', encoding='utf-8-sig', newline='') as f:
-                        writer = csv.writer(f)
-                        for row_idx in range(sheet.nrows):
-                            writer.writerow(sheet.row_values(row_idx))
-
-                    os.replace(temp_path, csv_path)
-                    return True
-
-                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
-                    if attempt < RETRIES - 1:
-                        await asyncio.sleep(0.3 * (2 ** attempt))
-                        continue
-                    logger.warning("下载失败 [%s]: %s", student_id, e)
-                    return False
+def convert_sheet(content):
+    """转换阶段的单个任务：返回 (CSV 字节, 规范化内容哈希)"""
+    data = xls_to_csv_bytes(content)
+    return data, sheet_digest(data)
 
-            return False
-        except Exception as e:
-            logger.warning("下载失败 [%s]: %s", student_id, e)
-            return False
+
+class DirSink:
+    """
+    每个学号写一个 results_csv/<学号>.csv（原有模式，结束后再统一打包）。
+    各输出端在数据落盘（或入库提交）后以 ([(学号, 大小, 哈希), ...], 段号) 调用 on_commit，任务日志据此标记完成；
+    confirmed_epoch() 返回输出端能确认完整的最后一个段号，续传时只核对其后的完成记录（逐个落盘的输出端恒为 0）。
+    raw_xls 为真的输出端（直接入库）接收原始 XLS，自行解析，下载端不做转换。
+    """
+
+    raw_xls = False
+
+    def __init__(self, csv_dir):
+        self.csv_dir = csv_dir
+        self.on_commit = None
+        self.error = None
+        os.makedirs(csv_dir, exist_ok=True)
+
+    def has(self, student_id):
+        return os.path.exists(os.path.join(self.csv_dir, f"{student_id}.csv"))
+
+    def finished(self):
+        return {f[:-4] for f in os.listdir(self.csv_dir) if f.endswith('.csv') and not f.startswith('.')}
+
+    def confirmed_epoch(self):
+        return 0
+
+    def epoch_of(self, student_id):
+        return 0
+
+    def iter_sheets(self, student_ids):
+        """读取已落盘的成绩单，产出 (学号, CSV 字节)"""
+        for sid in student_ids:
+            with open(os.path.join(self.csv_dir, f"{sid}.csv"), 'rb') as f:
+                yield sid, f.read()
+
+    async def start(self):
+        pass
+
+    async def put(self, student_id, data, digest=None):
+        csv_path = os.path.join(self.csv_dir, f"{student_id}.csv")
+        temp_path = f"{csv_path}.tmp"
+        try:
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, csv_path)
         finally:
             if os.path.exists(temp_path):
                 try:
                     os.remove(temp_path)
                 except OSError:
                     pass
+        if self.on_commit:
+            self.on_commit([(student_id, len(data), digest)])
 
-async def batch_download(ids, csv_dir, use_proxy, workers, desc="进度", total=None, initial=0):
-    """异步并发下载一批学号，返回 (成功数, 失败数)。"""
-    if use_proxy:
-        connector = ProxyConnector.from_url(PROXY, limit=workers, limit_per_host=workers)
-    else:
-        connector = aiohttp.TCPConnector(limit=workers, limit_per_host=workers)
+    async def close(self):
+        pass
+
+
+class ZipSink:
+    """
+    流式写入 ZIP：下载完成的 CSV 经队列交给唯一的写入任务，边下载边压缩，不落中间目录。
+    shard_size > 0 时按条数滚动分片（xxx.part0001.zip ...）；否则每 checkpoint 条写成一个段（xxx.seg0001.zip ...），
+    结束时经临时文件合并进目标 ZIP 再 os.replace。已关闭的分片/段不会再被改写，中断后以其中央目录续传，
+    最多丢失正在写的一段（损坏的文件改名为 .bad）；on_commit 在分片/段关闭后才报告其中的学号。
+    分片/段的序号即提交段号（epoch），目标 ZIP 的注释记录已合并到的段号，之后的段接着编号。
+    """
+
+    raw_xls = False
+
+    def __init__(self, zip_name, shard_size=0, checkpoint=1000, queue_size=1000):
+        self.zip_name = zip_name
+        self.shard_size = shard_size
+        self.checkpoint = checkpoint
+        self.queue_size = queue_size
+        self._done = {}   # 学号 -> 所在段号（本次运行写入的为 None）
+        self._zf = None
+        self._count = 0
+        self._next_shard = 1
+        self._epoch = 0
+        self._merged_epoch = 0
+        self._confirmed = 0
+        self._queue = None
+        self._task = None
+        self.error = None
+        self._unclosed = []
+        self.on_commit = None
+        # 单线程执行器：保证写入顺序，同时把 deflate 挪出事件循环（zlib 会释放 GIL）
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self._scan()
+
+    def _part_path(self, index):
+        stem, ext = os.path.splitext(self.zip_name)
+        return f"{stem}.{'part' if self.shard_size else 'seg'}{index:04d}{ext or '.zip'}"
+
+    def _part_paths(self):
+        stem, ext = os.path.splitext(self.zip_name)
+        kind = 'part' if self.shard_size else 'seg'
+        return sorted(glob.glob(f"{glob.escape(stem)}.{kind}[0-9][0-9][0-9][0-9]{ext or '.zip'}"))
+
+    def paths(self):
+        """当前已存在的输出 ZIP 列表（单文件模式下包括尚未合并的段）"""
+        if self.shard_size:
+            return self._part_paths()
+        return ([self.zip_name] if os.path.exists(self.zip_name) else []) + self._part_paths()
+
+    def _scan(self):
+        """读取已有 ZIP 的中央目录作为续传索引，损坏的 ZIP 改名为 .bad 后重新下载"""
+        present = set()
+        for path in self.paths():
+            try:
+                with zipfile.ZipFile(path, 'r') as zf:
+                    names = zf.namelist()
+                    comment = zf.comment
+            except zipfile.BadZipFile:
+                logger.warning("ZIP 已损坏，改名为 %s.bad 后重新下载其中学号", path)
+                os.replace(path, f"{path}.bad")
+                continue
+            if path == self.zip_name:
+                self._merged_epoch = epoch = _comment_epoch(comment)
+            else:
+                epoch = int(os.path.splitext(path)[0][-4:])
+                present.add(epoch)
+            self._done.update((n[:-4], epoch) for n in names if n.endswith('.csv'))
+        self._next_shard = max(self._merged_epoch, *present) + 1 if present else self._merged_epoch + 1
+        # 从已合并的段号起连续存在的段都能确认；缺号（损坏或被删除）之后的段留给日志核对
+        confirmed = self._merged_epoch
+        while confirmed + 1 in present:
+            confirmed += 1
+        self._confirmed = confirmed
+
+    def confirmed_epoch(self):
+        return self._confirmed
+
+    def epoch_of(self, student_id):
+        return self._done.get(student_id) or 0
+
+    def has(self, student_id):
+        return student_id in self._done
+
+    def finished(self):
+        return set(self._done)
+
+    def iter_sheets(self, student_ids):
+        """读取已落盘的成绩单，产出 (学号, CSV 字节)"""
+        wanted = {f"{sid}.csv" for sid in student_ids}
+        for path in self.paths():
+            with zipfile.ZipFile(path, 'r') as zf:
+                for name in zf.namelist():
+                    if name in wanted:
+                        wanted.discard(name)
+                        yield name[:-4], zf.read(name)
+
+    async def start(self):
+        self._queue = asyncio.Queue(self.queue_size)
+        self._task = asyncio.ensure_future(self._writer())
+
+    def _check(self):
+        if self.error is not None:
+            raise RuntimeError(f"写入ZIP失败，停止接收: {self.error}")
+        if self._task is not None and self._task.done():
+            self._task.result()
+            raise RuntimeError("ZIP 写入任务已退出")
+
+    async def put(self, student_id, data, digest=None):
+        self._check()
+        self._done[student_id] = None
+        await self._queue.put((student_id, data, digest))
+
+    def _commit(self, groups):
+        """groups 为 [(条目, 段号), ...]"""
+        for entries, epoch in groups:
+            if entries and self.on_commit:
+                self.on_commit(entries, epoch)
+
+    async def close(self):
+        """写完队列中的条目并合并各段；写入出错时抛出该错误（已关闭的段保留，下次运行续传）"""
+        if self._task is None:
+            return
+        if not self._task.done():
+            await self._queue.put(None)
+        try:
+            await self._task
+        finally:
+            self._task = None
+            loop = asyncio.get_running_loop()
+            try:
+                self._commit([await loop.run_in_executor(self._executor, self._close_zip)])
+                if self.error is None and not self.shard_size:
+                    await loop.run_in_executor(self._executor, self._merge_segments)
+            finally:
+                self._executor.shutdown()
+        if self.error is not None:
+            raise self.error
+
+    async def _writer(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            # 一次取走队列里已就绪的条目，减少线程切换
+            items = [await self._queue.get()]
+            while items[-1] is not None and not self._queue.empty() and len(items) < 256:
+                items.append(self._queue.get_nowait())
+            stop = items[-1] is None
+            if stop:
+                items.pop()
+            if items and self.error is None:
+                try:
+                    self._commit(await loop.run_in_executor(self._executor, self._write_many, items))
+                except Exception as e:
+                    # 写入失败后继续排空队列，避免 put 永久阻塞；put 会把错误抛给下载端
+                    logger.error("写入ZIP失败: %s", e)
+                    self.error = e
+            if stop:
+                return
+
+    def _open_zip(self):
+        self._epoch = self._next_shard
+        path = self._part_path(self._epoch)
+        self._next_shard += 1
+        self._zf = zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED)
+        self._count = 0
+
+    def _close_zip(self):
+        """关闭当前分片/段，返回 (其中已落盘的条目, 段号)"""
+        if self._zf is None:
+            return [], self._epoch
+        self._zf.close()
+        self._zf = None
+        closed, self._unclosed = self._unclosed, []
+        return closed, self._epoch
+
+    def _write_many(self, items):
+        """写入一组条目，返回期间关闭的分片/段 [(条目, 段号), ...]"""
+        committed = []
+        for student_id, data, digest in items:
+            if self._zf is None:
+                self._open_zip()
+            self._zf.writestr(f"{student_id}.csv", data)
+            self._unclosed.append((student_id, len(data), digest))
+            self._count += 1
+            if self._count >= (self.shard_size or self.checkpoint):
+                committed.append(self._close_zip())
+        return committed
+
+    def _merge_segments(self):
+        """
+        把各段合并进目标 ZIP：先写临时文件再 os.replace，合并中途中断时原 ZIP 和各段都不受影响。
+        条目按压缩后的原始字节复制（不解压、不重新压缩），已有的目标 ZIP 按字节整体复制，代价接近一次顺序拷贝。
+        """
+        segments = self._part_paths()
+        if not segments:
+            return
+        temp_path = f"{self.zip_name}.tmp"
+        mode = 'w'
+        if os.path.exists(self.zip_name):
+            shutil.copyfile(self.zip_name, temp_path)
+            mode = 'a'
+        with zipfile.ZipFile(temp_path, mode, zipfile.ZIP_DEFLATED) as out:
+            # 上次合并后、删除段之前中断时，段里的条目已在目标 ZIP 中
+            names = set(out.namelist())
+            merged = max(_comment_epoch(out.comment), *(int(os.path.splitext(p)[0][-4:]) for p in segments))
+            out.comment = f"epoch={merged}".encode()
+            for path in segments:
+                with zipfile.ZipFile(path, 'r') as zf:
+                    for info in zf.infolist():
+                        if info.filename not in names:
+                            copy_raw_entry(zf, info, out)
+                            names.add(info.filename)
+        os.replace(temp_path, self.zip_name)
+        for path in segments:
+            os.remove(path)
+
+
+def _comment_epoch(comment):
+    """目标 ZIP 注释中记录的已合并段号（没有时为 0）"""
+    text = comment.decode('ascii', errors='replace')
+    return int(text[6:]) if text.startswith('epoch=') and text[6:].isdigit() else 0
+
+
+def copy_raw_entry(src, info, out):
+    """把 src 中的一个条目按压缩后的字节追加到 out（写模式的 ZipFile）：重写本地文件头并复制压缩数据，
+    中央目录由 out 关闭时按 filelist 重建"""
+    src.fp.seek(info.header_offset)
+    header = src.fp.read(zipfile.sizeFileHeader)
+    if len(header) != zipfile.sizeFileHeader or header[:4] != zipfile.stringFileHeader:
+        raise zipfile.BadZipFile(f"本地文件头损坏: {info.filename}")
+    name_len, extra_len = struct.unpack('<HH', header[26:30])
+    src.fp.seek(info.header_offset + zipfile.sizeFileHeader + name_len + extra_len)
+    entry = zipfile.ZipInfo(info.filename, info.date_time)
+    entry.compress_type = info.compress_type
+    entry.create_system = info.create_system
+    entry.external_attr = info.external_attr
+    entry.flag_bits = info.flag_bits & ~0x08   # 大小和 CRC 写进本地文件头，不再跟数据描述符
+    entry.CRC = info.CRC
+    entry.compress_size = info.compress_size
+    entry.file_size = info.file_size
+    entry.header_offset = out.fp.tell()
+    out.fp.write(entry.FileHeader())
+    remaining = info.compress_size
+    while remaining:
+        chunk = src.fp.read(min(remaining, 1 << 20))
+        if not chunk:
+            raise zipfile.BadZipFile(f"压缩数据不完整: {info.filename}")
+        out.fp.write(chunk)
+        remaining -= len(chunk)
+    out.filelist.append(entry)
+    out.NameToInfo[entry.filename] = entry
+    out.start_dir = out.fp.tell()
+    out._didModify = True
+
+
+class Converter:
+    """
+    XLS→CSV 转换阶段：CPU 密集的 xlrd 解析放到进程池，事件循环只做网络 I/O。
+    slots 限制排队中的原始 XLS 数量，积压时下载端等待，形成背压。workers=0 时在事件循环内直接转换。
+    """
+
+    def __init__(self, workers, queue_size=None):
+        self.workers = workers
+        self._pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers) if workers > 0 else None
+        self._slots = asyncio.Semaphore(queue_size or max(workers, 1) * 4)
+
+    async def acquire(self):
+        await self._slots.acquire()
+
+    def release(self):
+        self._slots.release()
+
+    async def convert(self, content):
+        """返回 (CSV 字节, 内容哈希)"""
+        if self._pool is None:
+            return convert_sheet(content)
+        return await asyncio.get_running_loop().run_in_executor(self._pool, convert_sheet, content)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+
+
+class LoopLagMonitor:
+    """周期性 sleep 并测量实际唤醒延迟，用于观察事件循环是否被阻塞"""
+
+    def __init__(self, interval=0.1):
+        self.interval = interval
+        self.samples = []
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            t0 = loop.time()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, loop.time() - t0 - self.interval))
+
+    def summary(self):
+        if not self.samples:
+            return "无采样"
+        lags = sorted(self.samples)
+        avg = sum(lags) / len(lags)
+        p99 = lags[min(len(lags) - 1, int(len(lags) * 0.99))]
+        return f"平均 {avg*1000:.1f}ms | p99 {p99*1000:.1f}ms | 最大 {lags[-1]*1000:.1f}ms"
+
+
+class AdaptiveLimiter:
+    """
+    AIMD 自适应并发：每收集 window 个请求样本做一次决策。
+    错误率（429/5xx/超时）超过阈值或中位延迟超过基线 latency_factor 倍时乘性下调，否则加性上调，
+    始终限制在 [floor, ceiling] 内。用法与 asyncio.Semaphore 相同（async with）。
+    """
+
+    def __init__(self, initial, floor, ceiling, window=50, step=2, backoff=0.7,
+                 error_threshold=0.05, latency_factor=2.0):
+        self.floor = floor
+        self.ceiling = ceiling
+        self.limit = float(min(max(initial, floor), ceiling))
+        self.window = window
+        self.step = step
+        self.backoff = backoff
+        self.error_threshold = error_threshold
+        self.latency_factor = latency_factor
+        self._inflight = 0
+        self._cond = asyncio.Condition()
+        self._latencies = []
+        self._errors = 0
+        self._baseline = None
+
+    async def __aenter__(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self._inflight < int(self.limit))
+            self._inflight += 1
+
+    async def __aexit__(self, *exc):
+        async with self._cond:
+            self._inflight -= 1
+            self._cond.notify()
+
+    def record(self, latency, error):
+        """记录一次请求结果：latency 秒，error 表示限流/服务端错误/超时"""
+        self._latencies.append(latency)
+        if error:
+            self._errors += 1
+        if len(self._latencies) >= self.window:
+            self._decide()
+
+    def _decide(self):
+        lats = sorted(self._latencies)
+        p50 = lats[len(lats) // 2]
+        error_rate = self._errors / len(lats)
+        self._latencies = []
+        self._errors = 0
+        # 基线取历史最低中位延迟，每个窗口允许缓慢上漂 5%，跟随服务器的长期变化
+        self._baseline = p50 if self._baseline is None else min(self._baseline * 1.05, p50)
+
+        old = int(self.limit)
+        if error_rate > self.error_threshold or p50 > self._baseline * self.latency_factor:
+            self.limit = max(self.floor, self.limit * self.backoff)
+            action = "下调"
+        else:
+            self.limit = min(self.ceiling, self.limit + self.step)
+            action = "上调"
+        new = int(self.limit)
+        if new != old:
+            logger.info("并发%s %d -> %d (错误率 %.1f%%, p50 %.0fms, 基线 %.0fms, 在途 %d)",
+                        action, old, new, error_rate * 100, p50 * 1000, self._baseline * 1000, self._inflight)
+            if new > old:
+                asyncio.ensure_future(self._wake())
+
+    async def _wake(self):
+        async with self._cond:
+            self._cond.notify_all()
+
+
+class Hedger:
+    """
+    对冲请求：某一步超过该步近期延迟的 quantile 分位仍未完成时，在另一个连接上再发一份，先完成者胜出，另一份取消。
+    预算为令牌桶：每个原始请求积累 budget 个令牌，每次对冲消耗 1 个，额外请求量不超过原始请求的 budget 比例。
+    阈值只按原始请求的延迟计算：原始请求输给对冲而被取消时记录其取消前已等待的时间，
+    慢请求不会从样本中消失，阈值不会随对冲越来越低。
+    """
+
+    def __init__(self, quantile=0.95, budget=0.05, burst=10, window=500, min_samples=100, min_delay=0.05):
+        self.quantile = quantile
+        self.budget = budget
+        self.burst = burst
+        self.window = window
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self._latencies = {}
+        self._thresholds = {}
+        self._since_update = {}
+        self._tokens = float(burst)
+        self.requests = {}
+        self.fired = {}
+        self.won = {}
+
+    def threshold(self, phase):
+        """当前对冲阈值（秒），样本不足时返回 None"""
+        return self._thresholds.get(phase)
+
+    def record(self, phase, latency):
+        lats = self._latencies.setdefault(phase, collections.deque(maxlen=self.window))
+        lats.append(latency)
+        # 每 50 个样本重算一次分位数，避免每个请求都排序
+        n = self._since_update.get(phase, 0) + 1
+        if n >= 50 and len(lats) >= self.min_samples:
+            ordered = sorted(lats)
+            q = ordered[min(len(ordered) - 1, int(len(ordered) * self.quantile))]
+            self._thresholds[phase] = max(self.min_delay, q)
+            n = 0
+        self._since_update[phase] = n
+
+    async def _timed(self, phase, make_request):
+        """原始请求：完成或被取消时都记录耗时（被取消时是实际延迟的下界），出错时不记录"""
+        t0 = time.perf_counter()
+        try:
+            result = await make_request()
+        except asyncio.CancelledError:
+            self.record(phase, time.perf_counter() - t0)
+            raise
+        self.record(phase, time.perf_counter() - t0)
+        return result
+
+    async def run(self, phase, make_request):
+        """执行 make_request()（返回协程的无参函数），必要时对冲，返回先成功的结果"""
+        self.requests[phase] = self.requests.get(phase, 0) + 1
+        self._tokens = min(self.burst, self._tokens + self.budget)
+        primary = asyncio.ensure_future(self._timed(phase, make_request))
+        tasks = [primary]
+        try:
+            delay = self.threshold(phase)
+            if delay is None:
+                return await primary
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if done or self._tokens < 1:
+                return await primary
+            self._tokens -= 1
+            self.fired[phase] = self.fired.get(phase, 0) + 1
+            tasks.append(asyncio.ensure_future(make_request()))
+            pending, error = set(tasks), None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            self.won[phase] = self.won.get(phase, 0) + 1
+                        return task.result()
+                    error = error or task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def report(self):
+        lines = []
+        for phase, total in self.requests.items():
+            fired = self.fired.get(phase, 0)
+            threshold = self.threshold(phase)
+            lines.append(f"   {phase} | 请求 {total} | 对冲 {fired} 次 ({fired / total * 100:.1f}%) | "
+                         f"对冲胜出 {self.won.get(phase, 0)} 次 | 阈值 "
+                         f"{f'{threshold * 1000:.0f}ms' if threshold is not None else '-'}")
+        return lines
+
+
+class _Egress:
+    """单个出口（代理或直连）：独立连接池、并发上限和吞吐统计"""
+
+    def __init__(self, url, limit):
+        self.url = url
+        self.limit = limit
+        self.semaphore = asyncio.Semaphore(limit)
+        self.session = None
+        self.inflight = 0
+        self.ok = 0
+        self.failed = 0
+        self.bytes = 0
+        self.consec_failures = 0
+        self.latency = None          # EWMA，秒
+        self.ejected_until = 0.0
+        self.ejections = 0
+        self.probing = False
+
+    @property
+    def name(self):
+        return self.url or '直连'
+
+    def healthy(self):
+        return self.ejected_until == 0.0
+
+    def available(self, now):
+        """健康，或冷却结束且当前没有探测请求（半开状态只放行一个）"""
+        return self.healthy() or (now >= self.ejected_until and not self.probing)
+
+
+class ProxyPool:
+    """
+    多出口连接池：每个代理一个 ClientSession 和并发上限，请求分配给负载最低的可用出口。
+    连续失败 eject_after 次或 EWMA 延迟超过其余出口中位数 slow_factor 倍时摘除，
+    冷却 cooldown 秒后放行一个探测请求，成功即恢复，失败则冷却时间翻倍。最后一个健康出口不会被摘除。
+    """
+
+    def __init__(self, urls, per_proxy, eject_after=5, cooldown=30.0, slow_factor=3.0, trace_configs=None):
+        self.egresses = [_Egress(url, per_proxy) for url in urls]
+        self.eject_after = eject_after
+        self.cooldown = cooldown
+        self.slow_factor = slow_factor
+        self.trace_configs = trace_configs
+        self._started = None
+
+    async def start(self):
+        for e in self.egresses:
+            if e.url:
+                connector = ProxyConnector.from_url(e.url, limit=e.limit, limit_per_host=e.limit)
+            else:
+                connector = aiohttp.TCPConnector(limit=e.limit, limit_per_host=e.limit)
+            e.session = aiohttp.ClientSession(connector=connector, headers=HEADERS, timeout=TIMEOUT,
+                                              trace_configs=self.trace_configs)
+        self._started = time.monotonic()
+
+    async def close(self):
+        for e in self.egresses:
+            if e.session is not None:
+                await e.session.close()
+                e.session = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def _pick(self):
+        while True:
+            now = time.monotonic()
+            candidates = [e for e in self.egresses if e.available(now)]
+            if candidates:
+                return min(candidates, key=lambda e: e.inflight / e.limit)
+            await asyncio.sleep(0.2)
+
+    @asynccontextmanager
+    async def lease(self, egress=None):
+        """借出一个出口，退出时按是否抛异常记录成败；传入 egress 时借用指定出口（即使已被摘除）"""
+        pinned = egress is not None
+        if not pinned:
+            egress = await self._pick()
+        probe = not pinned and not egress.healthy()
+        if probe:
+            egress.probing = True
+        async with egress.semaphore:
+            egress.inflight += 1
+            t0 = time.monotonic()
+            try:
+                yield egress
+            except Exception as e:
+                # 服务器给出了明确响应（非限流/5xx）说明出口本身可用
+                usable = isinstance(e, FetchError) and e.status is not None and e.status not in RETRY_STATUSES
+                self._record(egress, usable, time.monotonic() - t0, probe)
+                raise
+            else:
+                self._record(egress, True, time.monotonic() - t0, probe)
+            finally:
+                egress.inflight -= 1
+                if probe:
+                    egress.probing = False
+
+    def _record(self, egress, ok, latency, probe):
+        if ok:
+            egress.ok += 1
+            egress.consec_failures = 0
+            egress.latency = latency if egress.latency is None else egress.latency * 0.9 + latency * 0.1
+            if probe:
+                egress.ejected_until = 0.0
+                logger.info("出口恢复: %s", egress.name)
+            elif self._too_slow(egress):
+                self._eject(egress, f"EWMA 延迟 {egress.latency:.2f}s 明显高于其他出口")
+            return
+        egress.failed += 1
+        egress.consec_failures += 1
+        if probe:
+            self._eject(egress, "探测失败")
+        elif egress.healthy() and egress.consec_failures >= self.eject_after:
+            self._eject(egress, f"连续失败 {egress.consec_failures} 次")
 
-    semaphore = asyncio.Semaphore(workers)
+    def _too_slow(self, egress):
+        others = sorted(e.latency for e in self.egresses
+                        if e is not egress and e.healthy() and e.latency is not None)
+        if not others or egress.ok < 20:
+            return False
+        return egress.latency > others[len(others) // 2] * self.slow_factor
+
+    def _eject(self, egress, reason):
+        healthy = [e for e in self.egresses if e.healthy() and e is not egress]
+        if egress.healthy() and not healthy:
+            return  # 保留最后一个健康出口
+        egress.ejections += 1
+        wait = self.cooldown * (2 ** min(egress.ejections - 1, 5)) if not egress.healthy() else self.cooldown
+        egress.ejected_until = time.monotonic() + wait
+        egress.consec_failures = 0
+        logger.warning("摘除出口 %s（%s），%.0fs 后探测", egress.name, reason, wait)
+
+    def report(self):
+        elapsed = max(time.monotonic() - (self._started or time.monotonic()), 1e-9)
+        lines = []
+        for e in self.egresses:
+            state = '健康' if e.healthy() else '摘除'
+            latency = f"{e.latency * 1000:.0f}ms" if e.latency is not None else '-'
+            lines.append(f"   {e.name} | {state} | 成功 {e.ok} 失败 {e.failed} | {e.ok / elapsed:.1f} 个/s | "
+                         f"延迟 {latency} | {e.bytes / 1048576:.1f} MB | 摘除 {e.ejections} 次")
+        return lines
+
+
+class FetchError(Exception):
+    """下载最终失败，status 为最后一次 HTTP 状态码（网络错误时为 None）"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+async def _request(session, method, url, limiter=None, text=False, **kwargs):
+    """发出一次请求并读完响应体，返回 (状态码, 正文)；限流/服务端错误的状态码不读正文，交给调用方重试"""
+    loop = asyncio.get_running_loop()
+    t0 = loop.time()
+    try:
+        async with session.request(method, url, **kwargs) as r:
+            if limiter:
+                limiter.record(loop.time() - t0, r.status in RETRY_STATUSES)
+            if r.status in RETRY_STATUSES:
+                return r.status, None
+            r.raise_for_status()
+            return r.status, await (r.text() if text else r.read())
+    except asyncio.TimeoutError:
+        if limiter:
+            limiter.record(loop.time() - t0, True)
+        raise
+
+
+class ReportExpired(FetchError):
+    """reportServlet 不认识该 cachedId（服务端报表缓存已过期），需要重新获取报表参数"""
+
+
+async def _retry_sleep(attempt):
+    await asyncio.sleep(0.3 * (2 ** attempt))
+
+
+async def fetch_params(pool, student_id, limiter=None, metrics=None, hedger=None, queued_at=None):
+    """
+    第一步：POST showReport.jsp，返回 (出口, 报表令牌 (cachedId, reportParamsId, t_i_m_e))，重试用尽后抛出 FetchError。
+    每次尝试单独借出口：失败记在当次的出口上，退避期间不占出口，重试时重新挑选可用出口，不会把重试都耗在同一个坏代理上。
+    queued_at 为任务开始排队的时刻，首次借到出口时记入排队耗时
+    """
+    loop = asyncio.get_running_loop()
+    phase = 'show_report'
+    url = f"{BASE_URL}/reportJsp/showReport.jsp?rpx=/148656-XSCJDXSD.rpx"
+    form = {'selShowType': 'all', 'kclx': '0', 'xsxh': student_id}
+    for attempt in range(RETRIES):
+        try:
+            async with pool.lease() as egress:
+                t0 = loop.time()
+                if metrics and queued_at is not None and attempt == 0:
+                    metrics.observe('queue_wait', t0 - queued_at)
+                step = functools.partial(_request, egress.session, 'POST', url, limiter, text=True, data=form)
+                status, text = await (hedger.run(phase, step) if hedger else step())
+                if status in RETRY_STATUSES:
+                    raise FetchError(status, f"showReport.jsp 返回 {status}")
+        except NETWORK_ERRORS as e:
+            if attempt < RETRIES - 1:
+                if metrics:
+                    metrics.retry(phase, getattr(e, 'status', None) or type(e).__name__)
+                await _retry_sleep(attempt)
+                continue
+            raise FetchError(getattr(e, 'status', None), str(e) or type(e).__name__) from e
+        except FetchError as e:
+            if attempt < RETRIES - 1:
+                if metrics:
+                    metrics.retry(phase, e.status)
+                await _retry_sleep(attempt)
+                continue
+            raise
+        if metrics:
+            metrics.observe(phase, loop.time() - t0)
+
+        # 使用预编译的正则表达式
+        matches = [RE_CACHED.search(text), RE_PARAMS.search(text), RE_TIME.search(text)]
+        if not all(matches):
+            raise FetchError(status, "页面中没有报表参数")
+        return egress, tuple(m.group(1) for m in matches)
+
+    raise FetchError(None, "重试次数用尽")
+
+
+class EgressFailed(FetchError):
+    """第二步在拿到令牌的出口上连接失败：令牌与该出口的会话绑定，只能换出口从第一步重来"""
+
+
+async def fetch_report(pool, egress, token, limiter=None, metrics=None, hedger=None):
+    """
+    第二步：用报表令牌 GET reportServlet，返回 XLS 字节；令牌失效抛出 ReportExpired，
+    连接失败（没有 HTTP 响应）抛出 EgressFailed，限流/服务端错误在同一出口上退避重试，用尽后抛出 FetchError。
+    令牌与拿到它的出口会话绑定，每次尝试都借用该出口
+    """
+    loop = asyncio.get_running_loop()
+    phase = 'report_servlet'
+    cached_id, params_id, t_i_m_e = token
+    step = functools.partial(_request, egress.session, 'GET', f'{BASE_URL}/reportServlet', limiter, params={
+        'action': '3', 'file': '/148656-XSCJDXSD.rpx', 'columns': '0', 'srcType': 'file',
+        'cachedId': cached_id, 'reportParamsId': params_id,
+        't_i_m_e': t_i_m_e, 'excelFormat': '2003', 'width': '0', 'height': '0',
+        'pageStyle': '0', 'formula': '0', 'tips': 'yes'
+    })
+    for attempt in range(RETRIES):
+        t0 = loop.time()
+        try:
+            async with pool.lease(egress):
+                status, content = await (hedger.run(phase, step) if hedger else step())
+                if status in RETRY_STATUSES:
+                    raise FetchError(status, f"reportServlet 返回 {status}")
+                egress.bytes += len(content)
+        except NETWORK_ERRORS as e:
+            status = getattr(e, 'status', None)
+            if status in (404, 410):
+                raise ReportExpired(status, "报表缓存已过期") from e
+            if status is None:
+                raise EgressFailed(None, str(e) or type(e).__name__) from e
+            if attempt < RETRIES - 1:
+                if metrics:
+                    metrics.retry(phase, status)
+                await _retry_sleep(attempt)
+                continue
+            raise FetchError(status, str(e) or type(e).__name__) from e
+        except FetchError as e:
+            if attempt < RETRIES - 1:
+                if metrics:
+                    metrics.retry(phase, e.status)
+                await _retry_sleep(attempt)
+                continue
+            raise
+        if metrics:
+            metrics.observe(phase, loop.time() - t0)
+        return content
+
+    raise FetchError(None, "重试次数用尽")
+
+
+async def _restart(error, attempt, expired, metrics):
+    """第二步失败后能否从第一步重来：令牌过期重来一次，出口连接失败按重试次数换出口重来（先退避）；不能时抛出原异常"""
+    if isinstance(error, ReportExpired):
+        if expired:
+            raise error
+        if metrics:
+            metrics.retry('report_servlet', 'expired')
+        return True
+    if attempt == RETRIES - 1:
+        raise error
+    if metrics:
+        metrics.retry('report_servlet', type(error.__cause__ or error).__name__)
+    await _retry_sleep(attempt)
+    return expired
+
+
+async def fetch_excel(pool, student_id, limiter=None, metrics=None, hedger=None, queued_at=None):
+    """
+    两步请求下载某学号的成绩 Excel，返回 XLS 字节。每一步的每次尝试都单独从出口池借出口；
+    第二步令牌过期、或拿到令牌的出口连接失败时，重新走一遍第一步（换到当时可用的出口）
+    """
+    expired = False
+    for attempt in range(RETRIES):
+        egress, token = await fetch_params(pool, student_id, limiter, metrics, hedger,
+                                           queued_at if attempt == 0 else None)
+        try:
+            return await fetch_report(pool, egress, token, limiter, metrics, hedger)
+        except (ReportExpired, EgressFailed) as e:
+            expired = await _restart(e, attempt, expired, metrics)
+    raise FetchError(None, "重试次数用尽")
+
+
+class PipelineStages:
+    """
+    两阶段模式：showReport（产出报表令牌）和 reportServlet（用令牌下载 XLS）各有独立的并发上限。
+    第一阶段完成的令牌在第二阶段的信号量上按 FIFO 排队，队列长度受任务窗口限制；
+    分别统计两段的完成数、吞吐、排队时间和最大排队长度，慢的一端不会占住另一端的并发。
+    """
+
+    def __init__(self, show_workers, servlet_workers):
+        self.limits = {'show_report': show_workers, 'report_servlet': servlet_workers}
+        self._semaphores = {phase: asyncio.Semaphore(n) for phase, n in self.limits.items()}
+        self.stats = {phase: {'done': 0, 'failed': 0, 'wait': 0.0, 'busy': 0.0, 'queued': 0, 'max_queued': 0}
+                      for phase in self.limits}
+        self._started = time.monotonic()
+
+    @asynccontextmanager
+    async def slot(self, phase):
+        st = self.stats[phase]
+        t0 = time.monotonic()
+        st['queued'] += 1
+        st['max_queued'] = max(st['max_queued'], st['queued'])
+        try:
+            await self._semaphores[phase].acquire()
+        finally:
+            st['queued'] -= 1
+        t1 = time.monotonic()
+        st['wait'] += t1 - t0
+        try:
+            yield
+        except Exception:
+            st['failed'] += 1
+            raise
+        else:
+            st['done'] += 1
+        finally:
+            st['busy'] += time.monotonic() - t1
+            self._semaphores[phase].release()
+
+    def report(self):
+        elapsed = max(time.monotonic() - self._started, 1e-9)
+        lines = []
+        for phase, st in self.stats.items():
+            n = st['done'] + st['failed']
+            limit = self.limits[phase]
+            lines.append(f"   {phase} | 并发 {limit} | 完成 {st['done']} 失败 {st['failed']} | "
+                         f"{st['done'] / elapsed:.1f} 个/s | 平均排队 {st['wait'] / max(n, 1) * 1000:.0f}ms | "
+                         f"最长队列 {st['max_queued']} | 利用率 {st['busy'] / (limit * elapsed) * 100:.0f}%")
+        return lines
+
+
+async def _fetch_staged(pool, student_id, stages, converter, limiter=None, metrics=None, hedger=None):
+    """两阶段模式下载：两步分别占用各自阶段的并发槽，第二步固定使用拿到令牌的同一出口（同一会话）"""
+    loop = asyncio.get_running_loop()
+    queued_at = loop.time()
+    expired = False
+    for attempt in range(RETRIES):
+        async with stages.slot('show_report'):
+            egress, token = await fetch_params(pool, student_id, limiter, metrics, hedger,
+                                               queued_at if attempt == 0 else None)
+        try:
+            async with stages.slot('report_servlet'):
+                content = await fetch_report(pool, egress, token, limiter, metrics, hedger)
+                await converter.acquire()
+            return content
+        except (ReportExpired, EgressFailed) as e:
+            expired = await _restart(e, attempt, expired, metrics)
+    raise FetchError(None, "重试次数用尽")
+
+
+async def download_and_convert(pool, student_id, sink, semaphore, converter, limiter=None, journal=None,
+                               metrics=None, hedger=None, stages=None):
+    # 如果已完成，跳过；输出端已失败时不再下载
+    if sink.has(student_id):
+        return "skipped"
+    if sink.error is not None:
+        return "aborted"
+
+    loop = asyncio.get_running_loop()
+    try:
+        if stages:
+            content = await _fetch_staged(pool, student_id, stages, converter, limiter, metrics, hedger)
+        else:
+            queued_at = loop.time()
+            async with semaphore:
+                content = await fetch_excel(pool, student_id, limiter, metrics, hedger, queued_at)
+                # 转换积压时持有并发槽等待，避免原始 XLS 在内存中无限堆积
+                await converter.acquire()
+
+        t0 = loop.time()
+        try:
+            if sink.raw_xls:
+                # 直接入库：原始 XLS 交给输出端的解析进程，哈希也在那里计算；
+                # 返回的不是 XLS（如错误页）与转换失败一样按下载失败处理，不当作无效成绩单提交
+                if not content.startswith(XLS_MAGIC):
+                    raise ValueError("reportServlet 返回的不是 XLS")
+                data, digest = content, None
+            else:
+                data, digest = await converter.convert(content)
+        finally:
+            converter.release()
+        if metrics and not sink.raw_xls:
+            metrics.observe('convert', loop.time() - t0)
+
+        # 转换为CSV（直接入库时为原始 XLS）后交给输出端
+        # 任务日志和哈希清单在输出端提交（on_commit）后才更新，这里只负责交付
+        t0 = loop.time()
+        await sink.put(student_id, data, digest)
+        if metrics:
+            metrics.observe('write', loop.time() - t0)
+            metrics.done(len(content), len(data))
+        return True
+    except Exception as e:
+        if sink.error is not None:
+            # 输出端写入失败导致的异常不是下载失败，不计入失败也不进日志，续传时重新下载
+            return "aborted"
+        logger.warning("下载失败 [%s]: %s", student_id, e)
+        if metrics:
+            metrics.failed(getattr(e, 'status', None))
+        if journal:
+            journal.mark_failed(student_id, getattr(e, 'status', None), str(e))
+        return False
+
+
+async def _flush_metrics(metrics, prefix, interval):
+    """长时间运行时定期落盘指标，供 textfile 收集器抓取"""
+    while True:
+        await asyncio.sleep(interval)
+        metrics.write(prefix)
+
+
+def commit_entries(journal, manifest, entries, epoch=0, ingested=False):
+    """
+    输出端提交回调：标记任务日志完成（带提交段号）并记录哈希。提交前中断时日志里仍是未完成，续传时由输出端补记或重新下载；
+    哈希清单每累计 MANIFEST_SAVE_EVERY 条落盘一次，中断最多丢失最近一段，续传时由 restore_manifest 补回。
+    ingested 为真（直接入库）时提交即已入库，不再加入清单的待入库列表，避免之后 --manifest 导入时重复写入。
+    """
+    for sid, size, digest in entries:
+        if journal:
+            journal.mark_done(sid, size, digest, epoch=epoch)
+        if manifest and digest:
+            manifest.update(sid, digest)
+    if manifest and ingested:
+        manifest.clear(sid for sid, _, _ in entries)
+    if manifest and manifest.unsaved >= MANIFEST_SAVE_EVERY:
+        manifest.save()
+
+
+def restore_manifest(manifest, journal=None, sink=None, ingested=False):
+    """从任务日志的 sha256 列和输出端已有的成绩单补回清单中缺失的哈希，返回新增/变化数；
+    ingested 为真时日志中的完成记录都已入库，补回的哈希不加入待入库列表"""
+    restored = 0
+    if journal:
+        for sid, digest in journal.digests():
+            if manifest.update(sid, digest):
+                restored += 1
+                if ingested:
+                    manifest.clear([sid])
+    if sink is not None:
+        missing = [sid for sid in sink.finished() if sid not in manifest.hashes]
+        for sid, data in sink.iter_sheets(missing):
+            restored += manifest.update(sid, sheet_digest(data))
+    return restored
+
+
+def make_pool(use_proxy, pool_size, proxies=None, per_proxy=None, trace_configs=None):
+    """按配置创建出口池：代理模式下每个代理一个出口，否则单个直连出口"""
+    urls = (proxies or PROXIES) if use_proxy else [None]
+    return ProxyPool(urls, per_proxy or pool_size, trace_configs=trace_configs)
+
+
+def iter_ids(path):
+    """逐行读取学号（'-' 为标准输入），不一次性载入内存"""
+    # 标准输入另开一个文件对象读取：IdFeed 线程阻塞在读上时持有的是它的锁而不是 sys.stdin 的，
+    # 进程池此时 fork 出的子进程关闭 sys.stdin 不会死锁
+    f = open(sys.stdin.fileno(), 'r', closefd=False) if path == '-' else open(path, 'r')
+    try:
+        for line in f:
+            sid = line.strip()
+            if sid:
+                yield sid
+    finally:
+        f.close()
+
+
+class IdFeed:
+    """
+    在线程中迭代学号来源（文件/标准输入是同步读取，生产者慢时会阻塞），经有界队列交给事件循环，
+    读取等待不会卡住在途请求。队列满时读取线程等待，形成背压。
+    """
+
+    _END = object()
+
+    def __init__(self, ids, maxsize):
+        self._ids = ids
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(maxsize)
+        self._stop = threading.Event()
+        self.error = None
+        self._thread = threading.Thread(target=self._run, name='id-feed', daemon=True)
+        self._thread.start()
+
+    def _put(self, item):
+        return asyncio.run_coroutine_threadsafe(self._queue.put(item), self._loop)
+
+    def _run(self):
+        try:
+            for sid in self._ids:
+                if self._stop.is_set():
+                    return
+                self._put(sid).result()
+        except Exception as e:
+            self.error = e
+        finally:
+            try:
+                self._put(self._END)
+            except RuntimeError:
+                pass    # 事件循环已关闭
+
+    def _unwrap(self, item):
+        if item is self._END:
+            if self.error is not None:
+                raise self.error
+            return None
+        return item
+
+    def get_nowait(self):
+        """取出已就绪的学号，读完返回 None，暂无时抛出 asyncio.QueueEmpty"""
+        return self._unwrap(self._queue.get_nowait())
+
+    async def get(self):
+        return self._unwrap(await self._queue.get())
+
+    def close(self):
+        # 清空队列让等待中的读取线程醒来，看到停止标志后退出
+        self._stop.set()
+        while not self._queue.empty():
+            self._queue.get_nowait()
+
+
+async def batch_download(ids, sink, use_proxy, workers, desc="进度", total=None, initial=0, converter=None,
+                         limiter=None, journal=None, trace_configs=None, pool=None, metrics=None,
+                         window=0, failed_ids=None, hedger=None, stages=None):
+    """
+    异步并发下载一批学号，返回 (成功数, 失败数)。ids 可以是列表或任意迭代器（如逐行读取的文件、标准输入），
+    迭代器在读取线程中按需取出（IdFeed），同时存在的任务数不超过 window（默认并发上限的 2 倍），内存与学号总数无关。
+    传入 limiter 时由其自适应控制并发；传入 journal 时失败学号按退避时间在本轮内重新排队，直到成功或进入死信；
+    传入 pool（已 start 的 ProxyPool）时复用其出口，否则按 use_proxy 临时创建；
+    传入 failed_ids（列表）时追加最终失败的学号，供后续重试；传入 stages（PipelineStages）时两步请求分别限流。
+    """
+    own_converter = converter is None
+    if own_converter:
+        converter = Converter(0)
+    own_pool = pool is None
+    if own_pool:
+        # 自适应模式下连接池按上限开，实际在途请求数由 limiter 控制
+        pool = make_pool(use_proxy, limiter.ceiling if limiter else workers, trace_configs=trace_configs)
+        await pool.start()
+
+    semaphore = limiter or asyncio.Semaphore(workers)
+    window = window or (limiter.ceiling if limiter else workers) * 2
+    feed = None
+    if hasattr(ids, '__len__'):
+        if total is None:
+            total = len(ids)
+        ids = iter(ids)
+    else:
+        feed = IdFeed(ids, window)
+    loop = asyncio.get_running_loop()
     success = 0
     failed = 0
+    getter = None   # 任务窗口有空位但读取线程还没送来学号时，等待下一个学号
+
+    try:
+        tasks = {}
+        delayed = []   # (可重试时间, 学号) 小顶堆，等待中的重试不占任务
+        exhausted = False
+
+        def submit(sid):
+            coro = download_and_convert(pool, sid, sink, semaphore, converter, limiter, journal, metrics, hedger,
+                                        stages)
+            tasks[asyncio.ensure_future(coro)] = sid
 
-    async with aiohttp.ClientSession(connector=connector, headers=HEADERS, timeout=TIMEOUT) as session:
-        tasks = {asyncio.ensure_future(download_and_convert(session, sid, csv_dir, semaphore)): sid for sid in ids}
+        def refill():
+            nonlocal exhausted
+            # 到期的重试优先，其余空位从学号流中补
+            now = loop.time()
+            while delayed and delayed[0][0] <= now and len(tasks) < window:
+                submit(heapq.heappop(delayed)[1])
+            while not exhausted and len(tasks) < window:
+                if feed:
+                    try:
+                        sid = feed.get_nowait()
+                    except asyncio.QueueEmpty:
+                        break
+                else:
+                    sid = next(ids, None)
+                if sid is None:
+                    exhausted = True
+                else:
+                    submit(sid)
 
-        with tqdm(total=total or len(ids), initial=initial, desc=desc, unit="个") as pbar:
-            for coro in asyncio.as_completed(tasks.keys()):
-                result = await coro
-                if result is True:
-                    success += 1
-                elif result is False:
-                    failed += 1
-                pbar.set_postfix(成功=success, 失败=failed)
-                pbar.update(1)
+        retrying = 0
+        with tqdm(total=total, initial=initial, desc=desc, unit="个") as pbar:
+            refill()
+            while tasks or delayed or not exhausted:
+                timeout = max(0.0, delayed[0][0] - loop.time()) if delayed else None
+                waits = set(tasks)
+                if feed and not exhausted and len(tasks) < window:
+                    if getter is None:
+                        getter = asyncio.ensure_future(feed.get())
+                    waits.add(getter)
+                if waits:
+                    done, _ = await asyncio.wait(waits, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                else:
+                    await asyncio.sleep(timeout)
+                    done = ()
+                if getter in done:
+                    done.discard(getter)
+                    sid, getter = getter.result(), None
+                    if sid is None:
+                        exhausted = True
+                    elif not exhausted:
+                        submit(sid)
+                for task in done:
+                    sid = tasks.pop(task)
+                    if task.cancelled():
+                        continue
+                    result = task.result()
+                    if result == "aborted":
+                        # 输出端已失败：不再补充任务，取消在途下载
+                        exhausted = True
+                        delayed.clear()
+                        for other in tasks:
+                            other.cancel()
+                        continue
+                    if result is False and journal:
+                        delay = journal.take_retry(sid)
+                        if delay is not None:
+                            # 本轮内按退避时间重新排队，不计入完成
+                            heapq.heappush(delayed, (loop.time() + delay, sid))
+                            retrying += 1
+                            continue
+                    if result is True:
+                        success += 1
+                    elif result is False:
+                        failed += 1
+                        if failed_ids is not None:
+                            failed_ids.append(sid)
+                    postfix = {'成功': success, '失败': failed}
+                    if journal:
+                        postfix['重试'] = retrying
+                    if limiter:
+                        postfix['并发'] = int(limiter.limit)
+                    pbar.set_postfix(postfix)
+                    pbar.update(1)
+                refill()
+    finally:
+        if getter is not None:
+            getter.cancel()
+        if feed:
+            feed.close()
+        if own_pool:
+            await pool.close()
 
+    if own_converter:
+        converter.close()
     return success, failed
 
 async def async_main(args):
@@ -135,39 +1296,201 @@ async def async_main(args):
     zip_name = args.zip
     use_proxy = args.proxy or USE_PROXY
 
-    if not os.path.exists(args.ids):
+    from_stdin = args.ids == '-'
+    if not from_stdin and not os.path.exists(args.ids):
         print(f"❌ 未找到文件: {args.ids}")
         return
+    if from_stdin and args.journal:
+        print("❌ 任务日志需要学号文件，不能从标准输入读取")
+        return
+    # 参数检查都在创建日志、进程池等资源之前完成，之后的提前结束都经过下面的 finally 清理
+    if (args.show_workers or args.servlet_workers) and args.adaptive:
+        print("❌ 两阶段模式（--show-workers/--servlet-workers）不能与 --adaptive 同时使用")
+        return
 
-    with open(args.ids, 'r') as f:
-        student_ids = [line.strip() for line in f if line.strip()]
-
-    os.makedirs(csv_dir, exist_ok=True)
+    if args.ingest:
+        # 直接入库模式才需要数据库依赖
+        from ingest_pipeline import IngestSink
+        sink = IngestSink(parse_workers=max(args.convert_workers, 1), batch_size=args.batch_size)
+    elif args.stream:
+        sink = ZipSink(zip_name, shard_size=args.shard_size)
+    else:
+        sink = DirSink(csv_dir)
 
     # 构建待处理列表
-    finished = {f[:-4] for f in os.listdir(csv_dir) if f.endswith('.csv') and not f.startswith('.')}
-    pending = [sid for sid in student_ids if sid not in finished]
+    journal = None
+    if args.journal:
+        journal = Journal(args.journal, max_attempts=args.max_attempts)
+        added = journal.add(args.ids, iter_ids(args.ids))
+        if added:
+            print(f"📒 日志新增 {added} 个学号")
+        confirmed = 0
+        if not args.ingest:
+            # 日志中的 done 必须确实在输出端中：只核对输出端能确认的最后一段之后提交的记录（走段号索引），
+            # 放回待下载后其中仍在输出端的由下面补记完成，真正缺失的重新下载；
+            # 直接入库模式下 done 只在批次提交后记录，数据库即以日志为准
+            confirmed = sink.confirmed_epoch()
+            requeued = journal.requeue_after(confirmed)
+            # 旧版本日志的完成记录没有段号，逐个核对一次后补上
+            legacy = journal.unconfirmed()
+            lost = [sid for sid in legacy if not sink.has(sid)]
+            if lost:
+                journal.requeue(lost)
+            if legacy:
+                journal.confirm([sid for sid in legacy if sink.has(sid)], sink.epoch_of)
+            if requeued or lost:
+                print(f"📒 {requeued + len(lost)} 个已完成学号无法由输出端确认（第 {confirmed} 段之后或旧日志），重新核对")
+        # 只查询日志中未完成的学号，输出端已有的直接补记完成
+        unfinished = journal.pending()
+        already = [sid for sid in unfinished if sink.has(sid)]
+        if already:
+            journal.mark_many_done(already, sink.epoch_of)
+        already = set(already)
+        pending = [sid for sid in unfinished if sid not in already]
+        total = sum(journal.counts().values())
+        pending_count = len(pending)
+    else:
+        # 学号按需从文件/标准输入读取，不在内存中展开整个列表
+        finished = sink.finished()
+        pending = (sid for sid in iter_ids(args.ids) if sid not in finished)
+        if from_stdin:
+            total = pending_count = None
+        else:
+            total = pending_count = 0
+            for sid in iter_ids(args.ids):
+                total += 1
+                pending_count += sid not in finished
+
+    print(f"🚀 总数: {total if total is not None else '流式读取'} | 待处理: {pending_count if pending_count is not None else '-'}"
+          f" | 代理: {'启用' if use_proxy else '禁用'}")
+    if not args.ingest:
+        print(f"📂 {os.path.abspath(zip_name if args.stream else csv_dir)}")
 
-    print(f"🚀 总数: {len(student_ids)} | 待处理: {len(pending)} | 代理: {'启用' if use_proxy else '禁用'}")
-    print(f"📂 {os.path.abspath(csv_dir)}")
+    manifest = None
+    if args.manifest:
+        manifest = Manifest(args.manifest)
+        print(f"🧮 哈希清单: 已知 {len(manifest.hashes)} 个 | 待入库 {len(manifest.pending)} 个")
+        restored = restore_manifest(manifest, journal, None if args.ingest else sink, ingested=args.ingest)
+        if restored:
+            manifest.save()
+            print(f"🧮 补记上次中断前未保存的哈希 {restored} 个")
 
-    # 并发下载
-    success, failed = await batch_download(pending, csv_dir, use_proxy, args.workers,
-                                           desc="进度", total=len(student_ids), initial=len(finished))
+    if journal or manifest:
+        sink.on_commit = functools.partial(commit_entries, journal, manifest, ingested=args.ingest)
 
-    # 重试失败学号
-    finished_now = {f[:-4] for f in os.listdir(csv_dir) if f.endswith('.csv') and not f.startswith('.')}
-    retry_ids = [sid for sid in student_ids if sid not in finished_now]
-    if retry_ids:
-        print(f"\n🔄 重试 {len(retry_ids)} 个失败学号...")
-        _, failed = await batch_download(retry_ids, csv_dir, use_proxy, args.workers, desc="重试")
-        if failed > 0:
-            print(f"⚠️ 仍有 {failed} 个学号下载失败")
+    # 直接入库时转换在解析进程里完成，这里不再起转换进程池
+    converter = Converter(0 if args.ingest else args.convert_workers)
+    proxies = args.proxies.split(',') if args.proxies else None
+    workers = args.workers
+    stages = None
+    if args.show_workers or args.servlet_workers:
+        stages = PipelineStages(args.show_workers or args.workers, args.servlet_workers or args.workers)
+        # 两段的并发之和即为连接池和任务窗口的规模
+        workers = sum(stages.limits.values())
+        print(f"🔀 两阶段: showReport 并发 {stages.limits['show_report']} | "
+              f"reportServlet 并发 {stages.limits['report_servlet']}")
+    limiter = None
+    if args.adaptive:
+        limiter = AdaptiveLimiter(args.workers, args.min_workers, args.max_workers)
+        logger.setLevel(logging.INFO)
+        print(f"🎚️ 自适应并发: 初始 {int(limiter.limit)} | 范围 {args.min_workers}-{args.max_workers}")
+    lag_monitor = LoopLagMonitor() if args.loop_lag else None
+    if lag_monitor:
+        lag_monitor.start()
+    metrics = CrawlMetrics() if args.metrics_out else None
+    hedger = Hedger(args.hedge, args.hedge_budget) if args.hedge else None
+    if hedger:
+        print(f"🪁 对冲请求: 超过 p{args.hedge * 100:g} 延迟时补发，额外请求不超过 {args.hedge_budget * 100:g}%")
+    metrics_task = asyncio.ensure_future(_flush_metrics(metrics, args.metrics_out, args.metrics_interval)) \
+        if metrics and args.metrics_interval > 0 else None
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+
+    pool = make_pool(use_proxy, limiter.ceiling if limiter else workers, proxies, args.per_proxy)
+    if use_proxy and len(pool.egresses) > 1:
+        print(f"🌐 出口代理 {len(pool.egresses)} 个，每个并发上限 {pool.egresses[0].limit}")
+
+    sink_error = None
+    try:
+        await sink.start()
+        await pool.start()
+        # 并发下载（启用日志时失败学号在本轮内重试，否则收集起来再补一轮）
+        retry_ids = []
+        success, failed = await batch_download(pending, sink, use_proxy, workers,
+                                               desc="进度", total=total,
+                                               initial=total - pending_count if total is not None else 0,
+                                               converter=converter, limiter=limiter, journal=journal,
+                                               pool=pool, metrics=metrics, window=args.window,
+                                               failed_ids=None if journal else retry_ids, hedger=hedger,
+                                               stages=stages)
+
+        if retry_ids and sink.error is None:
+            print(f"\n🔄 重试 {len(retry_ids)} 个失败学号...")
+            _, failed = await batch_download(retry_ids, sink, use_proxy, workers, desc="重试",
+                                             converter=converter, limiter=limiter, pool=pool,
+                                             metrics=metrics, window=args.window, hedger=hedger, stages=stages)
+            if failed > 0:
+                print(f"⚠️ 仍有 {failed} 个学号下载失败")
+    finally:
+        # 输出端关闭失败（写入/入库出错）时其余清理照常进行，最后再报告
+        try:
+            await sink.close()
+        except Exception as e:
+            sink_error = e
+        await pool.close()
+        converter.close()
+        if use_proxy:
+            print("\n🌐 出口统计:")
+            print("\n".join(pool.report()))
+        if manifest:
+            manifest.save()
+            print(f"\n🧮 新增/变化 {manifest.changed} 个 | 待入库共 {len(manifest.pending)} 个"
+                  f" -> {os.path.abspath(args.manifest)}")
+        if journal:
+            counts = journal.counts()
+            journal.close()
+            print(f"\n📒 日志: 完成 {counts.get('done', 0)} | 待下载 {counts.get('pending', 0) + counts.get('retry', 0)}"
+                  f" | 死信 {counts.get('dead', 0)}")
+            if counts.get('dead'):
+                print(f"   查看死信: python crawl_journal.py {args.journal} --dead")
+        if lag_monitor:
+            await lag_monitor.stop()
+        if stages:
+            print("\n🔀 分阶段吞吐:")
+            print("\n".join(stages.report()))
+        if hedger:
+            print("\n🪁 对冲统计:")
+            print("\n".join(hedger.report()))
+        if metrics:
+            if metrics_task:
+                metrics_task.cancel()
+            metrics.write(args.metrics_out)
+            print(f"\n📊 分阶段耗时:\n{metrics.summary()}")
+            print(f"   -> {os.path.abspath(args.metrics_out)}.json / .prom")
+
+    if lag_monitor:
+        elapsed = loop.time() - started
+        print(f"⏱️ 事件循环延迟: {lag_monitor.summary()} | 吞吐 {success / elapsed if elapsed else 0:.1f} 个/s "
+              f"(并发 {workers}, 转换进程 {args.convert_workers})")
+
+    if sink_error is not None:
+        print(f"❌ 输出端写入失败，已停止下载: {sink_error}")
+        print("   未提交的学号仍为未完成，排除故障后重新运行即可续传")
+        return
+
+    if args.ingest:
+        print(f"✅ 入库完成: {sink.report()}")
+        return
+
+    if args.stream:
+        paths = sink.paths()
+        print(f"✅ 完成! {len(sink.finished())} 个文件 -> {', '.join(os.path.abspath(p) for p in paths)}")
+        return
 
     # 打包ZIP
     print("\n📦 打包中...")
     try:
-        files = [f for f in os.listdir(csv_dir) if f.endswith('.csv') and not f.startswith('.')]
+        files = [f + '.csv' for f in sink.finished()]
 
         with zipfile.ZipFile(zip_name, 'w', zipfile.ZIP_DEFLATED) as zf:
             for f in tqdm(files, desc="打包", unit="个"):
@@ -177,12 +1500,36 @@ async def async_main(args):
         print(f"❌ 打包失败: {e}")
 
 def main():
+    global BASE_URL
     parser = argparse.ArgumentParser(description="批量成绩下载器")
     parser.add_argument('--workers', '-w', type=int, default=DEFAULT_WORKERS, help='并发数')
-    parser.add_argument('--ids', '-i', default='ids.txt', help='学号文件')
+    parser.add_argument('--ids', '-i', default='ids.txt', help='学号文件（- 表示从标准输入逐行读取）')
     parser.add_argument('--proxy', '-p', action='store_true', help='使用代理')
     parser.add_argument('--zip', '-z', default='all_grades.zip', help='输出ZIP文件名')
+    parser.add_argument('--proxies', help='逗号分隔的多个代理地址（覆盖 config.PROXIES）')
+    parser.add_argument('--per-proxy', type=int, help='每个代理的并发上限（默认与 -w 相同，多代理时 -w 为总并发）')
+    parser.add_argument('--base-url', default=BASE_URL, help='报表系统地址（可指向 mock_report_server）')
+    parser.add_argument('--stream', '-s', action='store_true', help='边下载边写入ZIP，不生成 results_csv 目录')
+    parser.add_argument('--manifest', '-m', help='内容哈希清单（JSON），只把新增/变化的成绩单标记为待入库')
+    parser.add_argument('--journal', '-j', help='SQLite 任务日志文件（记录状态，失败学号本轮内退避重试）')
+    parser.add_argument('--max-attempts', type=int, default=5, help='启用日志时每个学号的最大尝试轮数')
+    parser.add_argument('--adaptive', '-a', action='store_true', help='AIMD 自适应并发（-w 作为初始值）')
+    parser.add_argument('--min-workers', type=int, default=20, help='自适应并发下限')
+    parser.add_argument('--max-workers', type=int, default=400, help='自适应并发上限')
+    parser.add_argument('--convert-workers', type=int, default=os.cpu_count(), help='XLS→CSV 转换进程数（0=在事件循环内转换；--ingest 时为解析进程数）')
+    parser.add_argument('--loop-lag', action='store_true', help='结束时报告事件循环延迟和吞吐')
+    parser.add_argument('--ingest', action='store_true', help='下载后直接解析入库（不生成CSV/ZIP），结束时计算排名')
+    parser.add_argument('--batch-size', type=int, default=2000, help='直接入库模式下每批写入的学生数')
+    parser.add_argument('--show-workers', type=int, default=0, help='两阶段模式：showReport.jsp 并发（0=与下载共用 -w）')
+    parser.add_argument('--servlet-workers', type=int, default=0, help='两阶段模式：reportServlet 并发（0=与下载共用 -w）')
+    parser.add_argument('--hedge', type=float, default=0, help='对冲请求的延迟分位（如 0.95，0=关闭）')
+    parser.add_argument('--hedge-budget', type=float, default=0.05, help='对冲额外请求占原始请求的比例上限')
+    parser.add_argument('--window', type=int, default=0, help='同时存在的下载任务数上限（默认并发上限的 2 倍）')
+    parser.add_argument('--metrics-out', help='分阶段指标输出前缀（写 <前缀>.json 和 <前缀>.prom）')
+    parser.add_argument('--metrics-interval', type=float, default=30.0, help='指标定期落盘间隔秒数（0=只在结束时写）')
+    parser.add_argument('--shard-size', type=int, default=0, help='流式模式下每个ZIP分片的文件数（0=不分片）')
     args = parser.parse_args()
+    BASE_URL = args.base_url.rstrip('/')
     asyncio.run(async_main(args))
 
 if __name__ == "__main__":
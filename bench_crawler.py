@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+batch_downloader 离线压测：在子进程中启动 mock_report_server，按 并发数 × 连接方式（直连/代理）扫描，
+输出 学号/s、请求/s、HTTP 请求延迟 p50/p95/p99、每个学号的 CPU 时间，用于离线调 DEFAULT_WORKERS、RETRIES 和超时。
+用法: python bench_crawler.py --count 3000 --workers 50,100,150,200 [--proxy socks5://127.0.0.1:10801]
+      python bench_crawler.py --target http://127.0.0.1:18080/qzbb   # 压测已在运行的模拟服务器
+"""
+import os
+import json
+import time
+import socket
+import asyncio
+import resource
+import argparse
+import multiprocessing
+import aiohttp
+
+import batch_downloader as bd
+from mock_report_server import add_server_args, server_from_args, serve
+
+
+class NullSink:
+    """丢弃结果的输出端，只测下载 + 转换"""
+
+    error = None
+    raw_xls = False
+
+    def has(self, student_id):
+        return False
+
+    def finished(self):
+        return set()
+
+    async def start(self):
+        pass
+
+    async def put(self, student_id, data, digest=None):
+        pass
+
+    async def close(self):
+        pass
+
+
+def cpu_time():
+    """本进程 + 已结束子进程（转换进程池）的 CPU 秒数；模拟服务器子进程运行中不计入"""
+    total = 0.0
+    for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+        ru = resource.getrusage(who)
+        total += ru.ru_utime + ru.ru_stime
+    return total
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * q))]
+
+
+def make_trace(latencies, errors):
+    trace = aiohttp.TraceConfig()
+
+    async def on_start(session, ctx, params):
+        ctx.t0 = time.perf_counter()
+
+    async def on_end(session, ctx, params):
+        latencies.append(time.perf_counter() - ctx.t0)
+
+    async def on_error(session, ctx, params):
+        errors.append(type(params.exception).__name__)
+
+    trace.on_request_start.append(on_start)
+    trace.on_request_end.append(on_end)
+    trace.on_request_exception.append(on_error)
+    return trace
+
+
+async def run_once(ids, workers, proxy, convert_workers):
+    latencies, errors = [], []
+    if proxy:
+        bd.PROXIES = [proxy]
+    converter = bd.Converter(convert_workers)
+    cpu0 = cpu_time()
+    t0 = time.perf_counter()
+    success, failed = await bd.batch_download(
+        ids, NullSink(), bool(proxy), workers, desc=f"w={workers} {'代理' if proxy else '直连'}",
+        converter=converter, trace_configs=[make_trace(latencies, errors)])
+    elapsed = time.perf_counter() - t0
+    converter.close()
+    cpu = cpu_time() - cpu0
+
+    lats = sorted(latencies)
+    return {
+        'workers': workers,
+        'connector': 'proxy' if proxy else 'direct',
+        'students': success,
+        'failed': failed,
+        'seconds': round(elapsed, 3),
+        'students_per_s': round(success / elapsed, 1) if elapsed else 0.0,
+        'requests_per_s': round(len(lats) / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(percentile(lats, 0.50) * 1000, 1),
+        'p95_ms': round(percentile(lats, 0.95) * 1000, 1),
+        'p99_ms': round(percentile(lats, 0.99) * 1000, 1),
+        'cpu_ms_per_student': round(cpu / max(success, 1) * 1000, 2),
+        'request_errors': len(errors),
+    }
+
+
+def _serve_mock(args, port):
+    serve(server_from_args(args), '127.0.0.1', port)
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _wait_port(port, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.2):
+                return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"模拟服务器未能在 {timeout}s 内启动")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='batch_downloader 离线吞吐压测')
+    parser.add_argument('--count', type=int, default=2000, help='每轮下载的学号数')
+    parser.add_argument('--workers', default='50,100,150,200', help='并发数列表（逗号分隔）')
+    parser.add_argument('--proxy', help='额外测一组经该代理的连接（如 socks5://127.0.0.1:10801）')
+    parser.add_argument('--convert-workers', type=int, default=os.cpu_count(), help='转换进程数（0=在事件循环内转换）')
+    parser.add_argument('--retries', type=int, default=bd.RETRIES, help='覆盖 RETRIES')
+    parser.add_argument('--sock-read', type=float, default=bd.TIMEOUT.sock_read, help='覆盖 sock_read 超时（秒）')
+    parser.add_argument('--sock-connect', type=float, default=bd.TIMEOUT.sock_connect, help='覆盖 sock_connect 超时（秒）')
+    parser.add_argument('--target', help='压测已在运行的服务器（不启动内置模拟服务器）')
+    parser.add_argument('--json', help='结果另存为 JSON')
+    add_server_args(parser)
+    args = parser.parse_args()
+
+    bd.RETRIES = args.retries
+    bd.TIMEOUT = aiohttp.ClientTimeout(sock_connect=args.sock_connect, sock_read=args.sock_read)
+
+    mock = None
+    if args.target:
+        bd.BASE_URL = args.target.rstrip('/')
+    else:
+        port = _free_port()
+        mock = multiprocessing.Process(target=_serve_mock, args=(args, port), daemon=True)
+        mock.start()
+        _wait_port(port)
+        bd.BASE_URL = f"http://127.0.0.1:{port}/qzbb"
+    print(f"🧪 目标: {bd.BASE_URL} | 每轮 {args.count} 个学号 | RETRIES={bd.RETRIES} | sock_read={args.sock_read}s")
+
+    ids = [f"2022{i:08d}" for i in range(1, args.count + 1)]
+    connectors = [None] + ([args.proxy] if args.proxy else [])
+    results = []
+    try:
+        for proxy in connectors:
+            for workers in (int(w) for w in args.workers.split(',')):
+                results.append(asyncio.run(run_once(ids, workers, proxy, args.convert_workers)))
+    finally:
+        if mock:
+            mock.terminate()
+            mock.join()
+
+    print(f"\n{'并发':>6} {'连接':>6} {'学号/s':>8} {'请求/s':>8} {'p50ms':>8} {'p95ms':>8} {'p99ms':>8} "
+          f"{'CPU ms/个':>10} {'失败':>6}")
+    for r in results:
+        print(f"{r['workers']:>6} {r['connector']:>6} {r['students_per_s']:>8} {r['requests_per_s']:>8} "
+              f"{r['p50_ms']:>8} {r['p95_ms']:>8} {r['p99_ms']:>8} {r['cpu_ms_per_student']:>10} {r['failed']:>6}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\n📄 {args.json}")
+
+
+if __name__ == '__main__':
+    main()
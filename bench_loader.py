@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+入库吞吐压测：同一批模拟成绩分别用原来的多行 INSERT ... ON CONFLICT（--loader insert）
+和 COPY + 集合式 Upsert（--loader copy）写入，输出 行/s。
+写入在独立的 bench_loader schema 中进行（结构与正式表相同），结束后整体删除，不影响正式数据。
+每种方式测两轮：首轮为全新插入，次轮同样的数据再写一遍，走冲突更新分支。
+用法: python bench_loader.py --students 20000 --batch-size 2000
+"""
+import io
+import csv
+import json
+import time
+import argparse
+from sqlalchemy import create_engine, text
+
+from grade_manager import GradeManager, DB_URI, parse_grade_sheet
+from mock_report_server import build_sheet_rows
+
+SCHEMA = 'bench_loader'
+
+
+def build_records(count):
+    """按真实成绩单版式生成并解析 count 个学生"""
+    students, courses = [], []
+    for i in range(1, count + 1):
+        cells = build_sheet_rows(f"2022{i:08d}")
+        rows = [[''] * 16 for _ in range(62)]
+        for (r, c), v in cells.items():
+            rows[r][c] = v
+        buf = io.StringIO()
+        csv.writer(buf).writerows(rows)
+        student, student_courses = parse_grade_sheet(buf.getvalue().encode('utf-8-sig'))
+        if student:
+            students.append(student)
+            courses.extend(student_courses)
+    return students, courses
+
+
+def run(manager, students, courses, batch_size):
+    """按流水线的方式分批 write_batch，返回耗时（秒）"""
+    by_student = {}
+    for c in courses:
+        by_student.setdefault(c['s_id'], []).append(c)
+    t0 = time.perf_counter()
+    for i in range(0, len(students), batch_size):
+        batch = students[i:i+batch_size]
+        manager.write_batch(batch, [c for s in batch for c in by_student.get(s['s_id'], ())])
+    return time.perf_counter() - t0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='COPY 与多行 INSERT 入库吞吐对比')
+    parser.add_argument('--students', type=int, default=20000, help='模拟学生数')
+    parser.add_argument('--batch-size', type=int, default=2000, help='每次 write_batch 的学生数')
+    parser.add_argument('--json', help='结果另存为 JSON')
+    args = parser.parse_args()
+
+    print(f"🧪 生成 {args.students} 个模拟学生...")
+    students, courses = build_records(args.students)
+    print(f"📊 学生 {len(students)} | 课程 {len(courses)}")
+
+    # 所有连接的 search_path 只有 bench_loader：建表、写入和 compact 检测都不会碰到正式表
+    admin = create_engine(DB_URI, pool_pre_ping=True)
+    engine = create_engine(DB_URI, pool_pre_ping=True,
+                           connect_args={'options': f'-csearch_path={SCHEMA}'})
+
+    results = []
+    try:
+        for loader in ('insert', 'copy'):
+            with admin.begin() as conn:
+                conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+                conn.execute(text(f"CREATE SCHEMA {SCHEMA}"))
+            # 在空 schema 中由 create_all 建成普通表
+            manager = GradeManager(loader=loader, engine=engine)
+            for phase in ('insert', 'update'):
+                elapsed = run(manager, students, courses, args.batch_size)
+                rows = len(students) + len(courses)
+                results.append({'loader': loader, 'phase': phase, 'rows': rows, 'seconds': round(elapsed, 3),
+                                'rows_per_s': round(rows / elapsed, 1)})
+                print(f"   {loader:>6} {phase:>6}: {elapsed:.2f}s | {rows / elapsed:,.0f} 行/s")
+    finally:
+        engine.dispose()
+        with admin.begin() as conn:
+            conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+        admin.dispose()
+
+    base = {r['phase']: r['rows_per_s'] for r in results if r['loader'] == 'insert'}
+    print(f"\n{'方式':>8} {'阶段':>8} {'行数':>10} {'行/s':>12} {'加速比':>8} {'耗时s':>8}")
+    for r in results:
+        r['speedup'] = round(r['rows_per_s'] / base[r['phase']], 2) if base.get(r['phase']) else 0.0
+        print(f"{r['loader']:>8} {r['phase']:>8} {r['rows']:>10} {r['rows_per_s']:>12} {r['speedup']:>8} {r['seconds']:>8}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\n📄 {args.json}")
+
+
+if __name__ == '__main__':
+    main()
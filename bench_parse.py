@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+grade_manager 解析吞吐压测（不连数据库）：对同一个成绩 ZIP 分别用
+原来的 80 线程 + 全局读锁方式、80 线程无锁读取（zip_reader）和 1、2、4…CPU核心数 个进程解析，输出 文件/s 和相对单进程的加速比。
+--memory 改为用 tracemalloc 比较汇总全部解析结果时的峰值内存和存活分配块数：
+原来的每条成绩一个 dict 与 columnar.CourseColumns 列式缓冲。
+用法: python bench_parse.py --zip all_grades.zip
+      python bench_parse.py --count 20000            # 没有真实数据时用 mock_report_server 的版式生成
+      python bench_parse.py --count 30000 --memory
+"""
+import io
+import os
+import csv
+import json
+import time
+import zipfile
+import argparse
+import tempfile
+import threading
+import tracemalloc
+import concurrent.futures
+
+from grade_manager import GradeParser, PARSE_CHUNK, _init_worker, _parse_chunk, parse_grade_sheet
+from columnar import CourseColumns
+from zip_reader import ZipReader
+from mock_report_server import build_sheet_rows
+
+
+def build_zip(path, count):
+    """按真实成绩单版式生成 count 个 CSV（与 xlrd 转换结果同样的 utf-8-sig 编码）"""
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for i in range(1, count + 1):
+            sid = f"2022{i:08d}"
+            cells = build_sheet_rows(sid)
+            rows = [[''] * 16 for _ in range(62)]
+            for (r, c), v in cells.items():
+                rows[r][c] = v
+            buf = io.StringIO()
+            csv.writer(buf).writerows(rows)
+            zf.writestr(f"{sid}.csv", buf.getvalue().encode('utf-8-sig'))
+
+
+def parse_threads(zip_path, names):
+    """原实现：80 线程，所有读取经过同一把锁"""
+    parser = GradeParser()
+    lock = threading.Lock()
+    parsed = 0
+    with zipfile.ZipFile(zip_path, 'r') as z:
+        def work(name):
+            with lock:
+                content = z.read(name)
+            return parser.parse_csv_grade(content)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=80) as executor:
+            for student, _ in executor.map(work, names):
+                parsed += student is not None
+    return parsed
+
+
+def parse_threads_mmap(zip_path, names):
+    """80 线程，经 zip_reader 无锁并发读取解压"""
+    parser = GradeParser()
+    parsed = 0
+    with ZipReader(zip_path) as z:
+        def work(name):
+            return parser.parse_csv_grade(z.read(name))
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=80) as executor:
+            for student, _ in executor.map(work, names):
+                parsed += student is not None
+    return parsed
+
+
+def parse_processes(zip_path, names, workers):
+    chunks = [names[i:i+PARSE_CHUNK] for i in range(0, len(names), PARSE_CHUNK)]
+    parsed = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                                initargs=(zip_path,)) as executor:
+        for students, _, _ in executor.map(_parse_chunk, chunks):
+            parsed += len(students)
+    return parsed
+
+
+def collect_dicts(zip_path, names):
+    """原来的汇总方式：学生和每条成绩各一个 dict"""
+    all_students, all_courses = [], []
+    with zipfile.ZipFile(zip_path, 'r') as z:
+        for name in names:
+            student, courses = parse_grade_sheet(z.read(name))
+            if student:
+                all_students.append(student)
+                all_courses.extend(courses)
+    return all_students, all_courses
+
+
+def collect_columns(zip_path, names):
+    """列式汇总：与 save_from_zip 相同，按解析分组取回 CourseColumns 再合并"""
+    _init_worker(zip_path)
+    all_students, all_courses = [], CourseColumns()
+    for i in range(0, len(names), PARSE_CHUNK):
+        students, courses, _ = _parse_chunk(names[i:i+PARSE_CHUNK])
+        all_students.extend(students)
+        all_courses.extend(courses)
+    return all_students, all_courses
+
+
+def measure_memory(collect, zip_path, names):
+    """在 tracemalloc 下汇总全部解析结果，返回 (成绩条数, 峰值字节, 汇总结果存活的分配块数, 耗时)"""
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    students, courses = collect(zip_path, names)
+    elapsed = time.perf_counter() - t0
+    peak = tracemalloc.get_traced_memory()[1]
+    blocks = sum(stat.count for stat in tracemalloc.take_snapshot().statistics('filename'))
+    tracemalloc.stop()
+    count = len(courses)
+    del students, courses
+    return count, peak, blocks, elapsed
+
+
+def run_memory(zip_path, names):
+    # 先不计量地完整解析一遍：pypinyin 导入、拼音缓存和单元格缓存对两种方式都已就绪，
+    # 否则先测的一方要替后测的一方承担这些，只比较汇总结果本身
+    collect_dicts(zip_path, names)
+    results = []
+    for mode, collect in (('dicts', collect_dicts), ('columns', collect_columns)):
+        count, peak, blocks, elapsed = measure_memory(collect, zip_path, names)
+        results.append({'mode': mode, 'courses': count, 'peak_mb': round(peak / 2**20, 1),
+                        'live_blocks': blocks, 'seconds': round(elapsed, 3)})
+    base = results[0]
+    print(f"\n{'方式':>8} {'成绩条数':>10} {'峰值MB':>10} {'存活块数':>12} {'耗时s':>8}")
+    for r in results:
+        print(f"{r['mode']:>8} {r['courses']:>10} {r['peak_mb']:>10} {r['live_blocks']:>12} {r['seconds']:>8}")
+    last = results[-1]
+    if last['peak_mb'] and last['live_blocks']:
+        print(f"📉 峰值内存 {base['peak_mb'] / last['peak_mb']:.1f}x | 分配块数 {base['live_blocks'] / last['live_blocks']:.1f}x")
+    return results
+
+
+def worker_counts(limit):
+    counts, n = [], 1
+    while n < limit:
+        counts.append(n)
+        n *= 2
+    counts.append(limit)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description='成绩单解析吞吐压测')
+    parser.add_argument('--zip', help='成绩ZIP（不指定则生成模拟数据）')
+    parser.add_argument('--count', type=int, default=10000, help='生成的模拟成绩单数量')
+    parser.add_argument('--max-workers', type=int, default=os.cpu_count(), help='最多测到多少个进程')
+    parser.add_argument('--memory', action='store_true', help='改为比较汇总解析结果的峰值内存和分配块数')
+    parser.add_argument('--json', help='结果另存为 JSON')
+    args = parser.parse_args()
+
+    tmp = None
+    zip_path = args.zip
+    if not zip_path:
+        tmp = tempfile.NamedTemporaryFile(suffix='.zip', delete=False)
+        tmp.close()
+        zip_path = tmp.name
+        print(f"🧪 生成 {args.count} 个模拟成绩单...")
+        build_zip(zip_path, args.count)
+
+    try:
+        with zipfile.ZipFile(zip_path, 'r') as z:
+            names = [f for f in z.namelist() if f.lower().endswith('.csv')]
+        print(f"📊 {len(names)} 个文件 | CPU {os.cpu_count()} 核")
+        if args.memory:
+            results = run_memory(zip_path, names)
+            if args.json:
+                with open(args.json, 'w', encoding='utf-8') as f:
+                    json.dump(results, f, ensure_ascii=False, indent=2)
+                print(f"\n📄 {args.json}")
+            return
+
+        results = []
+        t0 = time.perf_counter()
+        parsed = parse_threads(zip_path, names)
+        elapsed = time.perf_counter() - t0
+        results.append({'mode': 'threads-80', 'workers': 80, 'parsed': parsed, 'seconds': round(elapsed, 3),
+                        'files_per_s': round(len(names) / elapsed, 1)})
+        t0 = time.perf_counter()
+        parsed = parse_threads_mmap(zip_path, names)
+        elapsed = time.perf_counter() - t0
+        results.append({'mode': 'threads-mmap', 'workers': 80, 'parsed': parsed, 'seconds': round(elapsed, 3),
+                        'files_per_s': round(len(names) / elapsed, 1)})
+
+        for workers in worker_counts(args.max_workers):
+            t0 = time.perf_counter()
+            parsed = parse_processes(zip_path, names, workers)
+            elapsed = time.perf_counter() - t0
+            results.append({'mode': 'processes', 'workers': workers, 'parsed': parsed,
+                            'seconds': round(elapsed, 3), 'files_per_s': round(len(names) / elapsed, 1)})
+    finally:
+        if tmp:
+            os.remove(zip_path)
+
+    base = next(r['files_per_s'] for r in results if r['mode'] == 'processes')
+    print(f"\n{'方式':>12} {'并发':>6} {'解析数':>8} {'文件/s':>10} {'加速比':>8} {'耗时s':>8}")
+    for r in results:
+        r['speedup'] = round(r['files_per_s'] / base, 2) if base else 0.0
+        print(f"{r['mode']:>12} {r['workers']:>6} {r['parsed']:>8} {r['files_per_s']:>10} {r['speedup']:>8} {r['seconds']:>8}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\n📄 {args.json}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+PostgreSQL COPY 批量写入：行数据经 COPY 流入临时暂存表，再用一条 INSERT ... SELECT ... ON CONFLICT
+合并进目标表，替代逐批编译、绑定参数的多行 INSERT。grade_manager / import_teacher / import_recommendation 共用。
+暂存表为 TEMP 表（不写 WAL、只对当前连接可见、事务结束自动删除），与调用方的事务一起提交或回滚。
+"""
+
+# 各表的默认列、冲突键和冲突时更新的列
+SPECS = {
+    'student': {
+        'columns': ('s_id', 's_name', 's_college', 's_major', 's_grade', 's_class', 's_avg', 's_gpa', 's_py'),
+        'key': ('s_id',),
+        'update': ('s_name', 's_college', 's_major', 's_grade', 's_class', 's_avg', 's_gpa', 's_py'),
+    },
+    'course_score': {
+        'columns': ('s_id', 'c_term', 'c_name', 'c_score', 'c_type', 'c_hours', 'c_credit', 'c_pass'),
+        'key': ('s_id', 'c_term', 'c_name'),
+        'update': ('c_score', 'c_type', 'c_hours', 'c_credit', 'c_pass'),
+    },
+    # compact_course 迁移后的紧凑成绩表：课程名换成 course_name.c_id，学期、学时为 SMALLINT
+    'course_score_compact': {
+        'columns': ('s_id', 'c_term', 'c_id', 'c_score', 'c_type', 'c_hours', 'c_credit', 'c_pass'),
+        'key': ('s_id', 'c_term', 'c_id'),
+        'update': ('c_score', 'c_type', 'c_hours', 'c_credit', 'c_pass'),
+    },
+    'course_name': {
+        'columns': ('c_name',),
+        'key': ('c_name',),
+        'update': (),
+    },
+    'recommendation': {
+        'columns': ('s_id', 'year', 'name', 'gender', 'political', 'college', 'major', 'course_gpa', 'course_avg',
+                    'perf_score', 'comp_score', 'comp_rank', 'major_total', 'remark'),
+        'key': ('s_id', 'year'),
+        'update': ('name', 'gender', 'political', 'college', 'major', 'course_gpa', 'course_avg',
+                   'perf_score', 'comp_score', 'comp_rank', 'major_total', 'remark'),
+    },
+}
+
+
+def _copy_value(v):
+    """COPY text 格式的单元格：None → \\N，转义反斜杠、制表符和换行"""
+    if v is None:
+        return '\\N'
+    if isinstance(v, float):
+        return repr(v)
+    s = str(v)
+    if '\\' in s or '\t' in s or '\n' in s or '\r' in s:
+        s = s.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+    return s
+
+
+class _CopyStream:
+    """把行迭代器包装成 copy_expert 需要的 read(size)，边生成边发送，不在内存中拼出整个数据块。
+    rows 为 dict 的可迭代对象，或带 copy_lines 的列式缓冲（columnar.CourseColumns）"""
+
+    def __init__(self, rows, columns):
+        if hasattr(rows, 'copy_lines'):
+            self._lines = rows.copy_lines(columns, _copy_value)
+        else:
+            self._lines = ('\t'.join(_copy_value(row[c]) for c in columns) + '\n' for row in rows)
+        self._pending = ''
+        self.rows = 0
+
+    def read(self, size=-1):
+        parts = [self._pending]
+        length = len(self._pending)
+        while size < 0 or length < size:
+            line = next(self._lines, None)
+            if line is None:
+                break
+            parts.append(line)
+            length += len(line)
+            self.rows += 1
+        data = ''.join(parts)
+        if 0 <= size < len(data):
+            data, self._pending = data[:size], data[size:]
+        else:
+            self._pending = ''
+        return data
+
+
+def upsert(conn, table, rows, columns=None, key=None, update=None, returning=False):
+    """
+    COPY + 集合式 Upsert。conn 为 DB-API（psycopg2）连接，可由 SQLAlchemy 的
+    session.connection().connection 或 Connection.connection 取得，写入随调用方的事务提交。
+    update 为空元组时冲突即忽略（DO NOTHING）；冲突行的 update 列与现有值完全相同时不改写。
+    返回写入暂存表的行数；returning=True 时改为返回新插入或确有改动的行的键元组列表。
+    """
+    spec = SPECS.get(table, {})
+    columns = tuple(columns or spec['columns'])
+    key = tuple(key or spec['key'])
+    update = tuple(spec['update'] if update is None else update)
+    stage = f"_stage_{table}"
+    cols = ', '.join(columns)
+
+    cur = conn.cursor()
+    try:
+        cur.execute(f"DROP TABLE IF EXISTS pg_temp.{stage}")
+        cur.execute(f"CREATE TEMP TABLE {stage} ON COMMIT DROP AS SELECT {cols} FROM {table} WITH NO DATA")
+        # 行号按 COPY 顺序递增，批内重复的键保留最后一行（与逐行 Upsert 后写覆盖先写一致）
+        cur.execute(f"ALTER TABLE {stage} ADD COLUMN _stage_row BIGINT GENERATED ALWAYS AS IDENTITY")
+        stream = _CopyStream(rows, columns)
+        cur.copy_expert(f"COPY {stage} ({cols}) FROM STDIN", stream)
+        if not stream.rows:
+            return [] if returning else 0
+
+        # 同一批内重复的键只保留最后一行，否则 ON CONFLICT DO UPDATE 会报“不能二次修改同一行”
+        if update:
+            action = ("DO UPDATE SET " + ', '.join(f"{c} = EXCLUDED.{c}" for c in update) +
+                      f" WHERE ({', '.join(f'{table}.{c}' for c in update)}) IS DISTINCT FROM "
+                      f"({', '.join(f'EXCLUDED.{c}' for c in update)})")
+        else:
+            action = "DO NOTHING"
+        sql = (f"INSERT INTO {table} ({cols}) "
+               f"SELECT DISTINCT ON ({', '.join(key)}) {cols} FROM {stage} "
+               f"ORDER BY {', '.join(key)}, _stage_row DESC "
+               f"ON CONFLICT ({', '.join(key)}) {action}")
+        if returning:
+            sql += f" RETURNING {', '.join(key)}"
+        cur.execute(sql)
+        changed = cur.fetchall() if returning else None
+        cur.execute(f"DROP TABLE pg_temp.{stage}")
+        return changed if returning else stream.rows
+    finally:
+        cur.close()
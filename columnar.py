@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+课程成绩的列式缓冲：入库路径上不再为每条成绩保留一个 dict，而是按列存放——
+字符串列做字典编码（每个不同的值只存一份，行里只存 array('I') 编号），数值列为 array('d') / array('b')。
+全校约百万条成绩在内存中只剩十几个数组和几万个不重复的字符串（学号、学期、课程名、类型、学时）。
+缓冲可直接交给 bulk_loader.upsert（COPY 时每个不重复的字符串只转义一次）；解析子进程按分组返回缓冲，
+pickle 后也只是几段连续字节。
+"""
+from array import array
+
+
+class StringColumn:
+    """字典编码的字符串列：values 为不重复的值，codes 为每行的值编号"""
+
+    def __init__(self):
+        self.values = []
+        self.codes = array('I')
+        self._index = {}
+
+    def _code(self, s):
+        code = self._index.get(s)
+        if code is None:
+            code = self._index[s] = len(self.values)
+            self.values.append(s)
+        return code
+
+    def append(self, s):
+        self.codes.append(self._code(s))
+
+    def extend(self, other):
+        """追加另一列，其编号按本列的字典重映射"""
+        remap = [self._code(s) for s in other.values]
+        self.codes.extend(map(remap.__getitem__, other.codes))
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, i):
+        return self.values[self.codes[i]]
+
+    def __iter__(self):
+        return map(self.values.__getitem__, self.codes)
+
+    # 跨进程传递时不带反查字典，接收端重建
+    def __getstate__(self):
+        return self.values, self.codes
+
+    def __setstate__(self, state):
+        self.values, self.codes = state
+        self._index = {s: i for i, s in enumerate(self.values)}
+
+
+class CourseColumns:
+    """course_score 行的列式缓冲，列名与 parse_grade_sheet 返回的课程 dict 相同"""
+
+    STRINGS = ('s_id', 'c_term', 'c_name', 'c_type', 'c_hours')
+    NUMBERS = {'c_credit': 'd', 'c_score': 'd', 'c_pass': 'b'}
+
+    def __init__(self, records=()):
+        self.columns = {name: StringColumn() for name in self.STRINGS}
+        self.columns.update((name, array(code)) for name, code in self.NUMBERS.items())
+        self.extend(records)
+
+    def append(self, course):
+        for name, column in self.columns.items():
+            column.append(course[name])
+
+    def extend(self, records):
+        """追加另一个 CourseColumns，或课程 dict 的可迭代对象"""
+        if isinstance(records, CourseColumns):
+            for name, column in self.columns.items():
+                column.extend(records.columns[name])
+            return
+        for course in records:
+            self.append(course)
+
+    def __len__(self):
+        return len(self.columns['c_name'])
+
+    def __iter__(self):
+        """逐行产出 dict（只在需要 dict 的地方临时生成，例如 --loader insert）"""
+        names = tuple(self.columns)
+        return (dict(zip(names, row)) for row in zip(*self.columns.values()))
+
+    def records(self, start=0, stop=None):
+        """[start, stop) 行转为 dict 列表"""
+        names = tuple(self.columns)
+        cols = [self.columns[n][start:stop] if n in self.NUMBERS else
+                map(self.columns[n].values.__getitem__, self.columns[n].codes[start:stop]) for n in names]
+        return [dict(zip(names, row)) for row in zip(*cols)]
+
+    def distinct(self, name):
+        """字符串列中不重复的值"""
+        return list(self.columns[name].values)
+
+    def copy_lines(self, columns, fmt):
+        """按 columns 顺序生成 COPY text 格式的行；字符串列的每个不重复值只经 fmt 转换一次"""
+        cols = []
+        for name in columns:
+            column = self.columns[name]
+            if isinstance(column, StringColumn):
+                cols.append(map([fmt(v) for v in column.values].__getitem__, column.codes))
+            else:
+                cols.append(map(fmt, column))
+        return ('\t'.join(row) + '\n' for row in zip(*cols))
+
+
+def as_columns(courses):
+    """课程 dict 列表 → CourseColumns（已是 CourseColumns 时原样返回）"""
+    return courses if isinstance(courses, CourseColumns) else CourseColumns(courses)
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+批量下载的 SQLite 任务日志：记录每个学号的状态、尝试次数、最近 HTTP 状态、大小、内容哈希和时间戳。
+完成记录带输出端提交时的段号（epoch），续传时只需核对输出端最后确认的段之后的记录。
+失败学号按带抖动的指数退避在本轮内重试，超过次数进入死信（dead）。
+用法: python crawl_journal.py crawl.db [--dead] [--requeue-dead]
+"""
+import os
+import time
+import random
+import sqlite3
+import argparse
+
+# 状态：pending 待下载 / retry 等待重试 / done 完成 / dead 多次失败放弃
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    s_id TEXT PRIMARY KEY,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_status INTEGER,
+    last_error TEXT,
+    size INTEGER,
+    sha256 TEXT,
+    epoch INTEGER,
+    next_retry_at REAL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+-- 部分索引只覆盖未完成的学号，续传时查询代价与待处理数成正比
+CREATE INDEX IF NOT EXISTS idx_jobs_unfinished ON jobs(state) WHERE state != 'done';
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class Journal:
+    def __init__(self, path, max_attempts=5, base_delay=2.0, max_delay=300.0, commit_every=500):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.commit_every = commit_every
+        self._conn = sqlite3.connect(path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        # 旧版本日志没有段号列：补列，已有的完成记录段号为空，续传时核对一次
+        if 'epoch' not in {r[1] for r in self._conn.execute("PRAGMA table_info(jobs)")}:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN epoch INTEGER")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_epoch ON jobs(epoch) WHERE state = 'done'")
+        self._dirty = 0
+        self._retry_delays = {}
+
+    def add(self, ids_path, student_ids):
+        """登记学号列表；同一个 ids 文件未变化时跳过，重启不必重扫全部学号"""
+        st = os.stat(ids_path)
+        stamp = f"{os.path.abspath(ids_path)}:{st.st_size}:{st.st_mtime_ns}"
+        row = self._conn.execute("SELECT value FROM meta WHERE key = 'ids_file'").fetchone()
+        if row and row[0] == stamp:
+            return 0
+        now = time.time()
+        before = self._conn.total_changes
+        self._conn.executemany(
+            "INSERT OR IGNORE INTO jobs (s_id, created_at, updated_at) VALUES (?, ?, ?)",
+            ((sid, now, now) for sid in student_ids))
+        added = self._conn.total_changes - before
+        self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('ids_file', ?)", (stamp,))
+        self._conn.commit()
+        return added
+
+    def pending(self):
+        """未完成的学号（pending + retry），重启后 retry 状态立即重新下载"""
+        return [r[0] for r in self._conn.execute(
+            "SELECT s_id FROM jobs WHERE state IN ('pending', 'retry') ORDER BY s_id")]
+
+    def unconfirmed(self):
+        """没有段号的完成记录（旧版本日志），只在第一次续传时存在"""
+        return [r[0] for r in self._conn.execute("SELECT s_id FROM jobs WHERE state = 'done' AND epoch IS NULL")]
+
+    def digests(self):
+        """已完成学号记录的内容哈希 (学号, sha256)"""
+        return self._conn.execute("SELECT s_id, sha256 FROM jobs WHERE state = 'done' AND sha256 IS NOT NULL")
+
+    def requeue(self, student_ids):
+        """把学号放回待下载（例如日志记为完成但输出端中没有）"""
+        now = time.time()
+        self._conn.executemany(
+            "UPDATE jobs SET state = 'pending', next_retry_at = NULL, updated_at = ? WHERE s_id = ?",
+            ((now, sid) for sid in student_ids))
+        self._conn.commit()
+
+    def requeue_after(self, epoch):
+        """段号大于 epoch（输出端无法确认）的完成记录放回待下载，返回数量；走段号索引，代价与放回数成正比"""
+        cur = self._conn.execute(
+            "UPDATE jobs SET state = 'pending', next_retry_at = NULL, updated_at = ? WHERE state = 'done' AND epoch > ?",
+            (time.time(), epoch))
+        self._conn.commit()
+        return cur.rowcount
+
+    def confirm(self, student_ids, epoch_of):
+        """给核对过确实在输出端中的完成记录补上段号（epoch_of: 学号 → 其所在的段号）"""
+        self._conn.executemany("UPDATE jobs SET epoch = ? WHERE s_id = ?",
+                               ((epoch_of(sid), sid) for sid in student_ids))
+        self._conn.commit()
+
+    def counts(self):
+        return dict(self._conn.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state"))
+
+    def dead(self):
+        return self._conn.execute(
+            "SELECT s_id, attempts, last_status, last_error FROM jobs WHERE state = 'dead' ORDER BY s_id").fetchall()
+
+    def requeue_dead(self):
+        cur = self._conn.execute(
+            "UPDATE jobs SET state = 'pending', attempts = 0, next_retry_at = NULL, updated_at = ? WHERE state = 'dead'",
+            (time.time(),))
+        self._conn.commit()
+        return cur.rowcount
+
+    def mark_done(self, student_id, size=None, digest=None, status=200, epoch=0):
+        """epoch 为输出端提交该学号时的段号（没有分段的输出端为 0）"""
+        self._conn.execute(
+            "UPDATE jobs SET state = 'done', attempts = attempts + 1, last_status = ?, last_error = NULL, "
+            "size = ?, sha256 = ?, epoch = ?, next_retry_at = NULL, updated_at = ? WHERE s_id = ?",
+            (status, size, digest, epoch, time.time(), student_id))
+        self._touch()
+
+    def mark_many_done(self, student_ids, epoch_of=None):
+        """输出端已有但日志中未完成的学号（例如从旧目录续传）直接标记完成，段号取其所在的段"""
+        now = time.time()
+        self._conn.executemany(
+            "UPDATE jobs SET state = 'done', epoch = ?, updated_at = ? WHERE s_id = ?",
+            ((epoch_of(sid) if epoch_of else 0, now, sid) for sid in student_ids))
+        self._conn.commit()
+
+    def mark_failed(self, student_id, status=None, error=None):
+        """记录一次失败；未超过次数时安排带抖动的指数退避重试，否则进入死信"""
+        row = self._conn.execute("SELECT attempts FROM jobs WHERE s_id = ?", (student_id,)).fetchone()
+        attempts = (row[0] if row else 0) + 1
+        now = time.time()
+        if attempts < self.max_attempts:
+            delay = min(self.max_delay, self.base_delay * (2 ** (attempts - 1))) * random.uniform(0.5, 1.5)
+            state, next_at = 'retry', now + delay
+            self._retry_delays[student_id] = delay
+        else:
+            state, next_at = 'dead', None
+            self._retry_delays.pop(student_id, None)
+        self._conn.execute(
+            "INSERT INTO jobs (s_id, state, attempts, last_status, last_error, next_retry_at, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(s_id) DO UPDATE SET state = excluded.state, attempts = excluded.attempts, "
+            "last_status = excluded.last_status, last_error = excluded.last_error, "
+            "next_retry_at = excluded.next_retry_at, updated_at = excluded.updated_at",
+            (student_id, state, attempts, status, (error or '')[:500], next_at, now, now))
+        self._touch()
+
+    def take_retry(self, student_id):
+        """取出 mark_failed 安排的重试延迟（秒），已进入死信返回 None"""
+        return self._retry_delays.pop(student_id, None)
+
+    def _touch(self):
+        self._dirty += 1
+        if self._dirty >= self.commit_every:
+            self.commit()
+
+    def commit(self):
+        self._conn.commit()
+        self._dirty = 0
+
+    def close(self):
+        self.commit()
+        self._conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='查看 / 维护批量下载任务日志')
+    parser.add_argument('journal', help='SQLite 日志文件')
+    parser.add_argument('--dead', action='store_true', help='列出死信学号')
+    parser.add_argument('--requeue-dead', action='store_true', help='把死信学号重新放回待下载')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.journal):
+        print(f"❌ 未找到文件: {args.journal}")
+        return
+
+    journal = Journal(args.journal)
+    try:
+        counts = journal.counts()
+        print("📒 " + " | ".join(f"{k}: {v}" for k, v in sorted(counts.items())))
+        if args.dead:
+            for sid, attempts, status, error in journal.dead():
+                print(f"   {sid} | 尝试 {attempts} 次 | HTTP {status or '-'} | {error}")
+        if args.requeue_dead:
+            print(f"🔄 已重新排队 {journal.requeue_dead()} 个死信学号")
+    finally:
+        journal.close()
+
+
+if __name__ == '__main__':
+    main()
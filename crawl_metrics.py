@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+批量下载的分阶段指标：排队等待、showReport.jsp、reportServlet、XLS→CSV 转换、写入输出端 的耗时直方图，
+按阶段和 HTTP 状态统计的重试次数、最终失败数、传输字节数。
+结果写成 JSON 摘要和 Prometheus 文本格式（.prom），后者可直接放进 node_exporter 的 textfile 目录。
+"""
+import os
+import json
+import time
+
+PHASES = ('queue_wait', 'show_report', 'report_servlet', 'convert', 'write')
+PHASE_NAMES = {'queue_wait': '排队', 'show_report': 'showReport', 'report_servlet': 'reportServlet',
+               'convert': '转换', 'write': '写入'}
+# 直方图桶上界（秒），覆盖本地毫秒级到 sock_read 超时
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    def __init__(self, bounds=BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)   # 最后一格为 +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        i = 0
+        while i < len(self.bounds) and value > self.bounds[i]:
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        """按桶估计分位数（返回所在桶的上界，不超过观测到的最大值）"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= rank and c:
+                return min(self.bounds[i], self.max) if i < len(self.bounds) else self.max
+        return self.max
+
+
+class CrawlMetrics:
+    def __init__(self):
+        self.phases = {p: Histogram() for p in PHASES}
+        self.retries = {}    # (阶段, 状态) -> 次数；网络错误的状态为异常类型名
+        self.failures = {}   # 最终失败的状态 -> 学号数
+        self.bytes = {'xls': 0, 'csv': 0}
+        self.students = {'ok': 0, 'failed': 0}
+        self.started = time.time()
+
+    def observe(self, phase, seconds):
+        self.phases[phase].observe(seconds)
+
+    def retry(self, phase, status):
+        key = (phase, str(status))
+        self.retries[key] = self.retries.get(key, 0) + 1
+
+    def done(self, xls_bytes, csv_bytes):
+        self.students['ok'] += 1
+        self.bytes['xls'] += xls_bytes
+        self.bytes['csv'] += csv_bytes
+
+    def failed(self, status):
+        self.students['failed'] += 1
+        key = str(status) if status is not None else 'error'
+        self.failures[key] = self.failures.get(key, 0) + 1
+
+    def to_dict(self):
+        elapsed = time.time() - self.started
+        phases = {}
+        for name, h in self.phases.items():
+            phases[name] = {
+                'count': h.count,
+                'sum_s': round(h.sum, 3),
+                'mean_ms': round(h.sum / h.count * 1000, 1) if h.count else 0.0,
+                'p50_ms': round(h.quantile(0.50) * 1000, 1),
+                'p95_ms': round(h.quantile(0.95) * 1000, 1),
+                'p99_ms': round(h.quantile(0.99) * 1000, 1),
+                'max_ms': round(h.max * 1000, 1),
+                'buckets': {**{str(b): c for b, c in zip(h.bounds, h.counts)}, '+Inf': h.counts[-1]},
+            }
+        retries = {}
+        for (phase, status), n in sorted(self.retries.items()):
+            retries.setdefault(phase, {})[status] = n
+        return {
+            'elapsed_s': round(elapsed, 3),
+            'students': dict(self.students),
+            'students_per_s': round(self.students['ok'] / elapsed, 2) if elapsed else 0.0,
+            'bytes': dict(self.bytes),
+            'retries': retries,
+            'failures': dict(sorted(self.failures.items())),
+            'phases': phases,
+        }
+
+    def to_prometheus(self):
+        lines = [
+            '# HELP batch_crawler_phase_seconds Time spent per student in each crawler phase.',
+            '# TYPE batch_crawler_phase_seconds histogram',
+        ]
+        for name, h in self.phases.items():
+            cumulative = 0
+            for bound, c in zip(h.bounds, h.counts):
+                cumulative += c
+                lines.append(f'batch_crawler_phase_seconds_bucket{{phase="{name}",le="{bound}"}} {cumulative}')
+            lines.append(f'batch_crawler_phase_seconds_bucket{{phase="{name}",le="+Inf"}} {h.count}')
+            lines.append(f'batch_crawler_phase_seconds_sum{{phase="{name}"}} {h.sum:.6f}')
+            lines.append(f'batch_crawler_phase_seconds_count{{phase="{name}"}} {h.count}')
+        lines += ['# HELP batch_crawler_retries_total Retried request attempts by phase and status.',
+                  '# TYPE batch_crawler_retries_total counter']
+        for (phase, status), n in sorted(self.retries.items()):
+            lines.append(f'batch_crawler_retries_total{{phase="{phase}",status="{status}"}} {n}')
+        lines += ['# HELP batch_crawler_failures_total Students that failed after all retries, by last status.',
+                  '# TYPE batch_crawler_failures_total counter']
+        for status, n in sorted(self.failures.items()):
+            lines.append(f'batch_crawler_failures_total{{status="{status}"}} {n}')
+        lines += ['# HELP batch_crawler_students_total Students processed by result.',
+                  '# TYPE batch_crawler_students_total counter']
+        for result, n in self.students.items():
+            lines.append(f'batch_crawler_students_total{{result="{result}"}} {n}')
+        lines += ['# HELP batch_crawler_bytes_total Bytes downloaded (xls) and written (csv).',
+                  '# TYPE batch_crawler_bytes_total counter']
+        for kind, n in self.bytes.items():
+            lines.append(f'batch_crawler_bytes_total{{kind="{kind}"}} {n}')
+        lines += ['# HELP batch_crawler_start_time_seconds Unix time the crawl started.',
+                  '# TYPE batch_crawler_start_time_seconds gauge',
+                  f'batch_crawler_start_time_seconds {self.started:.3f}']
+        return '\n'.join(lines) + '\n'
+
+    def write(self, prefix):
+        """原子写出 <prefix>.json 和 <prefix>.prom（textfile 收集器不会读到半个文件）"""
+        for path, text in ((f"{prefix}.json", json.dumps(self.to_dict(), ensure_ascii=False, indent=2)),
+                           (f"{prefix}.prom", self.to_prometheus())):
+            temp_path = f"{path}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                f.write(text)
+            os.replace(temp_path, path)
+
+    def summary(self):
+        lines = []
+        for name, h in self.phases.items():
+            if h.count:
+                lines.append(f"   {PHASE_NAMES[name]:<14} {h.count:>8} 次 | 平均 {h.sum / h.count * 1000:>8.1f}ms | "
+                             f"p95 ≤{h.quantile(0.95) * 1000:.0f}ms | 累计 {h.sum:.1f}s")
+        if self.retries:
+            lines.append("   重试: " + ", ".join(f"{PHASE_NAMES[p]} {s}×{n}" for (p, s), n in sorted(self.retries.items())))
+        lines.append(f"   流量: XLS {self.bytes['xls'] / 1048576:.1f}MB | CSV {self.bytes['csv'] / 1048576:.1f}MB")
+        return "\n".join(lines)
@@ -4,14 +4,21 @@ import os
 import sys
 import csv
 import argparse
-import zipfile
 import concurrent.futures
 from datetime import datetime
-from pypinyin import pinyin, Style
-from sqlalchemy import create_engine, Column, String, Float, Integer, text
+from sqlalchemy import create_engine, Column, String, Float, Integer, Index, DateTime, Identity, text
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB
 from sqlalchemy import SmallInteger
 
+import bulk_loader
+import compact_course
+import pinyin_cache
+import sheet_parser
+from columnar import CourseColumns, as_columns
+from zip_reader import ZipReader
+from grade_manifest import Manifest
+
 def normalize_punct(s):
     """全角ASCII标点 → 半角"""
     if not s:
@@ -29,8 +36,167 @@ except ImportError:
 
 Base = declarative_base()
 
+# 排名 SQL：{where} 为空时全表重算，否则只重算指定专业（班级号前8位）——班级包含在专业内，两种排名都不受其他专业影响。
+# 只写回排名确有变化的行（其余行不产生新版本和WAL），RETURNING 返回这些学号
+RANK_SQL = """
+    UPDATE student
+    SET 
+        class_avg_rank = t.c_avg_r,
+        class_gpa_rank = t.c_gpa_r,
+        major_avg_rank = t.m_avg_r,
+        major_gpa_rank = t.m_gpa_r
+    FROM (
+        SELECT 
+            s_id,
+            RANK() OVER (PARTITION BY s_class ORDER BY s_avg DESC) as c_avg_r,
+            RANK() OVER (PARTITION BY s_class ORDER BY s_gpa DESC) as c_gpa_r,
+            RANK() OVER (PARTITION BY LEFT(s_class, 8) ORDER BY s_avg DESC) as m_avg_r,
+            RANK() OVER (PARTITION BY LEFT(s_class, 8) ORDER BY s_gpa DESC) as m_gpa_r
+        FROM student
+        {where}
+    ) t
+    WHERE student.s_id = t.s_id
+      AND (student.class_avg_rank, student.class_gpa_rank, student.major_avg_rank, student.major_gpa_rank)
+          IS DISTINCT FROM (t.c_avg_r, t.c_gpa_r, t.m_avg_r, t.m_gpa_r)
+    RETURNING student.s_id
+"""
+RANK_WHERE_MAJORS = "WHERE LEFT(s_class, 8) = ANY(:majors)"
+# 专业键的表达式索引：增量排名和单学生刷新只读取涉及的专业，不扫描整张 student 表。
+# 模型中已声明，旧库的 student 表由 create_all 跳过，初始化时补建
+MAJOR_INDEX_SQL = "CREATE INDEX IF NOT EXISTS ix_student_major_key ON student (LEFT(s_class, 8))"
+
+# import_teacher 为尚无成绩的课程插入的占位行（成绩记 0），不参与单科排名和课程统计
+SCORED_ROWS = "NOT (c_type = '' AND c_hours = '0')"
+COURSE_GROUPS = ("AND (c_name, c_term) IN "
+                 "(SELECT * FROM unnest(CAST(:names AS text[]), CAST(:terms AS text[])))")
+
+# 单学生刷新的事务级咨询锁：同一专业的排名、同一 课程/学期 组的单科排名和统计同一时间只由一个事务重算，
+# 否则并发刷新在 RANK_SQL 上按不同顺序更新同专业的行而互相死锁。space 区分专业键和课程组键，
+# 所有键按同一顺序加锁，两个刷新涉及的键有交集时也不会互相等待成环；锁在事务提交或回滚时自动释放
+REFRESH_LOCK_MAJOR, REFRESH_LOCK_GROUP = 1, 2
+REFRESH_LOCK_SQL = """
+    SELECT pg_advisory_xact_lock(space, key)
+    FROM (SELECT DISTINCT space, hashtext(name) AS key
+          FROM unnest(CAST(:spaces AS int[]), CAST(:names AS text[])) AS k(space, name)
+          ORDER BY space, key OFFSET 0) AS locks
+"""
+
+# 单科排名：按 课程+学期 分组的名次、人数和百分位（超过了同课程百分之多少的同学）写入 course_rank，
+# 查询某学生某门课的排名变为主键读取。{groups} 为空时全部重算，否则为 COURSE_GROUPS，只重算指定的 课程/学期 组
+COURSE_RANK_SQL = """
+    INSERT INTO course_rank (s_id, c_term, c_name, c_rank, c_total, c_percentile)
+    SELECT
+        s_id, c_term, c_name,
+        RANK() OVER (PARTITION BY c_name, c_term ORDER BY c_score DESC),
+        COUNT(*) OVER (PARTITION BY c_name, c_term),
+        ROUND((PERCENT_RANK() OVER (PARTITION BY c_name, c_term ORDER BY c_score) * 100)::numeric, 2)
+    FROM course_score
+    WHERE {scored} {groups}
+    ON CONFLICT (s_id, c_term, c_name) DO UPDATE SET
+        c_rank = EXCLUDED.c_rank,
+        c_total = EXCLUDED.c_total,
+        c_percentile = EXCLUDED.c_percentile
+    WHERE (course_rank.c_rank, course_rank.c_total, course_rank.c_percentile)
+          IS DISTINCT FROM (EXCLUDED.c_rank, EXCLUDED.c_total, EXCLUDED.c_percentile)
+"""
+# 成绩行被删除（或只剩占位行）后清掉对应的单科排名
+COURSE_RANK_PRUNE_SQL = """
+    DELETE FROM course_rank r
+    WHERE NOT EXISTS (SELECT 1 FROM course_score c
+                      WHERE c.s_id = r.s_id AND c.c_term = r.c_term AND c.c_name = r.c_name AND {scored})
+"""
+
+# 课程统计：每个 课程/学期 一行全体统计（c_teacher 为空串）加每位任课教师一行，挂科率接口直接读一行。
+# 直方图为 [<60, 60~69, 70~79, 80~89, ≥90] 各分数段人数。
+# 一条语句内 Upsert 新统计（按主键顺序写入，并发刷新重叠的组时加锁顺序一致）并只删掉组内已不存在的旧教师行，
+# 刷新服务多个线程同时重算同一组时不会因先删后插撞主键
+COURSE_STATS_SQL = """
+    WITH fresh AS (
+        SELECT
+            c_name, c_term,
+            CASE WHEN GROUPING(c_teacher) = 1 THEN '' ELSE c_teacher END AS c_teacher,
+            COUNT(*) AS n_total,
+            ROUND(AVG(c_score)::numeric, 2) AS avg_score,
+            ROUND(COALESCE(STDDEV_POP(c_score), 0)::numeric, 2) AS std_score,
+            COUNT(*) FILTER (WHERE c_score < 60) AS n_fail,
+            COUNT(*) FILTER (WHERE c_pass = 1) AS n_reexam,
+            COUNT(*) FILTER (WHERE c_pass = 2) AS n_retake,
+            ARRAY[COUNT(*) FILTER (WHERE c_score < 60),
+                  COUNT(*) FILTER (WHERE c_score >= 60 AND c_score < 70),
+                  COUNT(*) FILTER (WHERE c_score >= 70 AND c_score < 80),
+                  COUNT(*) FILTER (WHERE c_score >= 80 AND c_score < 90),
+                  COUNT(*) FILTER (WHERE c_score >= 90)]::int[] AS hist
+        FROM course_score
+        WHERE {scored} {groups}
+        GROUP BY GROUPING SETS ((c_name, c_term), (c_name, c_term, c_teacher))
+        HAVING GROUPING(c_teacher) = 1 OR COALESCE(c_teacher, '') <> ''
+    ), upserted AS (
+        INSERT INTO course_stats (c_name, c_term, c_teacher, n_total, avg_score, std_score,
+                                  n_fail, n_reexam, n_retake, hist)
+        SELECT c_name, c_term, c_teacher, n_total, avg_score, std_score, n_fail, n_reexam, n_retake, hist
+        FROM fresh
+        ORDER BY c_name, c_term, c_teacher
+        ON CONFLICT (c_name, c_term, c_teacher) DO UPDATE SET
+            n_total = EXCLUDED.n_total, avg_score = EXCLUDED.avg_score, std_score = EXCLUDED.std_score,
+            n_fail = EXCLUDED.n_fail, n_reexam = EXCLUDED.n_reexam, n_retake = EXCLUDED.n_retake,
+            hist = EXCLUDED.hist
+        WHERE (course_stats.n_total, course_stats.avg_score, course_stats.std_score, course_stats.n_fail,
+               course_stats.n_reexam, course_stats.n_retake, course_stats.hist)
+              IS DISTINCT FROM (EXCLUDED.n_total, EXCLUDED.avg_score, EXCLUDED.std_score, EXCLUDED.n_fail,
+                                EXCLUDED.n_reexam, EXCLUDED.n_retake, EXCLUDED.hist)
+    )
+    DELETE FROM course_stats s
+    WHERE TRUE {groups}
+      AND NOT EXISTS (SELECT 1 FROM fresh f
+                      WHERE f.c_name = s.c_name AND f.c_term = s.c_term AND f.c_teacher = s.c_teacher)
+"""
+
+# 学生文档：学生信息、四项排名、按学期的均分/学分加权均分、含任课教师的全部成绩，预先拼成一个 JSONB，
+# 成绩查询按主键取一行即可。{where} 为空时全部重建，否则为 STUDENT_IDS_WHERE；内容未变的行不改写
+STUDENT_DOC_SQL = """
+    INSERT INTO student_doc (s_id, doc, updated_at)
+    SELECT
+        s.s_id,
+        jsonb_build_object(
+            's_id', s.s_id, 's_name', s.s_name, 's_py', s.s_py, 's_college', s.s_college,
+            's_major', s.s_major, 's_grade', s.s_grade, 's_class', s.s_class,
+            's_avg', s.s_avg, 's_gpa', s.s_gpa,
+            'ranks', jsonb_build_object(
+                'class_avg_rank', s.class_avg_rank, 'class_gpa_rank', s.class_gpa_rank,
+                'major_avg_rank', s.major_avg_rank, 'major_gpa_rank', s.major_gpa_rank),
+            'terms', COALESCE(t.terms, '[]'::jsonb),
+            'courses', COALESCE(c.courses, '[]'::jsonb)),
+        now()
+    FROM student s
+    LEFT JOIN LATERAL (
+        SELECT jsonb_agg(jsonb_build_object(
+                   'c_term', c_term, 'c_name', c_name, 'c_score', c_score, 'c_type', c_type,
+                   'c_hours', c_hours, 'c_credit', c_credit, 'c_pass', c_pass, 'c_teacher', c_teacher)
+               ORDER BY c_term, c_name) AS courses
+        FROM course_score WHERE s_id = s.s_id
+    ) c ON TRUE
+    LEFT JOIN LATERAL (
+        SELECT jsonb_agg(jsonb_build_object(
+                   'c_term', c_term, 'courses', n, 'credits', credits, 'avg', avg_score, 'credit_avg', credit_avg)
+               ORDER BY c_term) AS terms
+        FROM (
+            SELECT c_term, COUNT(*) AS n, SUM(c_credit) AS credits,
+                   ROUND(AVG(c_score)::numeric, 2) AS avg_score,
+                   ROUND((SUM(c_score * c_credit) / NULLIF(SUM(c_credit), 0))::numeric, 2) AS credit_avg
+            FROM course_score
+            WHERE s_id = s.s_id AND {scored}
+            GROUP BY c_term
+        ) per_term
+    ) t ON TRUE
+    {where}
+    ON CONFLICT (s_id) DO UPDATE SET doc = EXCLUDED.doc, updated_at = EXCLUDED.updated_at
+    WHERE student_doc.doc IS DISTINCT FROM EXCLUDED.doc
+"""
+STUDENT_IDS_WHERE = "WHERE s.s_id = ANY(:ids)"
+
 class Student(Base):
     __tablename__ = 'student'
+    __table_args__ = (Index('ix_student_major_key', text('LEFT(s_class, 8)')),)
     s_id = Column(String(14), primary_key=True)
     s_name = Column(String(50), nullable=False, index=True)
     s_college = Column(String(50), nullable=False)
@@ -47,8 +213,8 @@ class Student(Base):
 
 class CourseScore(Base):
     __tablename__ = 'course_score'
-    # Composite Primary Key
-    s_id = Column(String(14), primary_key=True, nullable=False, index=True)
+    # Composite Primary Key（按学号查询由主键前缀覆盖，s_id 不再单独建索引）
+    s_id = Column(String(14), primary_key=True, nullable=False)
     c_term = Column(String(8), primary_key=True, nullable=False, index=True)
     c_name = Column(String(100), primary_key=True, nullable=False, index=True)
     
@@ -57,22 +223,72 @@ class CourseScore(Base):
     c_hours = Column(String(10), nullable=False)
     c_credit = Column(Float, nullable=False)
     c_pass = Column(SmallInteger, nullable=False) # 0-正常 1-补考 2-重修 3-刷分
+    c_teacher = Column(String(200), nullable=True)  # 由 import_teacher 写入
 
 class CourseName(Base):
     __tablename__ = 'course_name'
     c_name = Column(String(100), primary_key=True)
+    c_id = Column(Integer, Identity(), unique=True, nullable=False)   # 紧凑存储中代替课程名（见 compact_course）
+
+class CourseRank(Base):
+    """单科排名（由 course_score 派生，导入时只刷新有新成绩的 课程/学期 组）"""
+    __tablename__ = 'course_rank'
+    __table_args__ = (Index('ix_course_rank_group', 'c_name', 'c_term', 'c_rank'),)
+    s_id = Column(String(14), primary_key=True)
+    c_term = Column(String(8), primary_key=True)
+    c_name = Column(String(100), primary_key=True)
+    c_rank = Column(Integer, nullable=False)        # 同课程同学期按成绩从高到低的名次
+    c_total = Column(Integer, nullable=False)       # 同课程同学期的人数
+    c_percentile = Column(Float, nullable=False)    # 成绩低于该学生的人数占比（0~100）
+
+class CourseStats(Base):
+    """课程统计（由 course_score 派生）：c_teacher 为空串的行是该课程该学期的全体统计"""
+    __tablename__ = 'course_stats'
+    c_name = Column(String(100), primary_key=True)
+    c_term = Column(String(8), primary_key=True)
+    c_teacher = Column(String(200), primary_key=True, default='')
+    n_total = Column(Integer, nullable=False)
+    avg_score = Column(Float, nullable=False)
+    std_score = Column(Float, nullable=False)
+    n_fail = Column(Integer, nullable=False)        # 成绩 < 60
+    n_reexam = Column(Integer, nullable=False)      # c_pass = 1 补考
+    n_retake = Column(Integer, nullable=False)      # c_pass = 2 重修
+    hist = Column(ARRAY(Integer), nullable=False)   # [<60, 60~69, 70~79, 80~89, ≥90]
+
+class StudentDoc(Base):
+    """学生文档（由 student、course_score 派生）：成绩查询接口的读模型"""
+    __tablename__ = 'student_doc'
+    s_id = Column(String(14), primary_key=True)
+    doc = Column(JSONB, nullable=False)
+    updated_at = Column(DateTime, nullable=False)
+
+
+def _group_params(groups):
+    return {'names': [g[0] for g in groups], 'terms': [g[1] for g in groups]}
 
-class GradeManager:
-    def __init__(self):
-        self.engine = create_engine(
-            DB_URI, 
-            pool_size=DB_POOL_SIZE, 
-            max_overflow=DB_MAX_OVERFLOW, 
-            pool_recycle=DB_POOL_RECYCLE, 
-            pool_pre_ping=True
-        )
-        self.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
-        Base.metadata.create_all(bind=self.engine)
+
+def refresh_course_stats(session, groups=None):
+    """
+    重算课程统计（不提交）。groups 为 (课程, 学期) 集合时只重算这些组，None 时全部重建。
+    Upsert 后删掉组内已不存在的行：任课教师变动后，旧教师的那一行随之消失
+    """
+    if groups is None:
+        session.execute(text(COURSE_STATS_SQL.format(scored=SCORED_ROWS, groups='')))
+    elif groups:
+        session.execute(text(COURSE_STATS_SQL.format(scored=SCORED_ROWS, groups=COURSE_GROUPS)),
+                        _group_params(groups))
+
+
+def refresh_student_docs(session, ids=None):
+    """重建学生文档（不提交）。ids 为学号集合时只重建这些学生，None 时全部重建"""
+    if ids is None:
+        session.execute(text(STUDENT_DOC_SQL.format(scored=SCORED_ROWS, where='')))
+    elif ids:
+        session.execute(text(STUDENT_DOC_SQL.format(scored=SCORED_ROWS, where=STUDENT_IDS_WHERE)),
+                        {'ids': sorted(ids)})
+
+class GradeParser:
+    """成绩单解析（不依赖数据库，可在子进程中使用）"""
 
     def parse_csv_grade(self, content_or_path):
         """解析 CSV 格式的成绩内容或文件"""
@@ -132,7 +348,7 @@ class GradeManager:
             else:
                 info['s_avg'] = info['s_gpa'] = 0.0
 
-            info['s_py'] = "".join(p[0] for p in pinyin(info['s_name'], style=Style.FIRST_LETTER))
+            info['s_py'] = pinyin_cache.initials(info['s_name'])
             return info
         except: return None
 
@@ -192,106 +408,395 @@ class GradeManager:
         try: return float(s)
         except: return {'优': 95.0, '良': 85.0, '中': 75.0, '及格': 65.0, '不及格': 55.0}.get(s, 0.0)
 
-    def save_from_zip(self, zip_path):
-        """从ZIP压缩包直接读取并保存到数据库"""
-        if not os.path.exists(zip_path):
-            print(f"❌ 找不到文件: {zip_path}")
-            return False
 
-        import threading
-        zip_lock = threading.Lock()
+def parse_grade_sheet(content):
+    """进程池任务：解析一份成绩单（CSV/XLS 字节或路径），返回 (student, courses)，课程已带 s_id。
+    使用 sheet_parser 的固定版式解析；GradeParser 保留作对照（python sheet_parser.py --verify）"""
+    return sheet_parser.parse(content)
 
-        with zipfile.ZipFile(zip_path, 'r') as z:
-            csv_files = [f for f in z.namelist() if f.lower().endswith('.csv')]
-            total_files = len(csv_files)
-            if not csv_files:
-                print("❌ ZIP内没有找到CSV文件")
+
+# 进程池 worker：每个子进程打开一次 ZIP（mmap，见 zip_reader），复用映射（目录模式下不打开，条目即文件路径）
+PARSE_CHUNK = 256
+_zf = None
+
+def _init_worker(zip_path=None, pinyin_known=None):
+    global _zf
+    _zf = ZipReader(zip_path) if zip_path else None
+    pinyin_cache.preload(pinyin_known)
+
+def _parse_chunk(names):
+    """解析一组 ZIP 条目或文件路径，返回 (学生列表, 课程的 CourseColumns, 出错数)"""
+    students, courses, errors = [], CourseColumns(), 0
+    for name in names:
+        try:
+            student, student_courses = parse_grade_sheet(_zf.read(name) if _zf else name)
+        except Exception:
+            errors += 1
+            continue
+        if student:
+            students.append(student)
+            courses.extend(student_courses)
+    return students, courses, errors
+
+
+class GradeManager(GradeParser):
+    def __init__(self, parse_workers=None, loader='copy', full_rank=False, engine=None):
+        # engine 不为 None 时使用调用方的连接（例如 bench_loader 指向独立 schema），不连接 DB_URI
+        self.engine = engine or create_engine(
+            DB_URI, 
+            pool_size=DB_POOL_SIZE, 
+            max_overflow=DB_MAX_OVERFLOW, 
+            pool_recycle=DB_POOL_RECYCLE, 
+            pool_pre_ping=True
+        )
+        self.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
+        Base.metadata.create_all(bind=self.engine)
+        with self.engine.begin() as conn:
+            conn.execute(text(MAJOR_INDEX_SQL))
+        # 最近一次导入实际处理的学号（文件名），供增量清单核销
+        self.ingested_ids = set()
+        self.parse_workers = parse_workers or os.cpu_count()
+        # 写入方式：copy（COPY 到暂存表后集合式 Upsert）或 insert（SQLAlchemy 多行 INSERT ... ON CONFLICT）
+        self.loader = loader
+        # 本次导入中新增或班级/均分/GPA 有变化的学生涉及的班级（含转出的原班级），排名只重算这些班级所在的专业
+        self.touched_classes = set()
+        # 最近一次排名计算中排名有变化的学号
+        self.rank_changed_ids = set()
+        # 本次导入中有新增或改动成绩的 (课程, 学期)，只刷新这些组的单科排名
+        self.touched_courses = set()
+        # 本次导入中学生信息或成绩有变化的学号，连同排名有变化的学号重建 student_doc
+        self.touched_students = set()
+        # 不为 None 时收集解析出的 姓名 → 拼音首字母，导入后合并进持久化拼音字典
+        self.learned_pinyin = None
+        # 为 True 时忽略变化跟踪，全表重算排名（排名字段被手工改动或首次启用增量排名时使用）
+        self.full_rank = full_rank
+        # course_score 已由 compact_course 迁移为紧凑存储时，成绩经课程名字典写入 course_score_compact
+        with self.engine.connect() as conn:
+            self.compact = compact_course.is_compact(conn)
+
+    def save_from_zip(self, zip_paths, only_ids=None, stream=False, batch_size=2000):
+        """
+        从ZIP压缩包（可为流式下载生成的多个分片）直接读取并保存到数据库，only_ids 限定只导入这些学号。
+        stream=True 时边解析边按 batch_size 个学生分批写入，内存占用与压缩包大小无关
+        """
+        if isinstance(zip_paths, str):
+            zip_paths = [zip_paths]
+        for zip_path in zip_paths:
+            if not os.path.exists(zip_path):
+                print(f"❌ 找不到文件: {zip_path}")
                 return False
 
-            print(f"📊 开始从ZIP解析 {total_files} 个文件...")
-            all_students, all_courses = [], []
-            
-            # 定义线程内部逻辑
-            def process_zip_entry(filename):
-                try:
-                    with zip_lock:
-                        with z.open(filename) as f:
-                            content = f.read()
-                    return self.parse_csv_grade(content)
-                except Exception as e:
-                    print(f"\n⚠️ 处理文件 {filename} 出错: {e}")
-                    return None, None
-
-            with concurrent.futures.ThreadPoolExecutor(max_workers=80) as executor:
-                futures = {executor.submit(process_zip_entry, f): f for f in csv_files}
-                count = 0
-                for future in concurrent.futures.as_completed(futures):
-                    res = future.result()
-                    count += 1
-                    if count % 100 == 0 or count == total_files:
-                        print(f"\r📁 解析进度: {count}/{total_files} ({count*100//total_files}%)", end="", flush=True)
-                    
-                    if res and res[0]:
-                        student, courses = res
-                        all_students.append(student)
-                        all_courses.extend({**c, 's_id': student['s_id']} for c in courses)
-            
-            print("\n✅ 解析完成，开始同步到数据库...")
-            return self._sync_to_db(all_students, all_courses)
+        self.ingested_ids = set()
+        self.touched_classes = set()
+        self.touched_courses = set()
+        self.touched_students = set()
+        entries = []
+        for zip_path in zip_paths:
+            csv_files = self._zip_entries(zip_path, only_ids)
+            if csv_files is None:
+                return False
+            if csv_files:
+                entries.append((zip_path, csv_files))
+        records = self._iter_zips(entries)
 
-    def save_to_database(self, csv_dir):
-        """从目录读取并保存到数据库"""
-        files = [os.path.join(csv_dir, f) for f in os.listdir(csv_dir) if f.lower().endswith('.csv')]
-        total_files = len(files)
-        if not files: return False
+        if stream:
+            return self._stream_to_db(records, batch_size)
+        all_students, all_courses = [], CourseColumns()
+        for students, courses in records:
+            all_students.extend(students)
+            all_courses.extend(courses)
 
-        print(f"📊 开始从目录解析 {total_files} 个文件...")
-        all_students, all_courses = [], []
-        
-        with concurrent.futures.ThreadPoolExecutor(max_workers=80) as executor:
-            futures = [executor.submit(self.parse_csv_grade, f) for f in files]
-            count = 0
-            for future in concurrent.futures.as_completed(futures):
-                res = future.result()
-                count += 1
-                if count % 100 == 0 or count == total_files:
+        print("\n✅ 解析完成，开始同步到数据库...")
+        return self._sync_to_db(all_students, all_courses)
+
+    def _zip_entries(self, zip_path, only_ids=None):
+        """列出单个ZIP内待解析的CSV（only_ids 不为空时只取这些学号），ZIP内没有CSV时返回 None"""
+        with ZipReader(zip_path) as z:
+            csv_files = [f for f in z.namelist() if f.lower().endswith('.csv')]
+        if not csv_files:
+            print(f"❌ ZIP内没有找到CSV文件: {zip_path}")
+            return None
+        if only_ids is not None:
+            csv_files = [f for f in csv_files if f[:-4] in only_ids]
+        self.ingested_ids.update(f[:-4] for f in csv_files)
+        return csv_files
+
+    def _iter_zips(self, entries):
+        for zip_path, csv_files in entries:
+            print(f"📊 开始从ZIP解析 {len(csv_files)} 个文件: {zip_path}")
+            yield from self._iter_parsed(csv_files, zip_path)
+
+    def _iter_parsed(self, names, zip_path):
+        """
+        多进程解析，按分组产出 (学生列表, CourseColumns)：每个子进程打开一次ZIP，按 PARSE_CHUNK 个条目一组分发，
+        在途分组不超过进程数的 2 倍，结果被取走后才提交下一组，内存与文件总数无关
+        """
+        total_files = len(names)
+        chunks = (names[i:i+PARSE_CHUNK] for i in range(0, total_files, PARSE_CHUNK))
+        errors = 0
+        count = 0
+        with concurrent.futures.ProcessPoolExecutor(max_workers=self.parse_workers, initializer=_init_worker,
+                                                    initargs=(zip_path, pinyin_cache.known())) as executor:
+            pending = {}
+
+            def submit_next():
+                chunk = next(chunks, None)
+                if chunk:
+                    pending[executor.submit(_parse_chunk, chunk)] = len(chunk)
+
+            for _ in range(self.parse_workers * 2):
+                submit_next()
+            while pending:
+                done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    students, courses, failed = future.result()
+                    errors += failed
+                    if self.learned_pinyin is not None:
+                        self.learned_pinyin.update((student['s_name'], student['s_py']) for student in students)
+                    count += pending.pop(future)
+                    submit_next()
                     print(f"\r📁 解析进度: {count}/{total_files} ({count*100//total_files}%)", end="", flush=True)
-                
-                if res and res[0]:
-                    student, courses = res
-                    all_students.append(student)
-                    all_courses.extend({**c, 's_id': student['s_id']} for c in courses)
-        
+                    yield students, courses
+        print()
+        if errors:
+            print(f"⚠️ {errors} 个文件解析出错已跳过")
+
+    def save_to_database(self, csv_dir, only_ids=None, stream=False, batch_size=2000):
+        """从目录读取并保存到数据库，only_ids 限定只导入这些学号，stream 同 save_from_zip"""
+        names = [f for f in os.listdir(csv_dir) if f.lower().endswith('.csv')]
+        if only_ids is not None:
+            names = [f for f in names if f[:-4] in only_ids]
+        self.ingested_ids = {f[:-4] for f in names}
+        self.touched_classes = set()
+        self.touched_courses = set()
+        self.touched_students = set()
+        files = [os.path.join(csv_dir, f) for f in names]
+        if not files: return False
+
+        print(f"📊 开始从目录解析 {len(files)} 个文件...")
+        records = self._iter_parsed(files, None)
+        if stream:
+            return self._stream_to_db(records, batch_size)
+        all_students, all_courses = [], CourseColumns()
+        for students, courses in records:
+            all_students.extend(students)
+            all_courses.extend(courses)
+
         print("\n✅ 解析完成，开始同步到数据库...")
         return self._sync_to_db(all_students, all_courses)
 
-    def _sync_to_db(self, all_students, all_courses):
-        """核心入库逻辑"""
+    def _stream_to_db(self, records, batch_size):
+        """
+        流式入库：解析结果攒满 batch_size 个学生（按解析分组取整）即写入并提交一批（解析进程同时继续工作），
+        全部提交后计算一次排名
+        """
+        students, courses = [], CourseColumns()
+        written = course_count = batches = 0
+        try:
+            for chunk_students, chunk_courses in records:
+                students.extend(chunk_students)
+                courses.extend(chunk_courses)
+                if len(students) >= batch_size:
+                    self.write_batch(students, courses)
+                    written += len(students)
+                    course_count += len(courses)
+                    batches += 1
+                    students, courses = [], CourseColumns()
+            if students:
+                self.write_batch(students, courses)
+                written += len(students)
+                course_count += len(courses)
+                batches += 1
+            print(f"\n✅ 流式写入完成: 学生 {written} 条 | 成绩 {course_count} 条 | {batches} 批")
+
+            print("🔄 正在执行SQL排名计算...")
+            self.run_ranking()
+            print("✨ 全部完成！")
+            return True
+        except Exception as e:
+            print(f"\n❌ 失败（已提交 {batches} 批 {written} 名学生）: {e}")
+            import traceback
+            traceback.print_exc()
+            return False
+
+    def _changed_students(self, session, batch):
+        """
+        Upsert 前与库中现有记录对比，返回 (新增或任一字段有变化的学号, 排名受影响的班级)。
+        只有 班级/均分/GPA 变化才影响排名，转班时新旧班级都算
+        """
+        fields = bulk_loader.SPECS['student']['update']
+        rows = session.execute(text(f"SELECT s_id, {', '.join(fields)} FROM student WHERE s_id = ANY(:ids)"),
+                               {'ids': [s['s_id'] for s in batch]}).mappings().all()
+        old = {r['s_id']: r for r in rows}
+        ids, classes = set(), set()
+        for s in batch:
+            prev = old.get(s['s_id'])
+            if prev is None:
+                ids.add(s['s_id'])
+                classes.add(s['s_class'])
+                continue
+            if any(prev[f] != s[f] for f in fields):
+                ids.add(s['s_id'])
+            if (prev['s_class'], prev['s_avg'], prev['s_gpa']) != (s['s_class'], s['s_avg'], s['s_gpa']):
+                classes.update((s['s_class'], prev['s_class']))
+        return ids, classes
+
+    def _upsert_students(self, session, batch):
+        """Upsert 学生，返回 (有变化的学号, 排名受影响的班级)"""
+        changed = self._changed_students(session, batch)
+        if self.loader == 'copy':
+            bulk_loader.upsert(session.connection().connection, 'student', batch)
+            return changed
         from sqlalchemy.dialects.postgresql import insert as pg_insert
+        stmt = pg_insert(Student).values(batch)
+        update_stmt = stmt.on_conflict_do_update(
+            index_elements=['s_id'],
+            set_={
+                's_name': stmt.excluded.s_name,
+                's_college': stmt.excluded.s_college,
+                's_major': stmt.excluded.s_major,
+                's_grade': stmt.excluded.s_grade,
+                's_class': stmt.excluded.s_class,
+                's_avg': stmt.excluded.s_avg,
+                's_gpa': stmt.excluded.s_gpa,
+                's_py': stmt.excluded.s_py,
+            }
+        )
+        session.execute(update_stmt)
+        return changed
+
+    def _upsert_courses(self, session, batch):
+        """Upsert 课程成绩（与现有值相同的行不改写），返回新增或有改动的行的 (学号, 学期, 课程)"""
+        if self.compact:
+            return compact_course.upsert(session, batch, self.loader)
+        if self.loader == 'copy':
+            return bulk_loader.upsert(session.connection().connection, 'course_score', batch, returning=True)
+        from sqlalchemy.dialects.postgresql import insert as pg_insert
+        stmt = pg_insert(CourseScore).values(batch)
+        update_stmt = stmt.on_conflict_do_update(
+            index_elements=['s_id', 'c_term', 'c_name'],
+            set_={
+                'c_score': stmt.excluded.c_score,
+                'c_type': stmt.excluded.c_type,
+                'c_hours': stmt.excluded.c_hours,
+                'c_credit': stmt.excluded.c_credit,
+                'c_pass': stmt.excluded.c_pass,
+            },
+            where=text("(course_score.c_score, course_score.c_type, course_score.c_hours, course_score.c_credit, "
+                       "course_score.c_pass) IS DISTINCT FROM (excluded.c_score, excluded.c_type, "
+                       "excluded.c_hours, excluded.c_credit, excluded.c_pass)")
+        ).returning(CourseScore.s_id, CourseScore.c_term, CourseScore.c_name)
+        return [tuple(r) for r in session.execute(update_stmt)]
+
+    def _course_slice(self, courses, start, stop):
+        """COPY 模式整个 CourseColumns 直接流入；insert 模式逐段临时转成 dict 列表"""
+        if self.loader == 'insert':
+            return courses.records(start, stop)
+        return courses
+
+    def _track(self, students=None, course_keys=()):
+        """累计本次导入的变化：_upsert_students / _upsert_courses 的返回值"""
+        if students:
+            ids, classes = students
+            self.touched_students |= ids
+            self.touched_classes |= classes
+        for s_id, c_term, c_name in course_keys:
+            self.touched_students.add(s_id)
+            self.touched_courses.add((c_name, c_term))
+
+    def _upsert_course_names(self, session, course_names):
+        """course_names 为不重复的课程名列表"""
+        if self.loader == 'copy':
+            bulk_loader.upsert(session.connection().connection, 'course_name', ({'c_name': n} for n in course_names))
+            return
+        from sqlalchemy.dialects.postgresql import insert as pg_insert
+        stmt = pg_insert(CourseName).values([{'c_name': n} for n in course_names])
+        stmt = stmt.on_conflict_do_nothing()
+        session.execute(stmt)
+
+    def write_batch(self, students, courses):
+        """流水线写入：一批学生及其课程（dict 列表或 CourseColumns）在一个事务内 Upsert 并提交（不计算排名）"""
+        courses = as_columns(courses)
+        session = self.SessionLocal()
+        try:
+            if students:
+                self._track(students=self._upsert_students(session, students))
+            step = 10000 if self.loader == 'insert' else max(len(courses), 1)
+            for i in range(0, len(courses), step):
+                self._track(course_keys=self._upsert_courses(session, self._course_slice(courses, i, i + step)))
+            course_names = courses.distinct('c_name')
+            if course_names:
+                self._upsert_course_names(session, course_names)
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally: session.close()
+
+    def refresh_student(self, student, courses):
+        """
+        单个学生刷新：Upsert 学生和课程，只重算其所在专业（转专业时连同原专业）的排名，
+        全部在一个事务内完成，返回最新的四项排名。写入前先按固定顺序锁住涉及的专业和 课程/学期 组，
+        同专业、同课程的并发刷新依次执行
+        """
+        session = self.SessionLocal()
+        try:
+            self._lock_refresh(session, student, courses)
+            ids, classes = self._upsert_students(session, [student])
+            keys = []
+            if courses:
+                keys = self._upsert_courses(session, courses)
+                self._upsert_course_names(session, list(set(c['c_name'] for c in courses)))
+            ids |= {k[0] for k in keys}
+            if classes:
+                ids |= self._rank_partitions(session, {c[:8] for c in classes})
+            groups = {(c_name, c_term) for _, c_term, c_name in keys}
+            if groups:
+                self._rank_courses(session, groups)
+                refresh_course_stats(session, groups)
+            refresh_student_docs(session, ids)
+            session.commit()
+            row = session.execute(text(
+                "SELECT class_avg_rank, class_gpa_rank, major_avg_rank, major_gpa_rank FROM student WHERE s_id = :s_id"
+            ), {'s_id': student['s_id']}).mappings().first()
+            return dict(row) if row else {}
+        except Exception:
+            session.rollback()
+            raise
+        finally: session.close()
+
+    def _lock_refresh(self, session, student, courses):
+        """为单学生刷新加事务级咨询锁：新旧班级所在专业（转专业时两者都锁）及成绩单涉及的 课程/学期 组"""
+        old = session.execute(text("SELECT s_class FROM student WHERE s_id = :s_id"),
+                              {'s_id': student['s_id']}).scalar()
+        majors = {c[:8] for c in (student.get('s_class'), old) if c}
+        groups = {f"{c['c_name']}\x1f{c['c_term']}" for c in courses or ()}
+        keys = [(REFRESH_LOCK_MAJOR, m) for m in majors] + [(REFRESH_LOCK_GROUP, g) for g in groups]
+        if keys:
+            session.execute(text(REFRESH_LOCK_SQL),
+                            {'spaces': [k[0] for k in keys], 'names': [k[1] for k in keys]})
+
+    def run_ranking(self):
+        """全部批次提交后统一计算一次排名（只重算受影响的专业）"""
+        session = self.SessionLocal()
+        try:
+            self._run_sql_ranking(session)
+            self._refresh_derived(session)
+        finally: session.close()
+
+    def _sync_to_db(self, all_students, all_courses):
+        """核心入库逻辑（all_courses 为 CourseColumns）"""
         session = self.SessionLocal()
         try:
             # 2. 学生信息 Upsert
             if all_students:
                 total_s = len(all_students)
                 print(f"📝 正在同步学生信息 ({total_s} 条)...")
-                for i in range(0, total_s, 5000):
-                    batch = all_students[i:i+5000]
-                    stmt = pg_insert(Student).values(batch)
-                    update_stmt = stmt.on_conflict_do_update(
-                        index_elements=['s_id'],
-                        set_={
-                            's_name': stmt.excluded.s_name,
-                            's_college': stmt.excluded.s_college,
-                            's_major': stmt.excluded.s_major,
-                            's_grade': stmt.excluded.s_grade,
-                            's_class': stmt.excluded.s_class,
-                            's_avg': stmt.excluded.s_avg,
-                            's_gpa': stmt.excluded.s_gpa,
-                            's_py': stmt.excluded.s_py,
-                        }
-                    )
-                    session.execute(update_stmt)
-                    current = min(i + 5000, total_s)
+                # COPY 模式整表一次流入，每张表只做一次集合式 Upsert
+                step = 5000 if self.loader == 'insert' else total_s
+                for i in range(0, total_s, step):
+                    self._track(students=self._upsert_students(session, all_students[i:i+step]))
+                    current = min(i + step, total_s)
                     print(f"\r👤 写入学生: {current}/{total_s} ({current*100//total_s}%)", end="", flush=True)
                 print("\n✅ 学生信息同步完成")
 
@@ -299,31 +804,18 @@ class GradeManager:
             if all_courses:
                 total_c = len(all_courses)
                 print(f"📚 正在同步课程成绩 ({total_c} 条)...")
-                for i in range(0, total_c, 10000):
-                    batch = all_courses[i:i+10000]
-                    stmt = pg_insert(CourseScore).values(batch)
-                    update_stmt = stmt.on_conflict_do_update(
-                        index_elements=['s_id', 'c_term', 'c_name'],
-                        set_={
-                            'c_score': stmt.excluded.c_score,
-                            'c_type': stmt.excluded.c_type,
-                            'c_hours': stmt.excluded.c_hours,
-                            'c_credit': stmt.excluded.c_credit,
-                            'c_pass': stmt.excluded.c_pass,
-                        }
-                    )
-                    session.execute(update_stmt)
-                    current = min(i + 10000, total_c)
+                step = 10000 if self.loader == 'insert' else total_c
+                for i in range(0, total_c, step):
+                    self._track(course_keys=self._upsert_courses(session, self._course_slice(all_courses, i, i + step)))
+                    current = min(i + step, total_c)
                     print(f"\r📖 写入成绩: {current}/{total_c} ({current*100//total_c}%)", end="", flush=True)
                 print("\n✅ 课程成绩同步完成")
                 
                 # 4. 同步课程名到 course_name 表
-                course_names = list(set(c['c_name'] for c in all_courses))
+                course_names = all_courses.distinct('c_name')
                 if course_names:
                     print(f"📋 同步课程名 ({len(course_names)} 个)...")
-                    stmt = pg_insert(CourseName).values([{'c_name': n} for n in course_names])
-                    stmt = stmt.on_conflict_do_nothing()
-                    session.execute(stmt)
+                    self._upsert_course_names(session, course_names)
                     print("✅ 课程名同步完成")
             
             session.commit()
@@ -332,6 +824,7 @@ class GradeManager:
             # 4. 用纯SQL计算排名
             print("🔄 正在执行SQL排名计算...")
             self._run_sql_ranking(session)
+            self._refresh_derived(session)
             print("✨ 全部完成！")
             return True
         except Exception as e:
@@ -342,31 +835,30 @@ class GradeManager:
             return False
         finally: session.close()
 
+    def _rank_partitions(self, session, majors):
+        """在当前事务内重算指定专业（及其下各班级）的排名，返回排名有变化的学号（不提交）"""
+        rows = session.execute(text(RANK_SQL.format(where=RANK_WHERE_MAJORS)), {'majors': sorted(majors)})
+        return set(rows.scalars())
+
     def _run_sql_ranking(self, session):
-        """使用纯SQL计算排名"""
+        """使用纯SQL计算排名：默认只重算本次导入涉及的班级所在的专业，full_rank 时全表重算"""
         try:
             # 用SQL窗口函数计算排名
-            print("📊 正在计算排名（使用SQL窗口函数）...")
-            session.execute(text("""
-                UPDATE student
-                SET 
-                    class_avg_rank = t.c_avg_r,
-                    class_gpa_rank = t.c_gpa_r,
-                    major_avg_rank = t.m_avg_r,
-                    major_gpa_rank = t.m_gpa_r
-                FROM (
-                    SELECT 
-                        s_id,
-                        RANK() OVER (PARTITION BY s_class ORDER BY s_avg DESC) as c_avg_r,
-                        RANK() OVER (PARTITION BY s_class ORDER BY s_gpa DESC) as c_gpa_r,
-                        RANK() OVER (PARTITION BY LEFT(s_class, 8) ORDER BY s_avg DESC) as m_avg_r,
-                        RANK() OVER (PARTITION BY LEFT(s_class, 8) ORDER BY s_gpa DESC) as m_gpa_r
-                    FROM student
-                ) t
-                WHERE student.s_id = t.s_id
-            """))
+            if self.full_rank:
+                print("📊 正在计算排名（全表，使用SQL窗口函数）...")
+                changed = set(session.execute(text(RANK_SQL.format(where=''))).scalars())
+            else:
+                majors = {c[:8] for c in self.touched_classes}
+                if not majors:
+                    print("✅ 没有学生的班级、均分或GPA发生变化，跳过排名计算")
+                    self.rank_changed_ids = set()
+                    return
+                print(f"📊 正在计算排名（{len(self.touched_classes)} 个班级所在的 {len(majors)} 个专业）...")
+                changed = self._rank_partitions(session, majors)
             session.commit()
-            print("✅ 排名计算完成")
+            self.rank_changed_ids = changed
+            self.touched_classes = set()
+            print(f"✅ 排名计算完成，{len(changed)} 名学生的排名有变化")
             
         except Exception as e:
             print(f"\n❌ 计算失败: {e}")
@@ -375,18 +867,83 @@ class GradeManager:
             session.rollback()
             raise
 
+    def _rank_courses(self, session, groups):
+        """在当前事务内重算指定 (课程, 学期) 组的单科排名（不提交）"""
+        if not groups:
+            return
+        session.execute(text(COURSE_RANK_SQL.format(scored=SCORED_ROWS, groups=COURSE_GROUPS)), _group_params(groups))
+
+    def _refresh_derived(self, session):
+        """
+        排名之后刷新派生表：course_rank、course_stats 只处理本次有成绩变化的 课程/学期 组，
+        student_doc 只重建信息或成绩有变化、以及排名有变化的学生；full_rank 时全部重建
+        """
+        try:
+            if self.full_rank:
+                print("📊 正在重建单科排名、课程统计和学生文档...")
+                session.execute(text(COURSE_RANK_PRUNE_SQL.format(scored=SCORED_ROWS)))
+                session.execute(text(COURSE_RANK_SQL.format(scored=SCORED_ROWS, groups='')))
+                refresh_course_stats(session)
+                refresh_student_docs(session)
+            else:
+                doc_ids = self.touched_students | self.rank_changed_ids
+                if not (self.touched_courses or doc_ids):
+                    return
+                print(f"📊 正在刷新派生表（{len(self.touched_courses)} 个课程/学期组，{len(doc_ids)} 个学生文档）...")
+                self._rank_courses(session, self.touched_courses)
+                refresh_course_stats(session, self.touched_courses)
+                refresh_student_docs(session, doc_ids)
+            session.commit()
+            self.touched_courses = set()
+            self.touched_students = set()
+            print("✅ 派生表刷新完成")
+        except Exception as e:
+            print(f"\n❌ 派生表刷新失败: {e}")
+            session.rollback()
+            raise
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument('--database', help='CSV目录')
-    parser.add_argument('--zip', help='ZIP压缩包路径')
+    parser.add_argument('--zip', nargs='+', help='ZIP压缩包路径（可传多个分片）')
+    parser.add_argument('--manifest', help='batch_downloader 生成的内容哈希清单，只导入新增/变化的学生')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='解析进程数（默认CPU核心数）')
+    parser.add_argument('--stream', action='store_true', help='边解析边分批写入（内存与数据量无关，每批单独提交）')
+    parser.add_argument('--batch-size', type=int, default=2000, help='流式写入时每批的学生数')
+    parser.add_argument('--loader', choices=['copy', 'insert'], default='copy',
+                        help='写入方式：copy（COPY+集合式Upsert）或 insert（原多行INSERT）')
+    parser.add_argument('--full-rank', action='store_true', help='全表重算排名（默认只重算有变化的学生所在专业）')
+    parser.add_argument('--pinyin-dict', help='持久化拼音字典（JSON），预置到解析进程，导入后合并新姓名')
     args = parser.parse_args()
-    
-    manager = GradeManager()
+
+    if not (args.zip or args.database):
+        parser.print_help()
+        sys.exit(0)
+
+    manifest = Manifest(args.manifest) if args.manifest else None
+    only_ids = None
+    if manifest:
+        only_ids = set(manifest.pending)
+        print(f"🧮 增量导入: 清单中待入库 {len(only_ids)} 个学生")
+        if not only_ids:
+            print("✅ 没有新增或变化的成绩单，无需导入")
+            sys.exit(0)
+
+    manager = GradeManager(args.workers, args.loader, args.full_rank)
+    if manager.compact:
+        print("🗜️ course_score 为紧凑存储，成绩经课程名字典写入 course_score_compact")
+    if args.pinyin_dict:
+        print(f"🔤 拼音字典: {pinyin_cache.load(args.pinyin_dict)} 条")
+        manager.learned_pinyin = {}
     if args.zip:
-        success = manager.save_from_zip(args.zip)
-        sys.exit(0 if success else 1)
-    elif args.database: 
-        success = manager.save_to_database(args.database)
-        sys.exit(0 if success else 1)
+        success = manager.save_from_zip(args.zip, only_ids, args.stream, args.batch_size)
     else:
-        parser.print_help()
+        success = manager.save_to_database(args.database, only_ids, args.stream, args.batch_size)
+
+    if success and args.pinyin_dict:
+        print(f"🔤 拼音字典新增 {pinyin_cache.save(args.pinyin_dict, manager.learned_pinyin)} 条")
+    if success and manifest:
+        manifest.clear(manager.ingested_ids)
+        manifest.save()
+        print(f"🧮 已核销 {len(manager.ingested_ids)} 个，清单剩余待入库 {len(manifest.pending)} 个")
+    sys.exit(0 if success else 1)
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+成绩单内容哈希清单：batch_downloader 记录每个学号规范化成绩单的哈希，
+内容新增或变化的学号进入 pending，grade_manager --manifest 只入库 pending 并在成功后清空。
+"""
+import os
+import csv
+import io
+import json
+import hashlib
+
+
+def sheet_digest(data):
+    """规范化成绩单（CSV 字节）的 SHA-256：忽略 BOM、单元格首尾空白、行尾空单元格和空行"""
+    text = data.decode('utf-8-sig', errors='replace')
+    return rows_digest(csv.reader(io.StringIO(text)))
+
+
+def rows_digest(rows):
+    """同 sheet_digest，输入为已读出的单元格行（如直接读 XLS 得到的行，与其转成 CSV 后的哈希相同）"""
+    h = hashlib.sha256()
+    for row in rows:
+        cells = [c.strip() for c in row]
+        while cells and not cells[-1]:
+            cells.pop()
+        if cells:
+            h.update('\x1f'.join(cells).encode('utf-8'))
+            h.update(b'\n')
+    return h.hexdigest()
+
+
+class Manifest:
+    def __init__(self, path):
+        self.path = path
+        self.hashes = {}
+        self.pending = set()
+        self.changed = 0
+        self.unsaved = 0
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.hashes = data.get('hashes', {})
+            self.pending = set(data.get('pending', []))
+
+    def update(self, student_id, digest):
+        """记录最新哈希，新增或变化时加入 pending 并返回 True"""
+        if self.hashes.get(student_id) == digest:
+            return False
+        self.hashes[student_id] = digest
+        self.pending.add(student_id)
+        self.changed += 1
+        self.unsaved += 1
+        return True
+
+    def clear(self, student_ids):
+        self.pending.difference_update(student_ids)
+
+    def save(self):
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': 1, 'hashes': self.hashes, 'pending': sorted(self.pending)}, f,
+                      ensure_ascii=False, separators=(',', ':'))
+        os.replace(temp_path, self.path)
+        self.unsaved = 0
@@ -7,7 +7,6 @@
 import os
 import re
 import argparse
-import zipfile
 import concurrent.futures
 from collections import defaultdict
 from sqlalchemy import create_engine, Column, String, Float
@@ -15,15 +14,21 @@ from sqlalchemy.orm import sessionmaker, declarative_base
 from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy import SmallInteger
 
-from parse_schedule import parse_html, normalize_punct
+import bulk_loader
+import compact_course
+import pinyin_cache
+from grade_manager import CourseStats, StudentDoc, refresh_course_stats, refresh_student_docs
+from parse_schedule import parse_html, normalize_punct, teacher_pinyin
+from zip_reader import ZipReader
 
 
-# 进程池 worker：每个子进程打开一次 ZIP，复用句柄
+# 进程池 worker：每个子进程打开一次 ZIP（mmap，见 zip_reader），复用映射
 _zf = None
 
-def _init_worker(zip_path):
+def _init_worker(zip_path, pinyin_known=None):
     global _zf
-    _zf = zipfile.ZipFile(zip_path, 'r')
+    _zf = ZipReader(zip_path)
+    pinyin_cache.preload(pinyin_known)
 
 def _parse_one(filename):
     html = _zf.read(filename).decode('utf-8', errors='ignore')
@@ -74,24 +79,30 @@ def main():
     parser.add_argument('--workers', type=int, default=os.cpu_count(), help='并发进程数（默认CPU核心数）')
     parser.add_argument('--batch-size', type=int, default=10000, help='每批写入条数')
     parser.add_argument('--dry-run', action='store_true', help='只解析不写入，预览结果')
+    parser.add_argument('--loader', choices=['copy', 'insert'], default='copy',
+                        help='写入方式：copy（COPY+集合式Upsert，一次写完）或 insert（按 --batch-size 分批 INSERT）')
+    parser.add_argument('--pinyin-dict', help='持久化拼音字典（JSON），预置到解析进程，解析后合并新教师名')
     args = parser.parse_args()
+    if args.pinyin_dict:
+        print(f"🔤 拼音字典: {pinyin_cache.load(args.pinyin_dict)} 条")
 
     # 1. 列出ZIP中所有HTML文件名
     print(f"📂 加载 ZIP: {args.zip}")
-    with zipfile.ZipFile(args.zip, 'r') as zf_main:
+    with ZipReader(args.zip) as zf_main:
         html_files = [f for f in zf_main.namelist() if f.endswith('.html')]
     total_files = len(html_files)
     print(f"   共 {total_files} 个 HTML 文件")
 
     # 2. 多进程并发解析（CPU密集型，用ProcessPoolExecutor）
     update_records = []
+    learned = {}
     success = 0
     empty = 0
     fail = 0
     skip_term = 0
 
     print(f"🔄 使用 {args.workers} 个进程并发解析...")
-    with concurrent.futures.ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker, initargs=(args.zip,)) as executor:
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker, initargs=(args.zip, pinyin_cache.known())) as executor:
         futures = {
             executor.submit(_parse_one, filename): filename
             for filename in html_files
@@ -129,12 +140,16 @@ def main():
                             'c_credit': 0, 'c_pass': 0,
                             'c_teacher': teacher_py,
                         })
+                if args.pinyin_dict:
+                    learned.update(teacher_pinyin(courses))
                 success += 1
             except Exception as e:
                 fail += 1
 
     print(f"\n✅ 解析完成: 有课 {success}, 空 {empty}, 失败 {fail}, 学期无法转换 {skip_term}")
     print(f"   待写入记录数: {len(update_records)}")
+    if args.pinyin_dict:
+        print(f"🔤 拼音字典新增 {pinyin_cache.save(args.pinyin_dict, learned)} 条")
 
     if not update_records:
         print("⚠️ 没有可更新的记录")
@@ -162,6 +177,8 @@ def main():
                            max_overflow=DB_MAX_OVERFLOW, pool_recycle=DB_POOL_RECYCLE,
                            pool_pre_ping=True)
     Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    CourseStats.__table__.create(bind=engine, checkfirst=True)
+    StudentDoc.__table__.create(bind=engine, checkfirst=True)
     session = Session()
 
     try:
@@ -169,19 +186,45 @@ def main():
         batch_size = args.batch_size
         print(f"📚 正在写入教师信息 ({total} 条)...")
 
-        for i in range(0, total, batch_size):
-            batch = update_records[i:i+batch_size]
-            stmt = pg_insert(CourseScore).values(batch)
-            update_stmt = stmt.on_conflict_do_update(
-                index_elements=['s_id', 'c_term', 'c_name'],
-                set_={'c_teacher': stmt.excluded.c_teacher}
-            )
-            session.execute(update_stmt)
-            done = min(i + batch_size, total)
-            print(f"\r   写入进度: {done}/{total} ({done*100//total}%)", end="", flush=True)
+        # 记下任课教师有变化（或新插入）的行，写完后只重算这些 课程/学期 的分教师统计和这些学生的文档
+        changed = set()
+        students = set()
+        columns = ('s_id', 'c_term', 'c_name', 'c_score', 'c_type', 'c_hours', 'c_credit', 'c_pass', 'c_teacher')
+        if compact_course.is_compact(session):
+            # 紧凑存储：经课程名字典写入 course_score_compact，返回的键已映射回课程名和学期文本
+            print("🗜️ course_score 为紧凑存储，经课程名字典写入")
+            keys = compact_course.upsert(session, update_records, args.loader, columns=columns,
+                                         update=('c_teacher',), batch_size=batch_size)
+            changed = {(c_name, c_term) for _, c_term, c_name in keys}
+            students = {s_id for s_id, _, _ in keys}
+        elif args.loader == 'copy':
+            # 一次 COPY 进暂存表，再用一条语句合并，只更新 c_teacher
+            keys = bulk_loader.upsert(session.connection().connection, 'course_score', update_records,
+                                      columns=columns, update=('c_teacher',), returning=True)
+            changed = {(c_name, c_term) for _, c_term, c_name in keys}
+            students = {s_id for s_id, _, _ in keys}
+        else:
+            for i in range(0, total, batch_size):
+                batch = update_records[i:i+batch_size]
+                stmt = pg_insert(CourseScore).values(batch)
+                update_stmt = stmt.on_conflict_do_update(
+                    index_elements=['s_id', 'c_term', 'c_name'],
+                    set_={'c_teacher': stmt.excluded.c_teacher},
+                    where=CourseScore.c_teacher.is_distinct_from(stmt.excluded.c_teacher)
+                ).returning(CourseScore.s_id, CourseScore.c_term, CourseScore.c_name)
+                for s_id, c_term, c_name in session.execute(update_stmt):
+                    changed.add((c_name, c_term))
+                    students.add(s_id)
+                done = min(i + batch_size, total)
+                print(f"\r   写入进度: {done}/{total} ({done*100//total}%)", end="", flush=True)
+
+        print(f"\n📊 正在刷新课程统计（{len(changed)} 个课程/学期组）...")
+        refresh_course_stats(session, changed)
+        print(f"📄 正在重建学生文档（{len(students)} 名学生）...")
+        refresh_student_docs(session, students)
 
         session.commit()
-        print(f"\n✅ 写入完成: 共 {total} 条")
+        print(f"\n✅ 写入完成: 共 {total} 条，{len(changed)} 个课程/学期组的任课教师有变化")
 
     except Exception as e:
         session.rollback()
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+下载 → 解析 → 入库 流水线：作为 batch_downloader 的输出端（--ingest），
+成绩单下载完成后直接在进程池中解析（原始 XLS 直接交给 sheet_parser，不先转 CSV），按批 Upsert 到数据库，全部提交后计算一次排名。
+各阶段之间是有界队列：入库慢时解析等待，解析慢时下载等待，整体速度取决于最慢的一段而不是各段之和。
+on_commit 在每批提交后才报告其中的学号（无效成绩单解析后即报告），任务日志据此标记完成。
+"""
+import time
+import asyncio
+import concurrent.futures
+
+import sheet_parser
+from grade_manager import GradeManager
+from grade_manifest import rows_digest, sheet_digest
+from columnar import CourseColumns
+
+
+def parse_sheet(data, digest=None):
+    """进程池任务：解析一份成绩单（XLS/CSV 字节），返回 (student, courses, 哈希)；
+    未给出哈希时按读出的单元格计算，与转成 CSV 后的 sheet_digest 相同"""
+    try:
+        rows = sheet_parser.read_rows(data)
+        if digest is None and rows:
+            digest = rows_digest(rows) if data.startswith(sheet_parser.XLS_MAGIC) else sheet_digest(data)
+        student, courses = sheet_parser.parse_rows(rows)
+    except MemoryError:
+        raise
+    except Exception:
+        # 内容本身读不出来（例如损坏的 XLS）才算无效成绩单；进程池故障由调用方按入库失败处理
+        return None, None, digest
+    return student, courses, digest
+
+
+class IngestSink:
+    # put() 接收下载到的原始 XLS，解析进程直接读取，省去 XLS→CSV 转换
+    raw_xls = True
+
+    def __init__(self, manager=None, parse_workers=2, batch_size=2000, flush_interval=5.0, queue_size=1000):
+        self.manager = manager
+        self.parse_workers = parse_workers
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue_size = queue_size
+        self._seen = set()
+        self._raw = None
+        self._parsed = None
+        self._parsers = []
+        self._writer = None
+        self._parse_pool = None
+        self.error = None
+        self.on_commit = None
+        # 单线程执行器：数据库写入串行进行，不阻塞事件循环
+        self._db_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.stats = {'received': 0, 'parsed': 0, 'invalid': 0, 'written': 0, 'courses': 0, 'batches': 0,
+                      'parse_busy': 0.0, 'write_busy': 0.0}
+
+    def has(self, student_id):
+        return student_id in self._seen
+
+    def finished(self):
+        return set(self._seen)
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        if self.manager is None:
+            # 建连接、建表是阻塞操作，放到写入线程里做
+            self.manager = await loop.run_in_executor(self._db_executor, GradeManager)
+        self._raw = asyncio.Queue(self.queue_size)
+        self._parsed = asyncio.Queue(self.queue_size)
+        self._parse_pool = concurrent.futures.ProcessPoolExecutor(max_workers=self.parse_workers)
+        self._parsers = [asyncio.ensure_future(self._parse_loop()) for _ in range(self.parse_workers * 2)]
+        self._writer = asyncio.ensure_future(self._write_loop())
+
+    async def put(self, student_id, data, digest=None):
+        if self.error is not None:
+            raise RuntimeError(f"入库失败，停止接收: {self.error}")
+        self._seen.add(student_id)
+        self.stats['received'] += 1
+        await self._raw.put((student_id, data, digest))
+
+    def _commit(self, entries):
+        if entries and self.on_commit:
+            self.on_commit(entries)
+
+    async def _parse_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self._raw.get()
+            if item is None:
+                return
+            if self.error is not None:
+                # 入库已失败，只排空队列
+                continue
+            student_id, data, digest = item
+            t0 = time.perf_counter()
+            try:
+                student, courses, digest = await loop.run_in_executor(self._parse_pool, parse_sheet, data, digest)
+            except Exception as e:
+                # 进程崩溃（BrokenProcessPool）、内存不足、序列化失败等不是成绩单无效：不提交该学号，
+                # 按入库失败停止接收，在途学号在日志中保持未完成，续传时重新下载
+                self.error = e
+                continue
+            self.stats['parse_busy'] += time.perf_counter() - t0
+            entry = (student_id, len(data), digest)
+            if not student:
+                self.stats['invalid'] += 1
+                self._commit([entry])
+                continue
+            self.stats['parsed'] += 1
+            await self._parsed.put((entry, student, courses))
+
+    async def _write_loop(self):
+        loop = asyncio.get_running_loop()
+        entries, students, courses = [], [], CourseColumns()
+        deadline = loop.time() + self.flush_interval
+        done = False
+        while not done:
+            try:
+                item = await asyncio.wait_for(self._parsed.get(), max(0.0, deadline - loop.time()))
+                if item is None:
+                    done = True
+                elif self.error is None:
+                    entries.append(item[0])
+                    students.append(item[1])
+                    courses.extend(item[2])
+            except asyncio.TimeoutError:
+                pass
+            # 攒够一批、到达刷新间隔或结束时写入
+            if students and (done or len(students) >= self.batch_size or loop.time() >= deadline):
+                t0 = time.perf_counter()
+                try:
+                    await loop.run_in_executor(self._db_executor, self.manager.write_batch, students, courses)
+                except Exception as e:
+                    # 写入失败后继续排空队列，避免上游阻塞；put 会把错误抛给下载端
+                    self.error = e
+                self.stats['write_busy'] += time.perf_counter() - t0
+                if self.error is None:
+                    self.stats['written'] += len(students)
+                    self.stats['courses'] += len(courses)
+                    self.stats['batches'] += 1
+                    self._commit(entries)
+                entries, students, courses = [], [], CourseColumns()
+            if loop.time() >= deadline:
+                deadline = loop.time() + self.flush_interval
+
+    async def close(self):
+        """排空各阶段队列，写完最后一批后计算排名；写入出错时抛出该错误"""
+        if self._raw is None:
+            self._db_executor.shutdown()
+            return
+        for _ in self._parsers:
+            await self._raw.put(None)
+        await asyncio.gather(*self._parsers)
+        await self._parsed.put(None)
+        await self._writer
+        self._parse_pool.shutdown()
+        self._raw = None
+        loop = asyncio.get_running_loop()
+        try:
+            if self.error is not None:
+                raise self.error
+            if self.stats['written']:
+                await loop.run_in_executor(self._db_executor, self.manager.run_ranking)
+        finally:
+            self._db_executor.shutdown()
+
+    def report(self):
+        s = self.stats
+        return (f"接收 {s['received']} | 解析 {s['parsed']}（无效 {s['invalid']}） | "
+                f"入库学生 {s['written']} 课程 {s['courses']}（{s['batches']} 批） | "
+                f"解析累计 {s['parse_busy']:.1f}s | 写入耗时 {s['write_busy']:.1f}s")
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地模拟报表服务器：模拟 showReport.jsp（返回 report1_cachedId / reportParamsId / t_i_m_e）
+和 reportServlet（返回按学号生成的成绩单 XLS），可配置延迟分布、错误率和 429 突发，
+用于离线压测 batch_downloader，不向教务系统发请求。
+用法: python mock_report_server.py --port 18080 --show-latency lognormal:40,0.5 --error-rate 0.01
+      python batch_downloader.py --base-url http://127.0.0.1:18080/qzbb ...
+"""
+import io
+import time
+import random
+import asyncio
+import argparse
+import itertools
+from collections import OrderedDict
+from aiohttp import web
+
+try:
+    import xlwt
+except ImportError:
+    xlwt = None
+
+COLLEGES = ['计算机与网络安全学院', '能源学院', '地球科学学院', '管理科学学院']
+COURSES = ['高等数学', '线性代数', '大学英语', '大学物理', '程序设计基础', '数据结构', '概率论与数理统计',
+           '离散数学', '操作系统', '计算机网络', '数据库原理', '软件工程', '编译原理', '形势与政策']
+SURNAMES = '王李张刘陈杨黄赵吴周徐孙马朱胡郭何高林罗'
+GIVEN = '伟芳娜秀英敏静丽强磊军洋勇艳杰娟涛明超兰霞平刚桂'
+
+
+def parse_latency(spec):
+    """
+    延迟分布（毫秒）→ 采样函数（秒）：
+    const:20 | uniform:10,50 | exp:30（均值） | lognormal:40,0.5（中位数, sigma）
+    """
+    kind, _, args = spec.partition(':')
+    vals = [float(v) for v in args.split(',')] if args else []
+    if kind == 'const':
+        return lambda rng: vals[0] / 1000
+    if kind == 'uniform':
+        return lambda rng: rng.uniform(vals[0], vals[1]) / 1000
+    if kind == 'exp':
+        return lambda rng: rng.expovariate(1 / vals[0]) / 1000
+    if kind == 'lognormal':
+        import math
+        mu = math.log(vals[0])
+        return lambda rng: rng.lognormvariate(mu, vals[1]) / 1000
+    raise ValueError(f"无法识别的延迟分布: {spec}")
+
+
+def build_sheet_rows(student_id):
+    """按学号确定性生成与真实成绩单相同版式的单元格 {(行, 列): 值}"""
+    rng = random.Random(student_id)
+    cells = {}
+    s_class = f"{student_id[:4]}{rng.randint(1000, 1099):04d}{rng.randint(1, 6):02d}"
+    cells[(1, 2)] = rng.choice(COLLEGES)
+    cells[(1, 10)] = s_class
+    cells[(1, 13)] = student_id
+    cells[(2, 2)] = f"专业{s_class[4:8]}"
+    cells[(2, 10)] = student_id[:4]
+    cells[(2, 13)] = rng.choice(SURNAMES) + ''.join(rng.choice(GIVEN) for _ in range(rng.randint(1, 2)))
+    year = int(student_id[:4]) if student_id[:4].isdigit() else 2022
+    courses = rng.sample(COURSES, rng.randint(8, len(COURSES)))
+    total = 0.0
+    for i, name in enumerate(courses):
+        row, col = 7 + i // 2, 0 if i % 2 == 0 else 8
+        score = round(rng.uniform(45, 99), 1)
+        total += score
+        cells[(row, col)] = f"{year + i % 4}{'01' if i % 3 else '02'}"
+        cells[(row, col + 1)] = name
+        cells[(row, col + 3)] = rng.choice(['必修', '必修', '选修'])
+        cells[(row, col + 4)] = float(rng.choice([32, 48, 64]))
+        cells[(row, col + 5)] = float(rng.choice([1, 2, 3, 4]))
+        cells[(row, col + 6)] = score
+        cells[(row, col + 7)] = '补考' if score < 60 and rng.random() < 0.5 else ''
+    cells[(61, 6)] = round(total / len(courses), 2)
+    cells[(61, 14)] = round(rng.uniform(1.5, 4.5), 2)
+    return cells
+
+
+def build_xls(student_id):
+    wb = xlwt.Workbook(encoding='utf-8')
+    ws = wb.add_sheet('成绩单')
+    for (row, col), value in build_sheet_rows(student_id).items():
+        ws.write(row, col, value)
+    buf = io.BytesIO()
+    wb.save(buf)
+    return buf.getvalue()
+
+
+class MockReportServer:
+    def __init__(self, show_latency='const:0', servlet_latency='const:0', error_rate=0.0,
+                 burst_every=0.0, burst_duration=0.0, burst_rate=1.0, template=None, seed=None, cache_size=100000):
+        self.show_latency = parse_latency(show_latency)
+        self.servlet_latency = parse_latency(servlet_latency)
+        self.error_rate = error_rate
+        self.burst_every = burst_every
+        self.burst_duration = burst_duration
+        self.burst_rate = burst_rate
+        self.rng = random.Random(seed)
+        self.cache_size = cache_size
+        self.template = None
+        if template:
+            with open(template, 'rb') as f:
+                self.template = f.read()
+        elif xlwt is None:
+            raise RuntimeError("未安装 xlwt，请 pip install xlwt 或用 --template 指定一个 XLS 样本")
+        self._reports = OrderedDict()   # cachedId -> 学号，模拟服务端报表缓存
+        self._ids = itertools.count(1)
+        self._started = time.monotonic()
+        self.stats = {'show': 0, 'servlet': 0, '429': 0, '5xx': 0}
+
+    def _fault(self):
+        """按配置返回需要注入的错误状态码，没有则返回 None"""
+        if self.burst_every and (time.monotonic() - self._started) % self.burst_every < self.burst_duration:
+            if self.rng.random() < self.burst_rate:
+                self.stats['429'] += 1
+                return 429
+        if self.error_rate and self.rng.random() < self.error_rate:
+            self.stats['5xx'] += 1
+            return self.rng.choice([502, 503, 504])
+        return None
+
+    async def show_report(self, request):
+        await asyncio.sleep(self.show_latency(self.rng))
+        status = self._fault()
+        if status:
+            return web.Response(status=status)
+        form = await request.post()
+        student_id = form.get('xsxh', '')
+        self.stats['show'] += 1
+        cached_id = f"A_{next(self._ids)}"
+        self._reports[cached_id] = student_id
+        if len(self._reports) > self.cache_size:
+            self._reports.popitem(last=False)
+        html = (f'<script>var report1_cachedId = "{cached_id}";</script>'
+                f'<form><input type=hidden name=reportParamsId value={self.rng.randint(100000, 999999)}>'
+                f'<a href="reportServlet?t_i_m_e={int(time.time() * 1000)}">导出</a></form>')
+        return web.Response(text=html, content_type='text/html')
+
+    async def report_servlet(self, request):
+        await asyncio.sleep(self.servlet_latency(self.rng))
+        status = self._fault()
+        if status:
+            return web.Response(status=status)
+        student_id = self._reports.get(request.query.get('cachedId', ''))
+        if student_id is None:
+            return web.Response(status=404, text='report expired')
+        self.stats['servlet'] += 1
+        body = self.template if self.template else build_xls(student_id)
+        return web.Response(body=body, content_type='application/vnd.ms-excel')
+
+    def make_app(self):
+        app = web.Application()
+        app.router.add_post('/qzbb/reportJsp/showReport.jsp', self.show_report)
+        app.router.add_get('/qzbb/reportServlet', self.report_servlet)
+        return app
+
+
+def add_server_args(parser):
+    parser.add_argument('--show-latency', default='lognormal:30,0.4', help='showReport.jsp 延迟分布（毫秒）')
+    parser.add_argument('--servlet-latency', default='lognormal:60,0.5', help='reportServlet 延迟分布（毫秒）')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='随机 502/503/504 比例')
+    parser.add_argument('--burst-every', type=float, default=0.0, help='每隔多少秒出现一次 429 突发（0=关闭）')
+    parser.add_argument('--burst-duration', type=float, default=2.0, help='每次 429 突发持续秒数')
+    parser.add_argument('--burst-rate', type=float, default=0.8, help='突发期间返回 429 的比例')
+    parser.add_argument('--template', help='固定返回的 XLS 样本（不用 xlwt 生成；未安装 xlwt 时必须指定）')
+    parser.add_argument('--seed', type=int, help='随机种子')
+
+
+def server_from_args(args):
+    return MockReportServer(args.show_latency, args.servlet_latency, args.error_rate,
+                            args.burst_every, args.burst_duration, args.burst_rate, args.template, args.seed)
+
+
+def serve(server, host, port):
+    web.run_app(server.make_app(), host=host, port=port, print=None, access_log=None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地模拟报表服务器')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=18080)
+    add_server_args(parser)
+    args = parser.parse_args()
+    server = server_from_args(args)
+    print(f"🧪 模拟报表服务器: http://{args.host}:{args.port}/qzbb")
+    serve(server, args.host, args.port)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,16 @@
 """
 解析 viewtable.do 返回的课表 HTML，提取每门课的教师信息。
 支持: 单个HTML文件、目录、ZIP文件（不解压直接读取）
-用法: python parse_schedule.py <html文件|目录|zip文件> [--workers N]
+用法: python parse_schedule.py <html文件|目录|zip文件> [--workers N] [--pinyin-dict pinyin_dict.json]
 """
 import re
 import sys
 import os
-import zipfile
 from concurrent.futures import ProcessPoolExecutor, as_completed
 from bs4 import BeautifulSoup
-from pypinyin import pinyin, Style
+
+import pinyin_cache
+from zip_reader import ZipReader
 
 
 def normalize_punct(s):
@@ -28,8 +29,18 @@ def name_to_py(name):
         return name  # 单字姓名，直接返回
     surname = name[0]  # 姓氏保留中文
     given = name[1:]   # 名字转拼音首字母
-    given_py = ''.join(p[0] for p in pinyin(given, style=Style.FIRST_LETTER))
-    return surname + given_py
+    return surname + pinyin_cache.initials(given)
+
+
+def teacher_pinyin(courses):
+    """课程中全部教师名字部分 → 拼音首字母，供合并进持久化拼音字典"""
+    mapping = {}
+    for c in courses:
+        for name in c['teachers']:
+            given = name.strip()[1:]
+            if given and given not in mapping:
+                mapping[given] = pinyin_cache.initials(given)
+    return mapping
 
 
 def parse_student_info(soup):
@@ -178,15 +189,11 @@ def format_result(filename, student, courses):
     return '\n'.join(lines)
 
 
-def load_from_zip(zip_path):
-    """从 ZIP 文件中读取所有 HTML，返回 [(filename, html_str), ...]"""
-    items = []
-    with zipfile.ZipFile(zip_path, 'r') as zf:
-        for name in zf.namelist():
-            if name.endswith('.html'):
-                html = zf.read(name).decode('utf-8', errors='ignore')
-                items.append((name, html))
-    return items
+def load_from_zip(zip_path, threads=None):
+    """从 ZIP 文件中读取所有 HTML（多线程并发解压，见 zip_reader），返回 [(filename, html_str), ...]"""
+    with ZipReader(zip_path) as zf:
+        names = [name for name in zf.namelist() if name.endswith('.html')]
+        return [(name, data.decode('utf-8', errors='ignore')) for name, data in zf.read_many(names, threads)]
 
 
 def load_from_dir(dir_path):
@@ -328,7 +335,10 @@ def main():
     parser.add_argument('--workers', type=int, default=os.cpu_count(), help='并发进程数（默认CPU核心数）')
     parser.add_argument('--stats', action='store_true', default=True, help='只输出统计（默认）')
     parser.add_argument('--detail', action='store_true', help='输出每个学生的详细课表')
+    parser.add_argument('--pinyin-dict', help='持久化拼音字典（JSON），预置到解析进程，解析后合并新教师名')
     args = parser.parse_args()
+    if args.pinyin_dict:
+        print(f"拼音字典: {pinyin_cache.load(args.pinyin_dict)} 条")
 
     workers = args.workers
 
@@ -363,7 +373,8 @@ def main():
         return
 
     print(f"使用 {workers} 个进程并发解析...")
-    with ProcessPoolExecutor(max_workers=workers) as executor:
+    with ProcessPoolExecutor(max_workers=workers, initializer=pinyin_cache.preload,
+                             initargs=(pinyin_cache.known(),)) as executor:
         futures = {executor.submit(_worker, item): item[0] for item in items}
         for future in as_completed(futures):
             fname = futures[future]
@@ -382,6 +393,11 @@ def main():
 
     print(f"\n文件统计: 共 {len(items)} 个, 有课 {success}, 空 {empty}, 失败 {fail}")
     print_stats(all_results)
+    if args.pinyin_dict:
+        learned = {}
+        for _, _, courses in all_results:
+            learned.update(teacher_pinyin(courses))
+        print(f"拼音字典新增 {pinyin_cache.save(args.pinyin_dict, learned)} 条")
 
 
 if __name__ == '__main__':
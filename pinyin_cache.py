@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+拼音首字母转换（grade_manager 的学生姓名、parse_schedule 的教师姓名共用）：
+- 有上限的 LRU 缓存：同一个教师名在几十万个课表页里只转换一次（每个进程）
+- 可选的持久化字典（JSON，姓名哈希 → 首字母）：由父进程加载后作为进程池 initializer 参数预置到各子进程，
+  子进程里已知的姓名一次 pypinyin 调用都不需要；导入结束后把新出现的姓名合并回字典。
+  字典里只存姓名的 BLAKE2b 哈希，不含明文姓名；但首字母和哈希仍可被枚举常见姓名还原，按敏感数据保管（已在 .gitignore 中）
+- pypinyin 延迟到第一次未命中时才导入，命令行启动和全命中的进程不加载它的词典
+用法: python pinyin_cache.py pinyin_dict.json            # 查看字典条目数
+      python pinyin_cache.py pinyin_dict.json 张三 李四   # 转换并写入字典
+"""
+import os
+import sys
+import json
+import hashlib
+import functools
+
+CACHE_SIZE = 65536
+FORMAT_VERSION = 2
+
+_known = {}      # 持久化字典中的条目（姓名哈希 → 首字母，加载或预置）
+_pinyin = None   # 延迟导入的 pypinyin.pinyin 及 Style.FIRST_LETTER
+
+
+def _convert(text):
+    global _pinyin
+    if _pinyin is None:
+        from pypinyin import pinyin, Style
+        _pinyin = (pinyin, Style.FIRST_LETTER)
+    pinyin, style = _pinyin
+    return ''.join(p[0] for p in pinyin(text, style=style))
+
+
+def _key(text):
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=12).hexdigest()
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def initials(text):
+    """拼音首字母，如 张三 → zs（非汉字原样保留）"""
+    hit = _known.get(_key(text)) if _known else None
+    if hit is not None:
+        return hit
+    return _convert(text)
+
+
+def preload(mapping):
+    """预置字典条目（known() 的结果，进程池 initializer 用）"""
+    if mapping:
+        _known.update(mapping)
+        initials.cache_clear()
+
+
+def known():
+    """当前已知的全部条目，作为 initargs 传给子进程"""
+    return dict(_known)
+
+
+def load(path):
+    """加载持久化字典，文件不存在时视为空，返回条目数；旧版明文字典（姓名 → 首字母）载入时转为哈希，下次保存即覆盖"""
+    if path and os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('version') == FORMAT_VERSION:
+            preload(data['entries'])
+        else:
+            preload({_key(text): value for text, value in data.items()})
+    return len(_known)
+
+
+def save(path, mapping=None):
+    """把 mapping（文本 → 首字母）以哈希合并进字典并原子写回，返回新增条目数"""
+    added = 0
+    for text, value in (mapping or {}).items():
+        if not text:
+            continue
+        key = _key(text)
+        if _known.get(key) != value:
+            _known[key] = value
+            added += 1
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump({'version': FORMAT_VERSION, 'entries': _known}, f, sort_keys=True, separators=(',', ':'))
+    os.replace(temp_path, path)
+    return added
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    path, names = sys.argv[1], sys.argv[2:]
+    print(f"📖 {path}: {load(path)} 条")
+    if names:
+        mapping = {n: initials(n) for n in names}
+        for n, v in mapping.items():
+            print(f"   {n} → {v}")
+        print(f"💾 新增 {save(path, mapping)} 条")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+单个学生即时刷新：下载 → 解析 → Upsert → 只重算其所在专业的排名。
+常驻进程复用已建立的出口连接池和数据库连接池，单次刷新通常 1~2 秒内完成。
+用法: python refresh_service.py --port 18100            # HTTP 服务：GET/POST /refresh/<学号>
+      python refresh_service.py 202212345678             # 只刷新一次
+库用法:
+    service = RefreshService(); await service.start()
+    result = await service.refresh('202212345678')
+"""
+import sys
+import time
+import asyncio
+import argparse
+from aiohttp import web
+
+import batch_downloader as bd
+from grade_manager import GradeManager, parse_grade_sheet
+
+
+class RefreshError(Exception):
+    """刷新失败，status 为对外返回的 HTTP 状态码"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class RefreshService:
+    def __init__(self, use_proxy=None, concurrency=8, proxies=None):
+        self.use_proxy = bd.USE_PROXY if use_proxy is None else use_proxy
+        self.concurrency = concurrency
+        self.proxies = proxies
+        self.pool = None
+        self.manager = None
+        self._semaphore = None
+        self._inflight = {}   # 学号 -> Future，同一学号的并发请求合并为一次刷新
+        self.stats = {'ok': 0, 'failed': 0, 'merged': 0}
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        self.pool = bd.make_pool(self.use_proxy, self.concurrency, self.proxies)
+        await self.pool.start()
+        # 建连接池、建表是阻塞操作，放到线程里；之后的刷新都复用这个引擎
+        self.manager = await loop.run_in_executor(None, GradeManager)
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+
+    async def close(self):
+        if self.pool:
+            await self.pool.close()
+        if self.manager:
+            self.manager.engine.dispose()
+
+    async def refresh(self, student_id):
+        """刷新一个学号，返回 {'s_id', 's_name', 'courses', 'ranks', 'timing_ms'}，失败抛出 RefreshError"""
+        if not student_id.isdigit():
+            raise RefreshError(400, f"学号格式不正确: {student_id}")
+        future = self._inflight.get(student_id)
+        if future is not None:
+            self.stats['merged'] += 1
+            return await asyncio.shield(future)
+        future = asyncio.ensure_future(self._refresh(student_id))
+        self._inflight[student_id] = future
+        future.add_done_callback(lambda f: self._inflight.pop(student_id, None))
+        try:
+            result = await asyncio.shield(future)
+        except Exception:
+            self.stats['failed'] += 1
+            raise
+        self.stats['ok'] += 1
+        return result
+
+    async def _refresh(self, student_id):
+        loop = asyncio.get_running_loop()
+        timing = {}
+        t0 = time.perf_counter()
+        async with self._semaphore:
+            try:
+                # 每次请求单独借出口，某个代理连接失败时重试会换到其他出口
+                content = await bd.fetch_excel(self.pool, student_id)
+            except bd.FetchError as e:
+                raise RefreshError(502, f"下载失败: {e}") from e
+            timing['download'] = time.perf_counter() - t0
+
+            # 单份成绩单的解析只需几毫秒，直接在事件循环内完成；XLS 字节直接解析，不再转成 CSV
+            t1 = time.perf_counter()
+            try:
+                student, courses = parse_grade_sheet(content)
+            except Exception as e:
+                raise RefreshError(502, f"成绩单格式异常: {e}") from e
+            if not student:
+                raise RefreshError(404, f"成绩单中没有学生信息: {student_id}")
+            if student['s_id'] != student_id:
+                # 返回的若是别人的成绩单，写入会覆盖另一名学生的数据
+                raise RefreshError(502, f"成绩单学号不符: 请求 {student_id}，返回 {student['s_id']}")
+            timing['parse'] = time.perf_counter() - t1
+
+            t2 = time.perf_counter()
+            ranks = await loop.run_in_executor(None, self.manager.refresh_student, student, courses)
+            timing['db'] = time.perf_counter() - t2
+
+        timing['total'] = time.perf_counter() - t0
+        return {
+            's_id': student['s_id'],
+            's_name': student['s_name'],
+            's_class': student['s_class'],
+            's_avg': student['s_avg'],
+            's_gpa': student['s_gpa'],
+            'courses': len(courses),
+            'ranks': ranks,
+            'timing_ms': {k: round(v * 1000, 1) for k, v in timing.items()},
+        }
+
+    async def handle_refresh(self, request):
+        student_id = request.match_info['s_id']
+        try:
+            return web.json_response(await self.refresh(student_id))
+        except RefreshError as e:
+            return web.json_response({'s_id': student_id, 'error': str(e)}, status=e.status)
+        except Exception as e:
+            bd.logger.exception("刷新失败 [%s]", student_id)
+            return web.json_response({'s_id': student_id, 'error': str(e)}, status=500)
+
+    async def handle_health(self, request):
+        return web.json_response({'stats': self.stats, 'inflight': len(self._inflight),
+                                  'egresses': self.pool.report()})
+
+    def make_app(self):
+        app = web.Application()
+        app.router.add_get('/refresh/{s_id}', self.handle_refresh)
+        app.router.add_post('/refresh/{s_id}', self.handle_refresh)
+        app.router.add_get('/health', self.handle_health)
+
+        async def on_startup(app):
+            await self.start()
+
+        async def on_cleanup(app):
+            await self.close()
+
+        app.on_startup.append(on_startup)
+        app.on_cleanup.append(on_cleanup)
+        return app
+
+
+async def refresh_once(student_id, use_proxy=None):
+    service = RefreshService(use_proxy, concurrency=1)
+    await service.start()
+    try:
+        return await service.refresh(student_id)
+    finally:
+        await service.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='单个学生成绩即时刷新服务')
+    parser.add_argument('student_id', nargs='?', help='只刷新这一个学号后退出（不启动服务）')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=18100)
+    parser.add_argument('--proxy', '-p', action='store_true', help='使用代理')
+    parser.add_argument('--proxies', help='逗号分隔的多个代理地址（覆盖 config.PROXIES）')
+    parser.add_argument('--concurrency', type=int, default=8, help='同时进行的刷新数')
+    parser.add_argument('--base-url', default=bd.BASE_URL, help='报表系统地址（可指向 mock_report_server）')
+    args = parser.parse_args()
+    bd.BASE_URL = args.base_url.rstrip('/')
+    use_proxy = args.proxy or bd.USE_PROXY
+
+    if args.student_id:
+        try:
+            result = asyncio.run(refresh_once(args.student_id, use_proxy))
+        except RefreshError as e:
+            print(f"❌ {e}")
+            sys.exit(1)
+        ranks = result['ranks']
+        print(f"✅ {result['s_id']} {result['s_name']} | {result['courses']} 门课程 | "
+              f"班级排名 {ranks.get('class_avg_rank')}/{ranks.get('class_gpa_rank')} | "
+              f"专业排名 {ranks.get('major_avg_rank')}/{ranks.get('major_gpa_rank')} | "
+              f"耗时 {result['timing_ms']['total']}ms")
+        return
+
+    proxies = args.proxies.split(',') if args.proxies else None
+    service = RefreshService(use_proxy, args.concurrency, proxies)
+    print(f"🔁 刷新服务: http://{args.host}:{args.port}/refresh/<学号> | 代理: {'启用' if use_proxy else '禁用'}")
+    web.run_app(service.make_app(), host=args.host, port=args.port, print=None)
+
+
+if __name__ == '__main__':
+    main()
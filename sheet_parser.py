@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+成绩单固定版式解析：按固定版式的行号直接取第1、2行和均分行，课程区的空白行（大多数）整行跳过、不切分字段，
+只有出现带引号的单元格（内含逗号）时才走 csv 模块。
+编码按 BOM / 内容判断（utf-8-sig、utf-16、utf-8，失败再用 gbk），也可直接传入报表系统返回的 XLS 字节，省去 XLS→CSV 往返。
+结果与 grade_manager.GradeParser（原实现，保留作对照）一致，grade_manager.parse_grade_sheet 使用本模块。
+用法: python sheet_parser.py --verify --zip all_grades.zip     # 与原实现逐份对比并计时
+      python sheet_parser.py --verify --count 5000             # 没有真实数据时用 mock_report_server 的版式生成
+"""
+import io
+import os
+import csv
+import sys
+import json
+import time
+import codecs
+import zipfile
+import argparse
+import functools
+
+import pinyin_cache
+
+# 版式：第1、2行为学生信息，第7~60行为两栏课程，第61行为均分/GPA
+INFO_ROW1, INFO_ROW2, STATS_ROW = 1, 2, 61
+COURSE_FIRST_ROW, COURSE_END_ROW = 7, 61
+# 两栏课程各字段的列：学期 课程名 类型 学时 学分 成绩 考试性质
+COURSE_COLUMNS = ((0, 1, 3, 4, 5, 6, 7), (8, 9, 11, 12, 13, 14, 15))
+GRADE_WORDS = {'优': 95.0, '良': 85.0, '中': 75.0, '及格': 65.0, '不及格': 55.0}
+XLS_MAGIC = b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'   # OLE2 复合文档（.xls）
+# 课程名、类型、学时、学分、成绩、考试性质、学院、班级在同一届学生间高度重复，逐单元格的规范化/转换按原始字符串缓存
+CELL_CACHE_SIZE = 65536
+# 空白课程行（两栏都没有课程）：占课程区的大部分，整行比较后直接跳过，不切分字段
+EMPTY_COURSE_LINE = ',' * 15
+
+
+@functools.lru_cache(maxsize=CELL_CACHE_SIZE)
+def _norm(s):
+    """全角ASCII标点 → 半角（同 grade_manager.normalize_punct）"""
+    return s.replace('（', '(').replace('）', ')').replace('：', ':').replace('，', ',')
+
+
+def decode(data):
+    """成绩单字节 → 文本；无法解码时返回 None"""
+    if data.startswith(codecs.BOM_UTF8):
+        encodings = ('utf-8-sig', 'gbk')
+    elif data.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        encodings = ('utf-16',)
+    else:
+        encodings = ('utf-8', 'gbk')
+    for encoding in encodings:
+        try:
+            return data.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    return None
+
+
+def _load(content):
+    if isinstance(content, str):
+        if not os.path.exists(content):
+            return None
+        with open(content, 'rb') as f:
+            return f.read()
+    return content
+
+
+def read_rows(content):
+    """成绩单（CSV/XLS 字节或文件路径）→ 行列表，每行为字符串单元格列表"""
+    content = _load(content)
+    if content is None:
+        return None
+    if content.startswith(XLS_MAGIC):
+        import xlrd
+        sheet = xlrd.open_workbook(file_contents=content).sheet_by_index(0)
+        # 与 XLS→CSV 转换一致：数值单元格按 str() 写出（如 48.0）
+        return [list(map(str, sheet.row_values(i))) for i in range(sheet.nrows)]
+    text = decode(content)
+    if not text:
+        return None
+    return _split_rows(text)
+
+
+def _split_rows(text):
+    if '"' in text:
+        # 有带引号的单元格（内含逗号、引号或换行）时才走 csv 模块
+        return list(csv.reader(io.StringIO(text)))
+    return [line.split(',') for line in text.splitlines()]
+
+
+@functools.lru_cache(maxsize=CELL_CACHE_SIZE)
+def _score(s):
+    try:
+        return float(s)   # float() 自身忽略首尾空白
+    except ValueError:
+        return GRADE_WORDS.get(s.strip(), 0.0)
+
+
+def _credit(s):
+    try:
+        return float(s)
+    except ValueError:
+        if s.strip():
+            raise
+        return 0.0
+
+
+@functools.lru_cache(maxsize=CELL_CACHE_SIZE)
+def _pass_status(s):
+    if not s: return 0
+    if '刷分' in s: return 3
+    if '补考' in s: return 1
+    if '重修' in s: return 2
+    return 0
+
+
+@functools.lru_cache(maxsize=CELL_CACHE_SIZE)
+def _course_head(name, c_type, hours, credit):
+    """
+    课程名/类型/学时/学分的原始单元格（缺列为 None）→ 课程字典模板，学期、成绩、考试性质、学号由调用方在副本上填写；
+    学分异常时抛出 ValueError（异常不缓存）
+    """
+    return {'c_term': None, 'c_name': _norm(name.strip()),
+            'c_type': _norm(c_type.strip()) if c_type is not None else '必修',
+            'c_hours': hours.strip() if hours is not None else '0',
+            'c_credit': _credit(credit) if credit is not None else 0.0,
+            'c_score': None, 'c_pass': None, 's_id': None}
+
+
+def _student(r1, r2, stats):
+    try:
+        s_id = r1[13].strip()
+    except IndexError:
+        return None
+    if not s_id:
+        return None
+    n1, n2 = len(r1), len(r2)
+    info = {
+        's_id': s_id,
+        's_name': r2[13].strip() if n2 > 13 else '未知',
+        's_college': _norm(r1[2].strip()) if n1 > 2 else '未知',
+        's_class': _norm(r1[10].strip()) if n1 > 10 else '未知',
+        's_major': _norm(r2[2].strip()) if n2 > 2 else '未知',
+        's_grade': r2[10].strip() if n2 > 10 else '未知',
+    }
+    if stats is not None:
+        try:
+            avg = stats[6].strip() if len(stats) > 6 else ''
+            gpa = stats[14].strip() if len(stats) > 14 else ''
+            info['s_avg'] = float(avg) if avg else 0.0
+            info['s_gpa'] = float(gpa) if gpa else 0.0
+        except ValueError:
+            return None
+    else:
+        info['s_avg'] = info['s_gpa'] = 0.0
+    info['s_py'] = pinyin_cache.initials(info['s_name'])
+    return info
+
+
+def _courses(rows, s_id):
+    """rows 为课程区的行，首列为空的行跳过"""
+    best = {}
+    (t1, n1, y1, h1, c1, s1, p1), (t2, n2, y2, h2, c2, s2, p2) = COURSE_COLUMNS
+    for row in rows:
+        term = row[t1].strip() if row else ''
+        if not term:
+            continue
+        width = len(row)
+        # 与原实现一致：某一栏数据异常时，该栏及同一行之后的栏跳过，之前已取到的保留；
+        # 同一学期同名课程保留成绩最高的一条（位置按首次出现），成绩不更高的不再构造
+        try:
+            if width >= 7 and row[n1].strip():
+                head = _course_head(row[n1], row[y1], row[h1], row[c1])
+                score = _score(row[s1])
+                key = (term, head['c_name'])
+                old = best.get(key)
+                if old is None or score > old['c_score']:
+                    best[key] = course = head.copy()
+                    course['c_term'] = term
+                    course['c_score'] = score
+                    status = row[p1] if width > p1 else ''
+                    course['c_pass'] = _pass_status(status) if status else 0
+                    course['s_id'] = s_id
+            if width > n2:
+                term = row[t2].strip()
+                if term.isdigit():
+                    head = _course_head(
+                        row[n2], row[y2] if width > y2 else None, row[h2] if width > h2 else None,
+                        row[c2] if width > c2 else None)
+                    score = _score(row[s2]) if width > s2 else 0.0
+                    key = (term, head['c_name'])
+                    old = best.get(key)
+                    if old is None or score > old['c_score']:
+                        best[key] = course = head.copy()
+                        course['c_term'] = term
+                        course['c_score'] = score
+                        status = row[p2] if width > p2 else ''
+                        course['c_pass'] = _pass_status(status) if status else 0
+                        course['s_id'] = s_id
+        except ValueError:
+            pass
+    return list(best.values())
+
+
+def parse(content):
+    """解析一份成绩单（CSV/XLS 字节或文件路径），返回 (student, courses)，课程已带 s_id；无效时返回 (None, None)"""
+    content = _load(content)
+    if not content:
+        return None, None
+    if content.startswith(XLS_MAGIC):
+        return parse_rows(read_rows(content))
+    text = decode(content)
+    if not text:
+        return None, None
+    if '"' in text:
+        return parse_rows(_split_rows(text))
+    # 无引号时只切分用到的行：第1、2行、均分行和课程区中不是空白课程行的行
+    lines = text.splitlines()
+    if len(lines) < 3:
+        return None, None
+    stats = lines[STATS_ROW].split(',') if len(lines) > STATS_ROW else None
+    student = _student(lines[INFO_ROW1].split(','), lines[INFO_ROW2].split(','), stats)
+    return _parsed(student, [line.split(',') for line in lines[COURSE_FIRST_ROW:COURSE_END_ROW]
+                             if line != EMPTY_COURSE_LINE])
+
+
+def parse_rows(rows):
+    """同 parse，输入为 read_rows 的结果"""
+    if not rows or len(rows) < 3:
+        return None, None
+    stats = rows[STATS_ROW] if len(rows) > STATS_ROW else None
+    return _parsed(_student(rows[INFO_ROW1], rows[INFO_ROW2], stats), rows[COURSE_FIRST_ROW:COURSE_END_ROW])
+
+
+def _parsed(student, rows):
+    if not student:
+        return None, None
+    return student, _courses(rows, student['s_id'])
+
+
+def _reference(content):
+    """原实现（grade_manager.GradeParser）的结果，课程同样带 s_id"""
+    from grade_manager import GradeParser
+    student, courses = GradeParser().parse_csv_grade(content)
+    if not student:
+        return None, None
+    return student, [{**c, 's_id': student['s_id']} for c in courses]
+
+
+def verify(samples):
+    """逐份对比两种实现的结果并分别计时（各取三轮最快），返回 (不一致的样本名列表, 原实现耗时, 本模块耗时)"""
+    from grade_manager import GradeParser
+    reference = GradeParser()
+    mismatched = []
+    for name, data in samples:
+        if _reference(data) != parse(data):
+            mismatched.append(name)
+
+    datas = [data for _, data in samples]
+    parse(datas[0])   # 预热拼音缓存，两边都只计解析本身
+    old_time = new_time = float('inf')
+    for _ in range(3):   # 各取三轮中最快的一轮，减少机器抖动的影响
+        t0 = time.perf_counter()
+        for data in datas:
+            reference.parse_csv_grade(data)
+        old_time = min(old_time, time.perf_counter() - t0)
+        t0 = time.perf_counter()
+        for data in datas:
+            parse(data)
+        new_time = min(new_time, time.perf_counter() - t0)
+    return mismatched, old_time, new_time
+
+
+def _mock_samples(count):
+    """mock_report_server 版式的 CSV，外加几种边界样本：GBK 编码、等级制成绩、带引号逗号以外的异常行"""
+    from mock_report_server import build_sheet_rows
+    samples = []
+    for i in range(1, count + 1):
+        sid = f"2022{i:08d}"
+        cells = build_sheet_rows(sid)
+        rows = [[''] * 16 for _ in range(62)]
+        for (r, c), v in cells.items():
+            rows[r][c] = v
+        if i % 7 == 0:
+            rows[8][6] = '良'
+        if i % 11 == 0:
+            rows[9][13] = 'abc'   # 学分异常，整行跳过
+        if i % 13 == 0:
+            rows[10][15] = '重修'
+        buf = io.StringIO()
+        csv.writer(buf).writerows(rows)
+        encoding = 'gbk' if i % 5 == 0 else 'utf-8-sig'
+        samples.append((f"{sid}.csv", buf.getvalue().encode(encoding)))
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description='成绩单固定版式解析：与原实现对比验证')
+    parser.add_argument('--verify', action='store_true', help='与 grade_manager.GradeParser 逐份对比并计时')
+    parser.add_argument('--zip', help='成绩ZIP（不指定则生成模拟数据）')
+    parser.add_argument('--count', type=int, default=5000, help='生成的模拟成绩单数量')
+    parser.add_argument('files', nargs='*', help='直接解析这些 CSV/XLS 文件并输出 JSON')
+    args = parser.parse_args()
+
+    if not args.verify:
+        if not args.files:
+            parser.print_help()
+            sys.exit(1)
+        for path in args.files:
+            student, courses = parse(path)
+            print(json.dumps({'file': path, 'student': student, 'courses': courses}, ensure_ascii=False))
+        return
+
+    if args.zip:
+        with zipfile.ZipFile(args.zip, 'r') as z:
+            samples = [(n, z.read(n)) for n in z.namelist() if n.lower().endswith('.csv')]
+    else:
+        print(f"🧪 生成 {args.count} 个模拟成绩单...")
+        samples = _mock_samples(args.count)
+    if not samples:
+        print("❌ 没有可对比的成绩单")
+        sys.exit(1)
+
+    mismatched, old_time, new_time = verify(samples)
+    n = len(samples)
+    print(f"📊 {n} 份 | 原实现 {old_time / n * 1e6:.1f}µs/份 | 本模块 {new_time / n * 1e6:.1f}µs/份 | "
+          f"加速 {old_time / new_time:.1f}x")
+    if mismatched:
+        print(f"❌ {len(mismatched)} 份结果不一致，例如: {', '.join(mismatched[:10])}")
+        sys.exit(1)
+    print("✅ 全部一致")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""sheet_parser 与原实现 grade_manager.GradeParser 在固定样本上的一致性"""
+import os
+
+import pytest
+
+import sheet_parser
+from grade_manifest import rows_digest, sheet_digest
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures', 'sheets')
+# <样本>.ref.csv：原实现能读的等价版本（原实现只认 utf-8/gbk、按逗号直接切分、不读 XLS）
+SAMPLES = sorted(n for n in os.listdir(FIXTURES) if not n.endswith('.ref.csv'))
+
+
+def _read(name):
+    with open(os.path.join(FIXTURES, name), 'rb') as f:
+        return f.read()
+
+
+def _reference_input(name):
+    ref = os.path.splitext(name)[0] + '.ref.csv'
+    return _read(ref) if os.path.exists(os.path.join(FIXTURES, ref)) else _read(name)
+
+
+@pytest.mark.parametrize('name', SAMPLES)
+def test_matches_grade_parser(name):
+    assert sheet_parser.parse(_read(name)) == sheet_parser._reference(_reference_input(name))
+
+
+@pytest.mark.parametrize('name', SAMPLES)
+def test_path_and_bytes_agree(name):
+    assert sheet_parser.parse(os.path.join(FIXTURES, name)) == sheet_parser.parse(_read(name))
+
+
+def test_special_cells():
+    student, courses = sheet_parser.parse(_read('quoted_comma.csv'))
+    names = {c['c_name'] for c in courses}
+    assert student['s_college'] == '计算机与网络安全学院,软件学院'
+    assert {'高等数学(上),实验', '程序设计(Python,C)'} <= names
+
+    student, courses = sheet_parser.parse(_read('sheet.xls'))
+    assert student['s_id'] == '202200000005'
+    assert any(c['c_pass'] == 2 for c in courses)
+    assert {c['c_score'] for c in courses} >= {95.0, 85.0}
+
+
+def test_xls_digest_matches_csv():
+    # 直接入库时按 XLS 读出的单元格算哈希，须与流式/目录模式转成 CSV 后的哈希一致
+    assert rows_digest(sheet_parser.read_rows(_read('sheet.xls'))) == sheet_digest(_read('sheet.ref.csv'))
+
+
+def test_invalid_sheets():
+    assert sheet_parser.parse(_read('missing_student_id.csv')) == (None, None)
+    assert sheet_parser.parse(b'') == (None, None)
+    assert sheet_parser.parse(os.path.join(FIXTURES, 'no_such_file.csv')) == (None, None)
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+并发读取 ZIP 条目：grade_manager、import_teacher 的解析进程和 parse_schedule.load_from_zip 共用。
+打开时用 zipfile 解析一次中央目录，记下每个条目的本地文件头偏移、压缩方式和长度；之后整个文件 mmap 只读映射，
+read(name) 直接按偏移切出压缩数据解压，没有共享的文件指针，也就不需要锁：
+多个线程可同时读取（zlib 解压和 CRC 计算期间释放 GIL），多个进程映射同一文件时共用页缓存。
+只支持不加密的 STORED / DEFLATED 条目（batch_downloader 生成的ZIP都是 DEFLATED），其他条目退回 zipfile 读取。
+用法: python zip_reader.py all_grades.zip [--threads 8]    # 读取并校验全部条目，输出 MB/s
+"""
+import os
+import sys
+import mmap
+import zlib
+import time
+import struct
+import zipfile
+import argparse
+import threading
+import concurrent.futures
+
+LOCAL_HEADER = struct.Struct('<4s22xHH')   # 签名 … 文件名长度 扩展字段长度（共30字节）
+LOCAL_SIGNATURE = b'PK\x03\x04'
+
+
+class ZipReader:
+    def __init__(self, path):
+        self.path = path
+        with zipfile.ZipFile(path, 'r') as zf:
+            infos = [i for i in zf.infolist() if not i.is_dir()]
+        self._names = [i.filename for i in infos]
+        self._entries = {i.filename: (i.header_offset, i.compress_type, i.compress_size, i.CRC, i.flag_bits & 0x1)
+                         for i in infos}
+        self._file = open(path, 'rb')
+        # 空文件不能 mmap；没有条目时也用不到映射
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if infos else None
+        self._fallback = None
+        self._fallback_lock = threading.Lock()
+
+    def namelist(self):
+        return list(self._names)
+
+    def read(self, name):
+        """读取并解压一个条目（线程安全），CRC 不符时抛出 zipfile.BadZipFile"""
+        offset, method, size, crc, encrypted = self._entries[name]
+        if encrypted or method not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+            return self._read_fallback(name)
+        signature, name_len, extra_len = LOCAL_HEADER.unpack_from(self._map, offset)
+        if signature != LOCAL_SIGNATURE:
+            raise zipfile.BadZipFile(f"本地文件头损坏: {name}")
+        start = offset + LOCAL_HEADER.size + name_len + extra_len
+        data = self._map[start:start + size]
+        if method == zipfile.ZIP_DEFLATED:
+            data = zlib.decompress(data, -zlib.MAX_WBITS)
+        if zlib.crc32(data) != crc:
+            raise zipfile.BadZipFile(f"CRC 校验失败: {name}")
+        return data
+
+    def _read_fallback(self, name):
+        # 加密或 bzip2/lzma 条目：交给 zipfile，同一句柄上的读取串行
+        with self._fallback_lock:
+            if self._fallback is None:
+                self._fallback = zipfile.ZipFile(self.path, 'r')
+            return self._fallback.read(name)
+
+    def read_many(self, names, threads=None):
+        """多线程并发读取，按 names 的顺序逐个产出 (name, bytes)"""
+        threads = threads or os.cpu_count()
+        if threads <= 1:
+            for name in names:
+                yield name, self.read(name)
+            return
+        with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+            yield from zip(names, executor.map(self.read, names))
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+        if self._fallback is not None:
+            self._fallback.close()
+            self._fallback = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ZIP 并发读取：读取并校验全部条目')
+    parser.add_argument('zip', help='ZIP 文件路径')
+    parser.add_argument('--threads', type=int, default=os.cpu_count(), help='读取线程数')
+    args = parser.parse_args()
+    if not os.path.exists(args.zip):
+        print(f"❌ 找不到文件: {args.zip}")
+        sys.exit(1)
+
+    with ZipReader(args.zip) as reader:
+        names = reader.namelist()
+        t0 = time.perf_counter()
+        total = sum(len(data) for _, data in reader.read_many(names, args.threads))
+        elapsed = time.perf_counter() - t0
+    print(f"📦 {len(names)} 个条目 | 解压后 {total / 2**20:.1f}MB | {args.threads} 线程 | "
+          f"{elapsed:.2f}s | {total / 2**20 / max(elapsed, 1e-9):.1f}MB/s")
+
+
+if __name__ == '__main__':
+    main()